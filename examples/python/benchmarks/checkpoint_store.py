@@ -0,0 +1,114 @@
+"""
+比較批量上傳 checkpoint 改用 SQLite 前後的寫入成本與載入時間
+
+舊做法每完成一個檔案就重新讀取並覆寫整個 JSON，單次成本隨已完成數量線性成長，總成本為 O(n²)；
+在大規模下無法實際跑完，因此量測已有 n 筆紀錄時的單次寫入成本，並以 n × 單次成本 / 2 估算總時間。
+新做法每完成一個檔案只寫入一列。
+
+Usage:
+    python -m benchmarks.checkpoint_store --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledges', 'batch_upload'))
+from checkpoint_store import CheckpointStore  # noqa: E402
+
+
+def file_path(i):
+    return f'/data/corpus/department_{i % 100:02d}/document_{i:07d}.pdf'
+
+
+def legacy_save(checkpoint_file, new_path, new_id):
+    """舊版 save_checkpoint：讀取整個 JSON、合併後以 indent=2 覆寫"""
+    with open(checkpoint_file, 'r') as f:
+        existing = json.load(f)
+    completed = set(existing.get('completed_files', []))
+    completed.add(new_path)
+    mapping = existing.get('file_id_mapping', {}).copy()
+    mapping[new_path] = new_id
+    data = {
+        'timestamp': time.time(),
+        'completed_files': list(completed),
+        'file_id_mapping': mapping,
+        'failed_files': existing.get('failed_files', []),
+        'pending_files': [],
+    }
+    with open(checkpoint_file, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def run_legacy(tmp_dir, size, samples):
+    """回傳 (已有 size 筆時的單次寫入秒數, 估算的總秒數, 載入秒數)"""
+    checkpoint_file = os.path.join(tmp_dir, f'legacy_{size}.json')
+    paths = [file_path(i) for i in range(size)]
+    with open(checkpoint_file, 'w') as f:
+        json.dump(
+            {
+                'completed_files': paths,
+                'file_id_mapping': {path: f'kf-{i}' for i, path in enumerate(paths)},
+                'failed_files': [],
+                'pending_files': [],
+            },
+            f,
+            indent=2,
+        )
+
+    start = time.perf_counter()
+    for i in range(samples):
+        legacy_save(checkpoint_file, file_path(size + i), f'kf-{size + i}')
+    per_write = (time.perf_counter() - start) / samples
+
+    start = time.perf_counter()
+    with open(checkpoint_file, 'r') as f:
+        set(json.load(f)['completed_files'])
+    load_seconds = time.perf_counter() - start
+
+    return per_write, per_write * size / 2, load_seconds
+
+
+def run_store(tmp_dir, size):
+    """回傳 (單次寫入秒數, 總秒數, 載入秒數)"""
+    store = CheckpointStore(os.path.join(tmp_dir, f'store_{size}.sqlite3'))
+    start = time.perf_counter()
+    for i in range(size):
+        store.mark_completed(file_path(i), f'kf-{i}')
+    total = time.perf_counter() - start
+    store.close()
+
+    # 重新開啟，模擬中斷後恢復
+    start = time.perf_counter()
+    store = CheckpointStore(os.path.join(tmp_dir, f'store_{size}.sqlite3'))
+    completed = store.completed_paths()
+    load_seconds = time.perf_counter() - start
+    store.close()
+    assert len(completed) == size
+
+    return total / size, total, load_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='已完成檔案數')
+    parser.add_argument('--samples', type=int, default=3, help='舊做法每個規模量測的寫入次數')
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} | {'legacy/write':>12} {'legacy total*':>14} {'legacy load':>12} | "
+          f"{'sqlite/write':>12} {'sqlite total':>13} {'sqlite load':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            legacy_write, legacy_total, legacy_load = run_legacy(tmp_dir, size, args.samples)
+            store_write, store_total, store_load = run_store(tmp_dir, size)
+            print(
+                f'{size:>10,} | {legacy_write * 1000:>10.1f}ms {legacy_total:>13,.0f}s {legacy_load:>11.2f}s | '
+                f'{store_write * 1e6:>10.1f}us {store_total:>12.1f}s {store_load:>11.2f}s'
+            )
+    print('* estimated: n x per-write cost at n entries / 2')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+比較長回應的串流處理成本：逐段 += 串接與每段 write + flush，對照 CompletionStream 與 CoalescingWriter
+
+文字累積：
+- dict += ：把內容累積在回應 dict 的欄位中（message['content'] += delta），每次都複製整個字串，O(n²)
+- local += ：區域變數 text += delta；CPython 在字串只有一個參照時會原地擴充，通常是線性的，但這是實作細節
+- CompletionStream：片段存在 list 中，最後 join 一次
+
+輸出（寫入 os.devnull，每次 flush 都是一次 write 系統呼叫）：
+- 每段 write + flush（chatbot_completion.py 原本的做法）
+- CoalescingWriter：依大小或時間合併後才寫入
+
+Usage:
+    python -m benchmarks.completion_stream --deltas 5000 20000 50000
+"""
+import argparse
+import os
+import random
+import time
+
+from utils.completion_stream import CompletionStream
+
+TOKENS = ['高鐵', '時刻表', ' the', ' train', ' departs', '，', '。', ' at', ' 08:30', '台北', '左營', ' ticket', '\n']
+
+
+def make_events(count):
+    """模擬一個有 count 段內容的串流回應"""
+    rng = random.Random(42)
+    events = [
+        {'conversationId': 'c3f1a2b4', 'content': rng.choice(TOKENS), 'done': False}
+        for _ in range(count)
+    ]
+    events.append({'conversationId': 'c3f1a2b4', 'content': '', 'done': True})
+    return events
+
+
+def accumulate_dict_field(events):
+    message = {'conversationId': None, 'content': ''}
+    for data in events:
+        if data.get('done') is False:
+            message['content'] += data['content']
+    return message['content']
+
+
+def accumulate_local(events):
+    text = ''
+    for data in events:
+        if data.get('done') is False:
+            text += data['content']
+    return text
+
+
+def accumulate_stream(events):
+    return CompletionStream(events).read()
+
+
+def write_each(events, file):
+    for data in events:
+        if 'content' in data and data.get('done') is False:
+            file.write(data['content'])
+            file.flush()
+
+
+def write_coalesced(events, file):
+    CompletionStream(events).write_to(file)
+
+
+class CountingFile:
+    """計算 flush（也就是實際的 write 系統呼叫）次數"""
+
+    def __init__(self, file):
+        self.file = file
+        self.flushes = 0
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def flush(self):
+        self.flushes += 1
+        self.file.flush()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--deltas', type=int, nargs='+', default=[5000, 20000, 50000], help='每個回應的內容片段數')
+    args = parser.parse_args()
+
+    print(f"{'deltas':>8}  {'dict += (ms)':>13}{'local += (ms)':>14}{'CompletionStream (ms)':>22}")
+    for count in args.deltas:
+        events = make_events(count)
+        dict_seconds, expected = timed(accumulate_dict_field, events)
+        local_seconds, local_text = timed(accumulate_local, events)
+        stream_seconds, stream_text = timed(accumulate_stream, events)
+        assert expected == local_text == stream_text
+        print(f"{count:>8}  {dict_seconds * 1000:>13.1f}{local_seconds * 1000:>14.1f}{stream_seconds * 1000:>22.1f}")
+
+    print(f"\n{'deltas':>8}  {'write+flush (ms)':>17}{'syscalls':>10}{'coalesced (ms)':>16}{'syscalls':>10}")
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        for count in args.deltas:
+            events = make_events(count)
+            each_file = CountingFile(devnull)
+            each_seconds, _ = timed(write_each, events, each_file)
+            coalesced_file = CountingFile(devnull)
+            coalesced_seconds, _ = timed(write_coalesced, events, coalesced_file)
+            print(
+                f"{count:>8}  {each_seconds * 1000:>17.1f}{each_file.flushes:>10}"
+                f"{coalesced_seconds * 1000:>16.1f}{coalesced_file.flushes:>10}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+比較 MaiAgentHelper 使用連線池前後的每秒呼叫數
+
+Usage:
+    python -m benchmarks.http_pool --calls 2000
+"""
+import argparse
+import time
+
+import requests
+
+from benchmarks.mock_server import start_mock_server
+from utils import MaiAgentHelper
+
+
+def run_without_pool(base_url, api_key, calls):
+    """舊做法：每次都呼叫模組層級的 requests.get，每次重新建立連線"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        response = requests.get(f'{base_url}knowledge-bases/', headers={'Authorization': f'Api-Key {api_key}'})
+        response.raise_for_status()
+    return calls / (time.perf_counter() - start)
+
+
+def run_with_pool(base_url, api_key, calls):
+    """新做法：MaiAgentHelper 透過共用 Session 重複使用 keep-alive 連線"""
+    with MaiAgentHelper(api_key, base_url=base_url) as helper:
+        start = time.perf_counter()
+        for _ in range(calls):
+            helper.list_knowledge_bases()
+        return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000, help='每個情境的呼叫次數')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server()
+    api_key = 'benchmark-key'
+
+    try:
+        before = run_without_pool(base_url, api_key, args.calls)
+        after = run_with_pool(base_url, api_key, args.calls)
+    finally:
+        server.shutdown()
+
+    print(f'Calls per scenario: {args.calls}')
+    print(f'Without pool: {before:,.0f} calls/sec')
+    print(f'With pool:    {after:,.0f} calls/sec')
+    print(f'Speedup:      {after / before:.2f}x')
+    print('Note: the stand-in server is plain HTTP on localhost; against the real API each new')
+    print('connection also pays network RTT and a TLS handshake, so the gap is larger.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+本機模擬 MaiAgent API 伺服器，供效能測試使用
+
+回應一律為 HTTP/1.1 並帶 Content-Length，因此用戶端可以保持 keep-alive 連線。
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 標頭與內容分兩次寫入，關閉 Nagle 以免 keep-alive 連線卡在 delayed ACK
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _discard_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        while length > 0:
+            chunk = self.rfile.read(min(length, 1 << 16))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def do_GET(self):
+        self._send_json(200, {'count': 0, 'next': None, 'previous': None, 'results': []})
+
+    def do_POST(self):
+        self._discard_body()
+        if self.path.startswith('/s3/'):
+            # 模擬 S3 預簽名 POST：成功時回傳 204 且沒有內容
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_json(200, {'id': 'mock-id'})
+
+    def do_PUT(self):
+        self.do_POST()
+
+    def do_PATCH(self):
+        self.do_POST()
+
+    def do_DELETE(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(handler_class=MockAPIHandler, host='127.0.0.1', port=0):
+    """在背景執行緒啟動模擬伺服器，回傳 (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}/api/v1/'
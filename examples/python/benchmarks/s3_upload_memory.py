@@ -0,0 +1,108 @@
+"""
+比較 S3 上傳改為串流前後的記憶體峰值
+
+舊做法會先把整個檔案讀進記憶體再組成 multipart body，峰值約為檔案大小的 1～2 倍；
+新做法從磁碟分段讀取送出，峰值只與區塊大小有關。以 tracemalloc 量測 Python 配置的記憶體峰值。
+
+Usage:
+    python -m benchmarks.s3_upload_memory --size-mb 64
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import tracemalloc
+
+import aiohttp
+import requests
+
+from benchmarks.mock_server import start_mock_server
+from utils import AsyncMaiAgentHelper, MaiAgentHelper
+
+
+def legacy_sync_upload(file_path, upload_data):
+    """舊做法：requests 的 files= 會把整個檔案讀進記憶體組成 body"""
+    with open(file_path, 'rb') as file:
+        fields = [(key, (None, value)) for key, value in upload_data['fields'].items()]
+        fields.append(('file', (os.path.basename(file_path), file)))
+        response = requests.post(upload_data['url'], files=fields)
+    assert response.status_code == 204
+
+
+def streaming_sync_upload(file_path, upload_data):
+    with MaiAgentHelper('benchmark-key', base_url=upload_data['url']) as helper:
+        assert helper.upload_file_to_s3(file_path, upload_data)
+
+
+async def legacy_async_upload(file_path, upload_data):
+    """舊做法：先把檔案整個讀成 bytes 再放進 FormData"""
+    with open(file_path, 'rb') as f:
+        file_data = f.read()
+    data = aiohttp.FormData()
+    for key, value in upload_data['fields'].items():
+        data.add_field(key, value)
+    data.add_field('file', file_data, filename=os.path.basename(file_path), content_type='application/octet-stream')
+    async with aiohttp.ClientSession() as session:
+        async with session.post(upload_data['url'], data=data) as response:
+            assert response.status == 204
+
+
+async def streaming_async_upload(file_path, upload_data):
+    async with AsyncMaiAgentHelper('benchmark-key', base_url=upload_data['url']) as helper:
+        await helper.upload_file_to_s3(file_path, upload_data)
+
+
+def measure_peak(func, *args):
+    """回傳執行 func 期間 Python 配置的記憶體峰值（MiB）"""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+        return tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=64, help='測試檔案大小（MiB）')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server()
+    upload_data = {
+        'url': base_url.replace('/api/v1/', '/s3/'),
+        'fields': {
+            'key': 'media/benchmark/file.bin',
+            'x-amz-algorithm': 'AWS4-HMAC-SHA256',
+            'x-amz-credential': 'credential',
+            'x-amz-date': '20240101T000000Z',
+            'policy': 'policy',
+            'x-amz-signature': 'signature',
+        },
+    }
+
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as tmp:
+        chunk = os.urandom(1 << 20)
+        for _ in range(args.size_mb):
+            tmp.write(chunk)
+        file_path = tmp.name
+
+    try:
+        results = [
+            ('Sync, legacy files=', measure_peak(legacy_sync_upload, file_path, upload_data)),
+            ('Sync, streaming', measure_peak(streaming_sync_upload, file_path, upload_data)),
+            ('Async, legacy read()', measure_peak(legacy_async_upload, file_path, upload_data)),
+            ('Async, streaming', measure_peak(streaming_async_upload, file_path, upload_data)),
+        ]
+    finally:
+        os.unlink(file_path)
+        server.shutdown()
+
+    print(f'File size: {args.size_mb} MiB')
+    for name, peak in results:
+        print(f'{name:<22} peak {peak:8.2f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+比較串流回應的 SSE 解析成本：sseclient + json.loads 與內建的 utils.sse（json / orjson）
+
+預設以固定亂數種子產生一條 10k 事件的模擬串流（格式與 create_chatbot_completion 的串流回應相同），
+並切成 1～4096 位元組不等的區塊，模擬從 socket 讀到的片段；也可以用 --stream 指定錄下來的原始回應內容。
+
+Usage:
+    python -m benchmarks.sse_parser --events 10000 --rounds 5
+    python -m benchmarks.sse_parser --stream recorded_stream.bin
+"""
+import argparse
+import json
+import random
+import time
+
+from utils.sse import iter_sse_json
+
+try:
+    import sseclient
+except ImportError:
+    sseclient = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TOKENS = ['高鐵', '時刻表', ' the', ' train', ' departs', '，', '。', ' at', ' 08:30', '台北', '左營', ' ticket', '\n']
+
+
+def record_stream(events):
+    """產生與 completions 串流相同格式的回應內容"""
+    rng = random.Random(42)
+    frames = []
+    for i in range(events - 1):
+        content = ''.join(rng.choice(TOKENS) for _ in range(rng.randint(1, 3)))
+        payload = {'conversationId': 'c3f1a2b4-0000-4000-8000-000000000000', 'content': content, 'done': False}
+        frames.append(f'data: {json.dumps(payload, ensure_ascii=False)}\n\n')
+    frames.append('data: {"conversationId": "c3f1a2b4-0000-4000-8000-000000000000", "content": "", "done": true}\n\n')
+    return ''.join(frames).encode('utf-8')
+
+
+def split_chunks(stream):
+    """切成 1～4096 位元組的區塊，模擬 iter_content(chunk_size=None) 讀到的片段"""
+    rng = random.Random(7)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.choice((rng.randint(1, 64), rng.randint(64, 1024), rng.randint(1024, 4096)))
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def parse_sseclient(chunks):
+    """舊做法：sseclient.SSEClient 逐事件解碼，再以 json.loads 解析"""
+    count = 0
+    for event in sseclient.SSEClient(iter(chunks)).events():
+        if event.data:
+            json.loads(event.data)
+            count += 1
+    return count
+
+
+def parse_builtin_json(chunks):
+    return sum(1 for _ in iter_sse_json(chunks, json_loads=json.loads))
+
+
+def parse_builtin_orjson(chunks):
+    return sum(1 for _ in iter_sse_json(chunks, json_loads=orjson.loads))
+
+
+def measure(parse, chunks, rounds):
+    """回傳最好的一輪的 (事件數, 牆鐘秒數, CPU 秒數)"""
+    best = None
+    for _ in range(rounds):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        count = parse(chunks)
+        result = (count, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+        if best is None or result[1] < best[1]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000, help='模擬串流的事件數')
+    parser.add_argument('--stream', help='錄下來的原始串流內容（取代模擬串流）')
+    parser.add_argument('--rounds', type=int, default=5, help='每個解析器量測的輪數（取最快的一輪）')
+    args = parser.parse_args()
+
+    if args.stream:
+        with open(args.stream, 'rb') as f:
+            stream = f.read()
+    else:
+        stream = record_stream(args.events)
+    chunks = split_chunks(stream)
+    print(f"Stream: {len(stream) / 1024:.0f} KiB in {len(chunks)} chunks")
+
+    parsers = []
+    if sseclient is not None:
+        parsers.append(('sseclient + json', parse_sseclient))
+    else:
+        print('sseclient-py is not installed, skipping the old parser')
+    parsers.append(('utils.sse + json', parse_builtin_json))
+    if orjson is not None:
+        parsers.append(('utils.sse + orjson', parse_builtin_orjson))
+    else:
+        print('orjson is not installed, skipping utils.sse + orjson')
+
+    print(f"{'parser':<22}{'events':>8}{'events/sec':>14}{'CPU µs/token':>15}")
+    for name, parse in parsers:
+        count, wall, cpu = measure(parse, chunks, args.rounds)
+        print(f"{name:<22}{count:>8}{count / wall:>14,.0f}{cpu / count * 1e6:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+比較批量上傳任務記帳改用 TaskTable 前後的成本
+
+舊做法每完成一個檔案要做 any(...) 掃描已完成列表，再從 deque 中 remove，兩者都是 O(n)，總成本 O(n²)；
+在大規模下無法實際跑完，因此在「一半已完成」的狀態下量測單次成本，再乘以 n 估算總時間。
+新做法（TaskTable）的新增、狀態轉換與計數都是 O(1)，直接完整執行。
+
+完成順序模擬並發上傳：大致依序，但在 --window 個任務內隨機交錯。
+
+Usage:
+    python -m benchmarks.task_table --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledges', 'batch_upload'))
+from batch_upload_advanced import FileUploadTask, TaskTable, UploadStatus  # noqa: E402
+
+
+def make_tasks(size):
+    return [FileUploadTask(f'/data/corpus/document_{i:07d}.pdf', 1024) for i in range(size)]
+
+
+def completion_order(size, window, seed=0):
+    """大致依序、在 window 內交錯的完成順序"""
+    rng = random.Random(seed)
+    order = list(range(size))
+    for start in range(0, size, window):
+        chunk = order[start:start + window]
+        rng.shuffle(chunk)
+        order[start:start + window] = chunk
+    return order
+
+
+def legacy_complete(task, tasks_queue, completed_tasks, failed_tasks):
+    """舊版 upload_single_file / upload_and_track 在每個檔案完成時做的記帳"""
+    task.status = UploadStatus.SUCCESS
+    if not any(t.file_path == task.file_path for t in completed_tasks):
+        completed_tasks.append(task)
+    try:
+        tasks_queue.remove(task)
+    except ValueError:
+        pass
+    # 進度條顯示的成功數
+    return len(completed_tasks) - len(failed_tasks)
+
+
+def run_legacy(size, window, samples):
+    """回傳 (一半已完成時的單次秒數, 估算的總秒數)"""
+    tasks = make_tasks(size)
+    order = completion_order(size, window)
+    half = size // 2
+
+    completed_tasks = [tasks[i] for i in order[:half]]
+    done = set(order[:half])
+    tasks_queue = deque(task for i, task in enumerate(tasks) if i not in done)
+    failed_tasks = []
+
+    sample_ids = order[half:half + samples]
+    start = time.perf_counter()
+    for i in sample_ids:
+        legacy_complete(tasks[i], tasks_queue, completed_tasks, failed_tasks)
+    per_task = (time.perf_counter() - start) / len(sample_ids)
+    return per_task, per_task * size
+
+
+def run_table(size, window):
+    """回傳 (單次秒數, 總秒數)"""
+    tasks = make_tasks(size)
+    order = completion_order(size, window)
+
+    start = time.perf_counter()
+    table = TaskTable(tasks)
+    for i in order:
+        task = tasks[i]
+        table.transition(task, UploadStatus.UPLOADING)
+        table.transition(task, UploadStatus.SUCCESS)
+        table.count(UploadStatus.SUCCESS, UploadStatus.SKIPPED)
+        table.count(UploadStatus.FAILED)
+    total = time.perf_counter() - start
+
+    assert table.count(UploadStatus.SUCCESS) == size
+    return total / size, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='任務數')
+    parser.add_argument('--window', type=int, default=10, help='完成順序交錯的範圍（約等於並發數）')
+    parser.add_argument('--samples', type=int, default=200, help='舊做法每個規模量測的次數')
+    args = parser.parse_args()
+
+    print(f"{'tasks':>10} | {'legacy/task':>12} {'legacy total*':>14} | {'table/task':>11} {'table total':>12}")
+    for size in args.sizes:
+        legacy_per_task, legacy_total = run_legacy(size, args.window, args.samples)
+        table_per_task, table_total = run_table(size, args.window)
+        print(
+            f'{size:>10,} | {legacy_per_task * 1000:>10.3f}ms {legacy_total:>13,.0f}s | '
+            f'{table_per_task * 1e6:>9.2f}us {table_total:>11.2f}s'
+        )
+    print('* estimated: n x per-task cost with half of the tasks completed')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,30 +2,66 @@ import os
 import time
 import json
 import asyncio
-import aiohttp
-import aiofiles
+import heapq
+import itertools
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Optional
 from dataclasses import dataclass
 from enum import Enum
 import logging
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import signal
 import sys
 import threading
+import aiohttp
 from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils import (
+    AdaptiveConcurrencyLimiter,
+    AsyncMaiAgentHelper,
+    KnowledgeFileDeleter,
+    KnowledgeFileRegistrar,
+    ProcessingTracker,
+)
+from checkpoint_store import CheckpointStore
+from directory_scanner import DirectoryScanner
+from kb_mirror import DEFAULT_MIRROR_PATH, KnowledgeBaseMirror
+from upload_manifest import UploadManifest, hash_file
 
 
 API_KEY = '<your-api-key>'
 KNOWLEDGE_BASE_ID = '<your-knowledge-base-id>'   # 你的知識庫 ID
 FILES_DIRECTORY = '<your-files-directory>'    # 你要上傳的檔案目錄 
+SCAN_BATCH_SIZE = 500    # 掃描執行緒每次交給上傳 workers 的檔案數
 
 @dataclass
 class UploadConfig:
-    max_concurrent_uploads: int = 10
+    max_concurrent_uploads: int = 10      # 並發上限；啟用 adaptive_concurrency 時為自動調整的上限
     max_retries: int = 3
     retry_delay: float = 2.0
     timeout_seconds: int = 300
+    adaptive_concurrency: bool = True     # 依伺服器回應自動調整並發數（遇到 429/5xx 降速並遵守 Retry-After）
+    initial_concurrent_uploads: int = 4   # 自動調整的起始並發數
+    content_dedup: bool = True            # 以內容雜湊略過已上傳過的檔案（即使路徑不同）
+    manifest_path: Optional[str] = None   # 內容雜湊 manifest 路徑，預設為 upload_outputs/content_manifest.sqlite3
+    hash_workers: int = 4                 # 計算雜湊的背景執行緒數
+    scan_workers: int = 8                 # 平行掃描目錄的執行緒數；網路檔案系統（NFS/SMB）可調高到 16～32
+    incremental_scan: bool = False        # 已上傳的檔案若大小或修改時間改變，視為新版本重新上傳
+    delete_replaced_files: bool = True    # 增量掃描重新上傳的檔案註冊成功後，刪除知識庫中的舊版本
+    presign_concurrency: int = 4          # 同時取得預簽名 URL 的請求數
+    register_concurrency: int = 4         # 同時註冊到知識庫的請求數
+    register_batch_size: int = 50         # 每次註冊請求最多包含的檔案數
+    register_batch_delay: float = 0.2     # 批次未滿時最多等待的秒數
+    list_concurrency: int = 8             # 完整性檢查時同時抓取的知識庫分頁數
+    kb_mirror: bool = True                # 完整性檢查改讀本機知識庫鏡像，只增量同步有變化的檔案
+    kb_mirror_path: Optional[str] = None  # 鏡像路徑，預設為 upload_outputs/kb_mirror.sqlite3
+    presign_prefetch: int = 0             # 預先取得、等待上傳 S3 的 URL 數量上限；0 表示與 max_concurrent_uploads 相同
+    presign_max_age: float = 600.0        # 預簽名 URL 等待超過此秒數時，上傳前重新取得
+    wait_for_processing: bool = False     # 上傳後持續追蹤解析狀態，所有檔案 done / failed 才結束
+    processing_poll_interval: float = 2.0       # 解析狀態的最短輪詢間隔（秒），之後逐次拉長
+    processing_max_poll_interval: float = 60.0  # 解析狀態的最長輪詢間隔（秒）
+    max_processing: int = 0               # 本次上傳仍在 initial / processing 的檔案數上限，達到時暫停註冊；0 表示不限制
     
     
 class UploadStatus(Enum):
@@ -40,11 +76,114 @@ class UploadStatus(Enum):
 class FileUploadTask:
     file_path: str
     file_size: int
+    mtime_ns: Optional[int] = None
     status: UploadStatus = UploadStatus.PENDING
     error_message: Optional[str] = None
     upload_time: Optional[float] = None
     retry_count: int = 0
     knowledge_file_id: Optional[str] = None  # 記錄上傳後的 knowledge file ID
+    content_hash: Optional[str] = None  # 檔案內容的 SHA-256
+    task_id: Optional[int] = None  # 由 TaskTable 指派
+    started_at: Optional[float] = None  # 進入上傳管線的時間
+    upload_data: Optional[Dict[str, Any]] = None  # 預簽名 URL 與表單欄位，上傳 S3 後清除
+    presigned_at: Optional[float] = None
+    s3_key: Optional[str] = None  # 上傳 S3 後保留，註冊失敗重試時不必重新上傳
+    completed_stage: Optional[str] = None  # 最後一個成功完成的管線階段
+    replaced_file_id: Optional[str] = None  # 增量掃描時，此檔案上一個版本的 knowledge file ID
+
+
+# 階段 handler 的回傳值：結果由另一個任務處理，worker 不更新統計
+DEFERRED = 'deferred'
+
+
+class PipelineStage:
+    """上傳管線中的一個階段，各自擁有佇列、worker 數與統計資訊"""
+    
+    def __init__(self, name: str, workers: int, queue_size: int = 0):
+        self.name = name
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+    
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+    
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'completed': self.completed,
+            'failed': self.failed,
+            'throughput_per_sec': round(self.completed / elapsed, 2) if elapsed > 0 else 0.0,
+            'utilization': round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+        }
+
+
+class TaskTable:
+    """
+    以 task_id 索引的任務表
+    
+    每個狀態各有一個以 task_id 為 key 的 dict，狀態轉換只是從一個 dict 移到另一個，
+    新增、轉換、計數都是 O(1)。進度條、checkpoint 與最終報告都直接從這裡讀取。
+    
+    已完成的任務可以用 forget() 移出索引（計數保留），大量檔案時記憶體用量不會隨總數成長。
+    """
+    
+    def __init__(self, tasks: Iterable[FileUploadTask] = ()):
+        self._tasks: Dict[int, FileUploadTask] = {}
+        self._by_status: Dict[UploadStatus, Dict[int, FileUploadTask]] = {status: {} for status in UploadStatus}
+        self._counts: Dict[UploadStatus, int] = {status: 0 for status in UploadStatus}
+        self._next_id = 0
+        for task in tasks:
+            self.add(task)
+    
+    @property
+    def total(self) -> int:
+        """曾經加入的任務總數（包含已 forget 的任務）"""
+        return self._next_id
+    
+    def add(self, task: FileUploadTask) -> int:
+        task.task_id = self._next_id
+        self._next_id += 1
+        self._tasks[task.task_id] = task
+        self._by_status[task.status][task.task_id] = task
+        self._counts[task.status] += 1
+        return task.task_id
+    
+    def get(self, task_id: int) -> FileUploadTask:
+        return self._tasks[task_id]
+    
+    def transition(self, task: FileUploadTask, status: UploadStatus):
+        """變更任務狀態並更新各狀態的索引與計數"""
+        if task.status == status:
+            return
+        self._counts[task.status] -= 1
+        self._counts[status] += 1
+        if self._by_status[task.status].pop(task.task_id, None) is not None:
+            self._by_status[status][task.task_id] = task
+        task.status = status
+    
+    def forget(self, task: FileUploadTask):
+        """把任務移出索引，計數不變"""
+        self._tasks.pop(task.task_id, None)
+        self._by_status[task.status].pop(task.task_id, None)
+    
+    def count(self, *statuses: UploadStatus) -> int:
+        return sum(self._counts[status] for status in statuses)
+    
+    def with_status(self, *statuses: UploadStatus) -> Iterator[FileUploadTask]:
+        """列出指定狀態、仍在索引中的任務；同一狀態內依進入該狀態的順序"""
+        for status in statuses:
+            yield from self._by_status[status].values()
+    
+    def __len__(self) -> int:
+        return len(self._tasks)
+    
+    def __iter__(self) -> Iterator[FileUploadTask]:
+        return iter(self._tasks.values())
 
 
 class BatchFileUploaderAdvanced:
@@ -63,8 +202,7 @@ class BatchFileUploaderAdvanced:
         self.source_directory = source_directory
         
         # 使用線程鎖來防止並發寫入 checkpoint 的問題
-        self._checkpoint_lock = threading.Lock()
-        self._completed_lock = threading.Lock()
+        self._checkpoint_lock = threading.RLock()
         
         # 設定輸出資料夾結構 - 使用來源資料夾名稱和知識庫ID組合
         if source_directory:
@@ -85,11 +223,45 @@ class BatchFileUploaderAdvanced:
         os.makedirs(self.log_dir, exist_ok=True)
         os.makedirs(self.report_dir, exist_ok=True)
         
-        self.tasks_queue = deque()
-        self.completed_tasks = []
-        self.failed_tasks = []
-        # 使用固定的 checkpoint 檔名
+        # S3 上傳與 API 請求（預簽名、註冊）各自使用一個並發控制器
+        self.limiter = self._create_limiter(config.max_concurrent_uploads, config.initial_concurrent_uploads)
+        api_limit = config.presign_concurrency + config.register_concurrency
+        self.api_limiter = self._create_limiter(api_limit, api_limit // 2)
+        self._stages: Dict[str, PipelineStage] = {}
+        self._registrar: Optional[KnowledgeFileRegistrar] = None
+        self._tracker: Optional[ProcessingTracker] = None
+        self._processing_failed: List[Dict[str, Any]] = []
+        self._processing_slots: Optional[asyncio.Semaphore] = None
+        self._processing_throttled = 0
+        self._replaced_files: List[Dict[str, Any]] = []
+        self._retry_heap: List[tuple] = []
+        self._registrations: set = set()
+        self._reupload_bytes_saved = 0
+        self._pipeline_elapsed = 0.0
+        
+        # 內容雜湊 manifest 放在所有來源資料夾共用的位置，搬移或重新命名資料夾後仍然有效
+        self.manifest = None
+        if config.content_dedup:
+            manifest_path = config.manifest_path or os.path.join(
+                os.path.dirname(__file__), 'upload_outputs', 'content_manifest.sqlite3'
+            )
+            self.manifest = UploadManifest(manifest_path)
+        self._hash_executor = None
+        self._pending_hashes: Dict[str, asyncio.Future] = {}
+        
+        # 知識庫檔案的本機鏡像，與 scan_file_status.py 等維護腳本共用
+        self.kb_mirror = KnowledgeBaseMirror(config.kb_mirror_path or DEFAULT_MIRROR_PATH) if config.kb_mirror else None
+        
+        self.tasks = TaskTable()
+        self._resumed_count = 0
+        self._changed_count = 0
+        self._total_upload_time = 0.0
+        self._success_spool = None
+        self._success_spool_file = None
+        # 使用固定的 checkpoint 檔名：SQLite 為主要紀錄，JSON 為中斷或結束時輸出的快照
         self.checkpoint_file = os.path.join(self.checkpoint_dir, "upload_checkpoint.json")
+        self.checkpoint_db_file = os.path.join(self.checkpoint_dir, "upload_checkpoint.sqlite3")
+        self._checkpoint_store = None
         
         logging.basicConfig(
             level=logging.INFO,
@@ -110,390 +282,640 @@ class BatchFileUploaderAdvanced:
         self.save_checkpoint()
         sys.exit(0)
     
-    def scan_files(self, directory: str) -> List[FileUploadTask]:
-        """掃描目錄並建立上傳任務列表"""
-        tasks = []
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if not file.startswith('.'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        file_size = os.path.getsize(file_path)
-                        tasks.append(FileUploadTask(file_path, file_size))
-                    except OSError as e:
-                        self.logger.warning(f"Cannot access file {file_path}: {e}")
-        
-        return tasks
+    def iter_files(self, directory: str) -> Iterator[FileUploadTask]:
+        """逐一掃描目錄並產生上傳任務，不需要等整個目錄掃描完"""
+        scanner = DirectoryScanner(workers=self.config.scan_workers)
+        for scanned in scanner.iter_files(directory):
+            yield FileUploadTask(scanned.path, scanned.size, scanned.mtime_ns)
+    
+    @property
+    def checkpoint_store(self) -> CheckpointStore:
+        """第一次使用時開啟 checkpoint 資料庫（舊版 JSON checkpoint 會自動匯入）"""
+        if self._checkpoint_store is None:
+            self._checkpoint_store = CheckpointStore(self.checkpoint_db_file, legacy_json_path=self.checkpoint_file)
+        return self._checkpoint_store
     
     def load_checkpoint(self) -> Optional[Dict[str, Any]]:
         """載入檢查點以恢復中斷的上傳"""
-        if not os.path.exists(self.checkpoint_file):
-            return None
-            
         try:
-            with open(self.checkpoint_file, 'r') as f:
-                checkpoint_data = json.load(f)
-                completed_count = len(checkpoint_data.get('completed_files', []))
-                self.logger.info(f"Loaded checkpoint with {completed_count} completed files")
-                return checkpoint_data
+            checkpoint_data = self.checkpoint_store.load()
         except Exception as e:
             self.logger.error(f"Failed to load checkpoint: {e}")
             return None
+        
+        if checkpoint_data:
+            completed_count = len(checkpoint_data.get('completed_files', []))
+            self.logger.info(f"Loaded checkpoint with {completed_count} completed files")
+        return checkpoint_data
     
     def save_checkpoint(self):
-        """儲存當前進度 - 累積更新已完成檔案"""
+        """輸出 JSON 快照（中斷或上傳結束時呼叫）；每個檔案的進度已即時寫入 checkpoint 資料庫"""
         with self._checkpoint_lock:
-            # 載入現有的 checkpoint（如果存在）
-            existing_completed = set()
-            existing_failed = []
-            existing_file_id_mapping = {}
-            
-            if os.path.exists(self.checkpoint_file):
-                try:
-                    with open(self.checkpoint_file, 'r') as f:
-                        existing_data = json.load(f)
-                        existing_completed = set(existing_data.get('completed_files', []))
-                        existing_failed = existing_data.get('failed_files', [])
-                        existing_file_id_mapping = existing_data.get('file_id_mapping', {})
-                except Exception as e:
-                    self.logger.warning(f"Could not read existing checkpoint: {e}")
-            
-            # 合併新的已完成檔案
-            all_completed = existing_completed
-            all_completed.update([task.file_path for task in self.completed_tasks])
-            
-            # 合併失敗檔案（去除重複）
-            failed_paths = set(item[0] if isinstance(item, (list, tuple)) else item for item in existing_failed)
-            for task in self.failed_tasks:
-                if task.file_path not in failed_paths:
-                    existing_failed.append((task.file_path, task.error_message))
-                    failed_paths.add(task.file_path)
-            
-            # 合併新的 file_id_mapping
-            file_id_mapping = existing_file_id_mapping.copy()
-            for task in self.completed_tasks:
-                if task.knowledge_file_id:
-                    file_id_mapping[task.file_path] = task.knowledge_file_id
-            
-            checkpoint_data = {
-                'timestamp': datetime.now().isoformat(),
-                'completed_files': list(all_completed),
-                'file_id_mapping': file_id_mapping,  # 新增：檔案路徑到 knowledge_file_id 的映射
-                'failed_files': existing_failed,
-                'pending_files': [task.file_path for task in self.tasks_queue]
-            }
+            pending = self.tasks.with_status(UploadStatus.PENDING, UploadStatus.UPLOADING)
+            self.checkpoint_store.export_json(self.checkpoint_file, (task.file_path for task in pending))
+            self.checkpoint_store.compact()
+            self.logger.info(f"Checkpoint saved with {self.checkpoint_store.completed_count()} total completed files")
+    
+    async def _compute_content_hash(self, task: FileUploadTask) -> Optional[str]:
+        """計算檔案內容雜湊；路徑、大小、修改時間都沒變時直接使用 manifest 中的快取"""
+        file_path = os.path.abspath(task.file_path)
+        try:
+            stat = os.stat(file_path)
+            digest = self.manifest.cached_hash(file_path, stat.st_size, stat.st_mtime_ns)
+            if digest is None:
+                # 讀檔與雜湊都在背景執行緒進行，不阻塞事件迴圈
+                loop = asyncio.get_running_loop()
+                digest = await loop.run_in_executor(self._hash_executor, hash_file, file_path)
+                self.manifest.remember_hash(file_path, stat.st_size, stat.st_mtime_ns, digest)
+            return digest
+        except OSError as e:
+            self.logger.warning(f"Cannot hash file {task.file_path}, uploading without dedup: {e}")
+            return None
+    
+    async def _find_uploaded_content(self, task: FileUploadTask) -> Optional[str]:
+        """回傳相同內容已上傳到此知識庫的 knowledge_file_id；需要上傳時回傳 None"""
+        task.content_hash = await self._compute_content_hash(task)
+        if task.content_hash is None:
+            return None
+        
+        while True:
+            existing_id = self.manifest.get(self.knowledge_base_id, task.content_hash)
+            if existing_id:
+                return existing_id
             
-            with open(self.checkpoint_file, 'w') as f:
-                json.dump(checkpoint_data, f, indent=2)
+            pending = self._pending_hashes.get(task.content_hash)
+            if pending is None:
+                # 由這個任務負責上傳，其他內容相同的任務等待結果
+                self._pending_hashes[task.content_hash] = asyncio.get_running_loop().create_future()
+                return None
             
-            total_completed = len(all_completed)
-            # 只在整百時顯示日誌，減少輸出
-            if total_completed % 100 == 0:
-                self.logger.info(f"Checkpoint saved with {total_completed} total completed files")
-    
-    async def get_upload_url(self, session: aiohttp.ClientSession, file_path: str) -> Dict[str, Any]:
-        """獲取預簽名上傳 URL"""
-        url = f"{self.base_url}upload-presigned-url/"
-        headers = {
-            'Authorization': f'Api-Key {self.api_key}',
-            'Content-Type': 'application/json'
-        }
+            # 同一次執行中有內容相同的檔案正在上傳；若它失敗，重新檢查並由其中一個任務接手上傳
+            existing_id = await asyncio.shield(pending)
+            if existing_id:
+                return existing_id
+    
+    def _settle_content_hash(self, task: FileUploadTask):
+        """記錄上傳結果並通知等待相同內容的任務"""
+        if task.content_hash is None:
+            return
+        if task.status == UploadStatus.SUCCESS and task.knowledge_file_id:
+            self.manifest.record(
+                self.knowledge_base_id,
+                task.content_hash,
+                task.file_size,
+                task.knowledge_file_id,
+                os.path.basename(task.file_path),
+            )
+        pending = self._pending_hashes.pop(task.content_hash, None)
+        if pending is not None and not pending.done():
+            pending.set_result(task.knowledge_file_id if task.status == UploadStatus.SUCCESS else None)
+    
+    async def _hash_stage(self, helper: AsyncMaiAgentHelper, task: FileUploadTask) -> Optional[str]:
+        """內容已在知識庫中時直接略過，否則交給預簽名階段"""
+        existing_id = await self._find_uploaded_content(task)
+        if existing_id:
+            # 相同內容已經在知識庫中（可能來自其他路徑或其他機器），不再呼叫 get_upload_url
+            task.knowledge_file_id = existing_id
+            self._complete_task(task, UploadStatus.SKIPPED)
+            return None
+        return 'presign'
+    
+    async def _presign_stage(self, helper: AsyncMaiAgentHelper, task: FileUploadTask) -> Optional[str]:
+        async with self.api_limiter.slot():
+            task.upload_data = await helper.get_upload_url(task.file_path, 'chatbot-file')
+        task.presigned_at = time.monotonic()
+        return 's3'
+    
+    async def _s3_stage(self, helper: AsyncMaiAgentHelper, task: FileUploadTask) -> Optional[str]:
+        if task.upload_data is None or time.monotonic() - task.presigned_at > self.config.presign_max_age:
+            # 在佇列中等待太久的預簽名 URL 可能已過期；S3 拒絕後重試時也重新取得
+            await self._presign_stage(helper, task)
+        async with self.limiter.slot():
+            task.s3_key = await helper.upload_file_to_s3(task.file_path, task.upload_data)
+        task.upload_data = None
+        return 'register'
+    
+    async def _register_stage(self, helper: AsyncMaiAgentHelper, task: FileUploadTask) -> Optional[str]:
+        """加入註冊批次後立即返回，由完成任務等待結果；worker 數即為 register_concurrency"""
+        if self._processing_slots is not None:
+            # 解析中的檔案達到上限時等待，S3 上傳完成的檔案在此排隊，掃描也會隨之暫停
+            if self._processing_slots.locked():
+                self._processing_throttled += 1
+            await self._processing_slots.acquire()
+        # 與其他剛上傳完成的檔案合併成同一個註冊請求
+        registered = self._registrar.submit(task.s3_key, os.path.basename(task.file_path))
+        completion = asyncio.ensure_future(self._complete_registration(self._stages['register'], task, registered))
+        self._registrations.add(completion)
+        completion.add_done_callback(self._registrations.discard)
+        return DEFERRED
+    
+    async def _complete_registration(self, stage: PipelineStage, task: FileUploadTask, registered: asyncio.Future):
+        """等待註冊結果，更新階段統計並完成任務；失敗時與其他階段相同地重試"""
+        stage.active += 1
+        try:
+            knowledge_file = await registered
+        except Exception as e:
+            if self._processing_slots is not None:
+                self._processing_slots.release()
+            stage.failed += 1
+            self._retry_or_fail(stage, task, e)
+            return
+        finally:
+            stage.active -= 1
         
-        file_size = os.path.getsize(file_path)
-        filename = os.path.basename(file_path)
+        stage.completed += 1
+        task.completed_stage = stage.name
+        if isinstance(knowledge_file, dict):
+            task.knowledge_file_id = knowledge_file.get('id')
+        if self._tracker is not None and task.knowledge_file_id:
+            # 任務完成後會移出任務表，callback 只保留需要的欄位
+            file_path = task.file_path
+            processed = self._tracker.track(
+                task.knowledge_file_id,
+                created_at=knowledge_file.get('createdAt'),
+                callback=lambda processed: self._on_file_processed(file_path, processed),
+            )
+            if self._processing_slots is not None:
+                # 解析完成（或檔案已被刪除）時才釋放名額
+                processed.add_done_callback(lambda _: self._processing_slots.release())
+        elif self._processing_slots is not None:
+            self._processing_slots.release()
+        self._complete_task(task, UploadStatus.SUCCESS)
+    
+    def _on_file_processed(self, file_path: str, knowledge_file: Dict[str, Any]):
+        """檔案解析完成（done / failed）時呼叫"""
+        if knowledge_file.get('status') == 'failed':
+            self._processing_failed.append({'file_path': file_path, 'knowledge_file_id': knowledge_file.get('id')})
+            self.logger.warning(f"Processing failed: {file_path} ({knowledge_file.get('id')})")
+    
+    def _complete_task(self, task: FileUploadTask, status: UploadStatus):
+        self.tasks.transition(task, status)
+        task.upload_time = time.time() - task.started_at if status == UploadStatus.SUCCESS else 0.0
+        # 只寫入這一筆紀錄，不重寫整個 checkpoint
+        self.checkpoint_store.mark_completed(task.file_path, task.knowledge_file_id, task.file_size, task.mtime_ns)
+        if task.replaced_file_id and task.replaced_file_id != task.knowledge_file_id:
+            # 內容沒變（沿用同一個 knowledge file）時不算取代
+            self._replaced_files.append({
+                'file_path': task.file_path,
+                'old_knowledge_file_id': task.replaced_file_id,
+                'knowledge_file_id': task.knowledge_file_id,
+                'deleted': False,
+            })
+        self._finish_task(task)
+    
+    def _fail_task(self, task: FileUploadTask, error: Exception):
+        self.tasks.transition(task, UploadStatus.FAILED)
+        task.error_message = str(error)
+        self.checkpoint_store.mark_failed(task.file_path, task.error_message)
+        self.logger.error(f"Failed to upload {task.file_path}: {error}")
+        self._finish_task(task)
+    
+    def _finish_task(self, task: FileUploadTask):
+        """任務離開管線：通知等待相同內容的任務、寫入報告、更新進度條"""
+        if self.manifest is not None:
+            self._settle_content_hash(task)
+        self._record_finished(task)
         
-        payload = {
-            'filename': filename,
-            'modelName': 'chatbot-file',  # 知識庫檔案使用 chatbot-file
-            'fieldName': 'file',
-            'fileSize': file_size
-        }
+        self._in_flight.release()
+        self._unfinished -= 1
+        if self._unfinished == 0 and self._producer_done:
+            self._all_done.set()
         
-        # 移除詳細調試輸出，只在錯誤時顯示
+        # 更新進度條（計數直接取自任務表，O(1)）
+        self._progress_bar.update(1)
+        postfix = dict(success=self.tasks.count(UploadStatus.SUCCESS, UploadStatus.SKIPPED),
+                       failed=self.tasks.count(UploadStatus.FAILED),
+                       concurrency=self.limiter.limit,
+                       queued='/'.join(str(stage.depth) for stage in self._stages.values()))
+        if self._tracker is not None:
+            postfix['processing'] = self._tracker.pending_count
+        self._progress_bar.set_postfix(**postfix, refresh=False)
+    
+    def _retry_or_fail(self, stage: PipelineStage, task: FileUploadTask, error: Exception):
+        """
+        失敗的任務放進延遲重試佇列，時間到後回到失敗的那個階段，超過重試次數則標記為失敗
+        
+        之前完成的階段不會重做：註冊失敗時沿用已上傳的 S3 key，不會再傳一次檔案。
+        等待期間 worker 不會被佔用，可以繼續處理其他任務。
+        """
+        task.retry_count += 1
+        if task.retry_count >= self.config.max_retries:
+            self._fail_task(task, error)
+            return
         
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
+        if stage.name == 's3' and isinstance(error, aiohttp.ClientResponseError) and 400 <= error.status < 500:
+            # 預簽名 URL 過期或被拒絕，重試前重新取得
+            task.upload_data = None
+        if stage.name == 'register':
+            self._reupload_bytes_saved += task.file_size
+        
+        due = time.monotonic() + self.config.retry_delay * task.retry_count
+        heapq.heappush(self._retry_heap, (due, next(self._retry_seq), stage.name, task))
+        self._retry_wakeup.set()
     
-    async def upload_to_s3(self, session: aiohttp.ClientSession, file_path: str, upload_info: Dict[str, Any]) -> str:
-        """上傳檔案到 S3"""
-        async with aiofiles.open(file_path, 'rb') as f:
-            file_data = await f.read()
+    async def _retry_scheduler(self):
+        """把到期的任務放回原本失敗的階段"""
+        while True:
+            if not self._retry_heap:
+                self._retry_wakeup.clear()
+                await self._retry_wakeup.wait()
+                continue
+            
+            delay = self._retry_heap[0][0] - time.monotonic()
+            if delay > 0:
+                # 等待期間有更早到期的任務加入時提早醒來
+                self._retry_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._retry_wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, _, stage_name, task = heapq.heappop(self._retry_heap)
+            await self._stages[stage_name].queue.put(task)
+    
+    async def _stage_worker(self, stage: PipelineStage, handler, helper: AsyncMaiAgentHelper):
+        """不斷從階段佇列取出任務處理，並把任務交給 handler 回傳的下一個階段"""
+        while True:
+            task = await stage.queue.get()
+            stage.active += 1
+            started = time.monotonic()
+            error = None
+            try:
+                next_stage = await handler(helper, task)
+            except Exception as e:
+                next_stage, error = None, e
+            finally:
+                stage.active -= 1
+                stage.busy_seconds += time.monotonic() - started
+            
+            if error is not None:
+                stage.failed += 1
+                self._retry_or_fail(stage, task, error)
+                continue
+            if next_stage == DEFERRED:
+                continue
+            stage.completed += 1
+            task.completed_stage = stage.name
+            if next_stage is not None:
+                # S3 階段的佇列有上限：預先取得的 URL 足夠時，預簽名 workers 會在這裡等待
+                await self._stages[next_stage].queue.put(task)
+    
+    def _create_limiter(self, max_limit: int, initial_limit: int) -> AdaptiveConcurrencyLimiter:
+        """建立並發控制器；關閉自動調整時固定使用 max_limit"""
+        if not self.config.adaptive_concurrency:
+            return AdaptiveConcurrencyLimiter(initial_limit=max_limit, min_limit=max_limit, max_limit=max_limit)
         
-        # 準備 multipart form data
-        data = aiohttp.FormData()
+        # 上傳時間取決於檔案大小，因此只依錯誤（429/5xx/連線錯誤）調整，不依延遲調整
+        initial_limit = max(1, min(initial_limit, max_limit))
+        return AdaptiveConcurrencyLimiter(initial_limit=initial_limit, max_limit=max_limit)
+    
+    def _record_finished(self, task: FileUploadTask):
+        """成功或略過的任務寫入報告暫存檔後移出任務表，失敗的任務留在任務表中供報告使用"""
+        if task.status not in (UploadStatus.SUCCESS, UploadStatus.SKIPPED):
+            return
+        if task.status == UploadStatus.SUCCESS and task.upload_time:
+            self._total_upload_time += task.upload_time
+        if self._success_spool is not None:
+            self._success_spool.write(json.dumps({
+                'file_path': task.file_path,
+                'file_size': task.file_size,
+                'upload_time': task.upload_time,
+                'knowledge_file_id': task.knowledge_file_id,
+                'skipped': task.status == UploadStatus.SKIPPED
+            }) + '\n')
+        self.tasks.forget(task)
+    
+    def _is_already_uploaded(self, task: FileUploadTask) -> bool:
+        """
+        檢查 checkpoint 是否已有此檔案
         
-        # 添加所有必要的 fields
-        for key, value in upload_info['fields'].items():
-            data.add_field(key, value)
+        增量掃描時，大小或修改時間與上次上傳時不同的檔案視為變更，需要重新上傳；
+        沒有記錄大小與修改時間的舊紀錄一律視為未變更。
+        """
+        record = self.checkpoint_store.completed_record(task.file_path)
+        if record is None:
+            return False
+        size, mtime_ns, knowledge_file_id = record
+        if not self.config.incremental_scan or mtime_ns is None:
+            return True
+        if (size, mtime_ns) == (task.file_size, task.mtime_ns):
+            return True
+        self._changed_count += 1
+        task.replaced_file_id = knowledge_file_id
+        return False
+    
+    async def _delete_replaced_files(self, helper: AsyncMaiAgentHelper):
+        """
+        刪除被新版本取代的舊知識庫檔案
         
-        # 添加檔案（必須在其他欄位之後）
-        data.add_field('file', file_data, 
-                      filename=os.path.basename(file_path),
-                      content_type='application/octet-stream')
+        仍有其他路徑（內容雜湊相同）使用的舊檔案會保留。刪除失敗的檔案不在 checkpoint 中，
+        完整性檢查會把它們列為 extra files，可以再用 delete_duplicate_files.py 清理。
+        """
+        old_ids = {entry['old_knowledge_file_id'] for entry in self._replaced_files}
+        in_use = {file_id for _, file_id in self.checkpoint_store.paths_for_file_ids(old_ids)}
+        old_ids -= in_use
+        if not old_ids:
+            return
         
-        # 檢查是否有有效的上傳 URL
-        if 'url' not in upload_info:
-            raise ValueError("Missing 'url' in upload_info response from presigned URL API. This indicates an API error.")
+        deleter = KnowledgeFileDeleter(
+            helper,
+            self.knowledge_base_id,
+            concurrency=self.config.register_concurrency,
+            limiter=self.api_limiter,
+            list_concurrency=self.config.list_concurrency,
+        )
+        deleted_ids, errors = await deleter.delete(old_ids)
+        deleted_ids = set(deleted_ids)
+        for entry in self._replaced_files:
+            entry['deleted'] = entry['old_knowledge_file_id'] in deleted_ids
+        if self.manifest is not None and deleted_ids:
+            self.manifest.forget_files(self.knowledge_base_id, deleted_ids)
+        self.logger.info(f"Deleted {len(deleted_ids)} replaced files from the knowledge base")
+        if errors:
+            self.logger.warning(
+                f"Could not delete {len(errors)} replaced files; they are listed in the upload report "
+                f"and as extra files in the integrity check"
+            )
+    
+    async def _produce_tasks(self, tasks: Iterable[FileUploadTask], entry_stage: PipelineStage):
+        """在背景執行緒中分批從（可能是惰性的）任務來源取出任務，略過 checkpoint 中已完成的檔案後送入管線"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(tasks)
         
-        upload_url = upload_info['url']
+        def next_batch() -> List[FileUploadTask]:
+            batch = []
+            for task in iterator:
+                if self._is_already_uploaded(task):
+                    self._resumed_count += 1
+                    continue
+                batch.append(task)
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    break
+            return batch
         
-        async with session.post(upload_url, data=data) as response:
-            if response.status == 204:
-                return upload_info['fields']['key']
-            else:
-                error_text = await response.text()
-                raise Exception(f"S3 upload failed: {response.status} - {error_text}")
+        while not self._shutdown:
+            batch = await loop.run_in_executor(None, next_batch)
+            if not batch:
+                break
+            for task in batch:
+                self.tasks.add(task)
+            self._progress_bar.total = self.tasks.total
+            self._progress_bar.refresh()
+            for task in batch:
+                # 管線中的任務數有上限，各階段忙不過來時掃描會暫停，記憶體用量維持固定
+                await self._in_flight.acquire()
+                self._unfinished += 1
+                task.started_at = time.time()
+                self.tasks.transition(task, UploadStatus.UPLOADING)
+                entry_stage.queue.put_nowait(task)
     
-    async def register_file(self, session: aiohttp.ClientSession, file_key: str, original_filename: str) -> Dict[str, Any]:
-        """註冊檔案到知識庫"""
-        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/"
-        headers = {'Authorization': f'Api-Key {self.api_key}'}
+    def _build_stages(self) -> Dict[str, PipelineStage]:
+        """依序建立各階段；S3 階段的佇列上限即為預先取得的預簽名 URL 數量"""
+        stages = {}
+        if self.manifest is not None:
+            stages['hash'] = PipelineStage('hash', self.config.hash_workers)
+        stages['presign'] = PipelineStage('presign', self.config.presign_concurrency)
+        stages['s3'] = PipelineStage(
+            's3',
+            self.config.max_concurrent_uploads,
+            queue_size=self.config.presign_prefetch or self.config.max_concurrent_uploads,
+        )
+        # 註冊 workers 只把檔案加入批次，不等待結果，register_concurrency 同時也是註冊請求的並發上限
+        stages['register'] = PipelineStage('register', self.config.register_concurrency)
+        return stages
+    
+    async def upload_batch_async(self, tasks: Iterable[FileUploadTask], progress_bar: tqdm):
+        """
+        異步批量上傳，使用 tqdm 顯示進度
         
-        payload = {
-            'files': [{
-                'file': file_key,
-                'filename': original_filename
-            }]
+        上傳拆成 [hash →] presign → s3 → register 幾個階段，各階段有自己的佇列與 worker 數：
+        S3 傳輸進行時，預簽名 workers 會先替後面的檔案取得 URL，API 與 S3 連線都不會閒置。
+        tasks 可以是邊掃描邊產生的惰性來源，掃描與上傳同時進行。
+        """
+        self._stages = self._build_stages()
+        handlers = {
+            'hash': self._hash_stage,
+            'presign': self._presign_stage,
+            's3': self._s3_stage,
+            'register': self._register_stage,
         }
         
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
-    
-    async def upload_single_file(self, session: aiohttp.ClientSession, task: FileUploadTask) -> FileUploadTask:
-        """上傳單個檔案的完整流程"""
-        start_time = time.time()
+        total_workers = sum(stage.workers for stage in self._stages.values())
+        # 額外保留一個註冊批次的名額，等待批次送出的檔案不會讓前面的階段停下來
+        self._in_flight = asyncio.Semaphore(total_workers * 2 + self.config.register_batch_size)
+        connections = (
+            self.config.max_concurrent_uploads + self.config.presign_concurrency + self.config.register_concurrency
+        )
+        self._unfinished = 0
+        self._producer_done = False
+        self._all_done = asyncio.Event()
+        self._progress_bar = progress_bar
+        self._retry_heap = []
+        self._registrations = set()
+        self._retry_seq = itertools.count()
+        self._retry_wakeup = asyncio.Event()
+        self._reupload_bytes_saved = 0
+        self._processing_failed = []
+        self._replaced_files = []
+        self._pipeline_elapsed = 0.0
+        self._processing_throttled = 0
+        self._tracker = None
+        self._processing_slots = asyncio.Semaphore(self.config.max_processing) if self.config.max_processing > 0 else None
+        
+        if self.manifest is not None:
+            self._hash_executor = ThreadPoolExecutor(max_workers=self.config.hash_workers)
         
-        for retry in range(self.config.max_retries):
+        async with AsyncMaiAgentHelper(
+            self.api_key,
+            base_url=self.base_url,
+            limit=connections,
+            timeout_seconds=self.config.timeout_seconds,
+        ) as helper:
+            self._registrar = KnowledgeFileRegistrar(
+                helper,
+                self.knowledge_base_id,
+                max_batch_size=self.config.register_batch_size,
+                max_delay=self.config.register_batch_delay,
+                limiter=self.api_limiter,
+                max_concurrency=self.config.register_concurrency,
+            )
+            # 限制解析中的檔案數需要追蹤解析狀態
+            if self.config.wait_for_processing or self._processing_slots is not None:
+                self._tracker = ProcessingTracker(
+                    helper,
+                    self.knowledge_base_id,
+                    min_interval=self.config.processing_poll_interval,
+                    max_interval=self.config.processing_max_poll_interval,
+                    concurrency=self.config.list_concurrency,
+                    limiter=self.api_limiter,
+                )
+            workers = [
+                asyncio.ensure_future(self._stage_worker(stage, handlers[name], helper))
+                for name, stage in self._stages.items()
+                for _ in range(stage.workers)
+            ]
+            workers.append(asyncio.ensure_future(self._retry_scheduler()))
+            started = time.monotonic()
             try:
-                task.status = UploadStatus.UPLOADING
-                
-                upload_info = await self.get_upload_url(session, task.file_path)
-                
-                file_key = await self.upload_to_s3(session, task.file_path, upload_info)
-                
-                original_filename = os.path.basename(task.file_path)
-                response = await self.register_file(session, file_key, original_filename)
-                
-                # 從響應中提取 knowledge_file_id (響應是一個陣列)
-                if response and isinstance(response, list) and len(response) > 0 and 'id' in response[0]:
-                    task.knowledge_file_id = response[0]['id']
-                
-                task.status = UploadStatus.SUCCESS
-                task.upload_time = time.time() - start_time
-                
-                # 使用線程鎖來確保安全地添加到完成列表
-                with self._completed_lock:
-                    # 再次檢查是否已經在完成列表中
-                    if not any(t.file_path == task.file_path for t in self.completed_tasks):
-                        self.completed_tasks.append(task)
-                        self.save_checkpoint()
+                await self._produce_tasks(tasks, next(iter(self._stages.values())))
+                self._producer_done = True
+                if self._unfinished == 0:
+                    self._all_done.set()
                 
-                return task
+                # workers 只會因為程式錯誤而結束，此時直接拋出，避免永遠等待
+                done_waiter = asyncio.ensure_future(self._all_done.wait())
+                done, _ = await asyncio.wait([done_waiter, *workers], return_when=asyncio.FIRST_COMPLETED)
+                if done_waiter not in done:
+                    done_waiter.cancel()
+                    for w in done:
+                        w.result()
+                self._pipeline_elapsed = time.monotonic() - started
                 
-            except Exception as e:
-                task.retry_count = retry + 1
-                if retry < self.config.max_retries - 1:
-                    await asyncio.sleep(self.config.retry_delay * (retry + 1))
-                else:
-                    task.status = UploadStatus.FAILED
-                    task.error_message = str(e)
-                    self.logger.error(f"Failed to upload {task.file_path}: {e}")
-        
-        return task
-    
-    async def upload_batch_async(self, tasks: List[FileUploadTask], progress_bar: tqdm):
-        """異步批量上傳，使用 tqdm 顯示進度"""
-        semaphore = asyncio.Semaphore(self.config.max_concurrent_uploads)
-        
-        async def upload_with_semaphore(task):
-            async with semaphore:
-                result = await self.upload_single_file(session, task)
-                # 從待處理佇列中移除已處理的任務
-                if result.status == UploadStatus.SUCCESS:
-                    with self._completed_lock:
-                        # 從 tasks_queue 中移除已完成的任務
-                        try:
-                            self.tasks_queue.remove(task)
-                        except ValueError:
-                            pass  # 任務可能已被移除
+                if self.config.delete_replaced_files and self._replaced_files:
+                    await self._delete_replaced_files(helper)
                 
-                # 更新進度條
-                progress_bar.update(1)
-                if result.status == UploadStatus.SUCCESS:
-                    progress_bar.set_postfix(success=progress_bar.n - len(self.failed_tasks), 
-                                           failed=len(self.failed_tasks), 
-                                           refresh=True)
-                return result
-        
-        connector = aiohttp.TCPConnector(limit=self.config.max_concurrent_uploads)
-        timeout = aiohttp.ClientTimeout(total=self.config.timeout_seconds)
-        
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            upload_tasks = []
-            
-            for task in tasks:
-                if self._shutdown:
-                    break
-                upload_tasks.append(upload_with_semaphore(task))
-            
-            results = await asyncio.gather(*upload_tasks, return_exceptions=True)
-            
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    tasks[i].status = UploadStatus.FAILED
-                    tasks[i].error_message = str(result)
-                    self.failed_tasks.append(tasks[i])
-                    # 從待處理佇列中移除失敗的任務
-                    with self._completed_lock:
-                        try:
-                            self.tasks_queue.remove(tasks[i])
-                        except ValueError:
-                            pass
-                elif result.status == UploadStatus.SUCCESS:
-                    # 成功的任務已經在 upload_single_file 中添加到 completed_tasks 並儲存了 checkpoint
-                    pass
-                else:
-                    self.failed_tasks.append(result)
-                    # 從待處理佇列中移除失敗的任務
-                    with self._completed_lock:
-                        try:
-                            self.tasks_queue.remove(result)
-                        except ValueError:
-                            pass
+                if self.config.wait_for_processing and self._tracker.pending_count:
+                    # 上傳已結束，輪詢不再與上傳搶 API 並發數
+                    self.logger.info(f"Waiting for {self._tracker.pending_count} files to finish processing...")
+                    await self._tracker.wait_all()
+                elif self._tracker is not None and self._tracker.pending_count:
+                    self.logger.info(f"{self._tracker.pending_count} files are still processing on the server")
+            finally:
+                if not self._pipeline_elapsed:
+                    self._pipeline_elapsed = time.monotonic() - started
+                for w in [*workers, *self._registrations]:
+                    w.cancel()
+                await asyncio.gather(*workers, *self._registrations, return_exceptions=True)
+                await self._registrar.close()
+                if self._tracker is not None:
+                    await self._tracker.close()
+                if self._hash_executor is not None:
+                    self._hash_executor.shutdown(wait=False)
+                    self._hash_executor = None
+    
+    def stage_summary(self) -> Dict[str, Dict[str, Any]]:
+        """各階段的完成數、失敗數、每秒處理量與 worker 使用率"""
+        summary = {name: stage.summary(self._pipeline_elapsed) for name, stage in self._stages.items()}
+        if 'register' in summary and self._registrar is not None:
+            summary['register']['requests'] = self._registrar.requests_sent
+        return summary
+    
+    def _api_helper(self) -> AsyncMaiAgentHelper:
+        return AsyncMaiAgentHelper(
+            self.api_key,
+            base_url=self.base_url,
+            limit=self.config.list_concurrency,
+            timeout_seconds=self.config.timeout_seconds,
+        )
+    
+    @staticmethod
+    def _kb_file_info(file_id: str, filename: str, created_at, status: str) -> Dict[str, Any]:
+        # createdAt 是時間戳，轉換為可讀格式
+        if created_at and str(created_at).isdigit():
+            created_at = datetime.fromtimestamp(int(created_at) / 1000).isoformat()
+        return {
+            'id': file_id,
+            'filename': filename or '',
+            'created_at': created_at or '',
+            'status': status or ''
+        }
+    
+    async def iter_knowledge_files(self, helper: AsyncMaiAgentHelper) -> AsyncIterator[Dict[str, Any]]:
+        """
+        逐筆產生知識庫中的檔案
+        
+        啟用本機鏡像時先增量同步再從鏡像讀取；否則分頁並行抓取，已處理的分頁不會留在記憶體中。
+        """
+        if self.kb_mirror is not None:
+            fetched = await self.kb_mirror.sync(
+                helper, self.knowledge_base_id, concurrency=self.config.list_concurrency
+            )
+            self.logger.info(f"Synced {fetched} files into the local KB mirror")
+            for file in self.kb_mirror.iter_files(self.knowledge_base_id):
+                yield self._kb_file_info(file['id'], file['filename'], file['created_at'], file['status'])
+            return
+        
+        async for file in helper.iter_knowledge_base_files(
+            self.knowledge_base_id, page_size=100, prefetch=self.config.list_concurrency
+        ):
+            file_id = file.get('id', '')
+            if file_id:
+                yield self._kb_file_info(file_id, file.get('filename'), file.get('createdAt'), file.get('status'))
     
     async def get_all_knowledge_files(self) -> Dict[str, Dict[str, Any]]:
-        """獲取知識庫中所有檔案的詳細資訊，返回以 id 為 key 的字典"""
-        all_files = {}
-        page = 1
+        """獲取知識庫中所有檔案的詳細資訊，返回以 id 為 key 的字典（大型知識庫請改用 iter_knowledge_files）"""
+        async with self._api_helper() as helper:
+            return {file['id']: file async for file in self.iter_knowledge_files(helper)}
+    
+    async def check_upload_integrity(self):
+        """
+        檢查上傳完整性，識別重複和漏傳的檔案
+        
+        知識庫的檔案清單邊抓取邊比對：記憶體中只保留本工具上傳過的 ID，
+        額外檔案逐筆寫入暫存檔，數十萬檔案的知識庫也不會把整個清單載入記憶體。
+        """
+        self.logger.info("Checking upload integrity...")
         
+        total_uploaded_files = self.checkpoint_store.completed_count()
+        if not total_uploaded_files and not self.checkpoint_store.failed_files():
+            self.logger.warning("No checkpoint found for integrity check")
+            return
+        
+        # 從 checkpoint 中獲取所有上傳的 file IDs；知識庫中出現過的會被移除，最後剩下的就是漏傳
+        unseen_ids = self.checkpoint_store.uploaded_file_ids()
+        total_uploaded_ids = len(unseen_ids)
+        total_kb_files = 0
+        extra_count = 0
+        extra_spool_file = os.path.join(self.report_dir, '.extra_files.jsonl')
+        
+        self.logger.info("Fetching knowledge base files...")
         try:
-            import requests
-            from tqdm.contrib.logging import logging_redirect_tqdm
-            import datetime
-            
-            self.logger.info("Fetching knowledge base files...")
-            
-            # 先獲取第一頁來了解總數
-            url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/?page=1&page_size=100"
-            headers = {'Authorization': f'Api-Key {self.api_key}'}
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            first_page = response.json()
-            
-            # 估算總頁數（如果有 count 欄位）
-            total_count = first_page.get('count', 0)
-            per_page = len(first_page.get('results', []))
-            estimated_pages = (total_count // per_page) + (1 if total_count % per_page > 0 else 0) if per_page > 0 else 1
-            
-            self.logger.info(f"Estimated {total_count} files across {estimated_pages} pages")
-            
-            # 使用 tqdm 顯示分頁進度
-            with logging_redirect_tqdm():
-                with tqdm(total=estimated_pages, desc="Fetching KB pages", unit="pages") as pbar:
-                    
-                    # 處理第一頁
-                    if 'results' in first_page:
-                        for file in first_page['results']:
-                            file_id = file.get('id', '')
-                            filename = file.get('filename', '')
-                            if file_id:
-                                # createdAt 是時間戳，轉換為可讀格式
-                                created_at = file.get('createdAt', '')
-                                if created_at and str(created_at).isdigit():
-                                    created_at = datetime.datetime.fromtimestamp(int(created_at) / 1000).isoformat()
-                                
-                                all_files[file_id] = {
-                                    'id': file_id,
-                                    'filename': filename,
-                                    'created_at': created_at,
-                                    'status': file.get('status', '')
-                                }
-                    pbar.update(1)
-                    
-                    # 處理後續頁面
-                    page = 2
-                    while first_page.get('next'):
-                        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/?page={page}"
-                        response = requests.get(url, headers=headers, timeout=30)
-                        response.raise_for_status()
-                        data = response.json()
-                        
-                        if 'results' in data:
-                            for file in data['results']:
-                                file_id = file.get('id', '')
-                                filename = file.get('filename', '')
-                                if file_id:
-                                    created_at = file.get('createdAt', '')
-                                    if created_at and str(created_at).isdigit():
-                                        created_at = datetime.datetime.fromtimestamp(int(created_at) / 1000).isoformat()
-                                    
-                                    all_files[file_id] = {
-                                        'id': file_id,
-                                        'filename': filename,
-                                        'created_at': created_at,
-                                        'status': file.get('status', '')
-                                    }
-                        
+            with open(extra_spool_file, 'w') as spool, logging_redirect_tqdm(), \
+                    tqdm(desc="Fetching KB files", unit="files") as pbar:
+                async with self._api_helper() as helper:
+                    async for file in self.iter_knowledge_files(helper):
+                        total_kb_files += 1
                         pbar.update(1)
+                        if file['id'] in unseen_ids:
+                            unseen_ids.discard(file['id'])
+                            continue
                         
-                        if not data.get('next'):
-                            break
-                        page += 1
-                        first_page = data  # 更新用於檢查 next
-            
-            self.logger.info(f"Successfully fetched {len(all_files)} files from knowledge base")
-            return all_files
-            
+                        # 檢查額外檔案（在知識庫但不在 checkpoint 記錄中）
+                        extra_count += 1
+                        if extra_count == 1:
+                            self.logger.info("Extra files in KB (not in upload records), may be duplicates or uploaded by other methods:")
+                        if extra_count <= 10:
+                            self.logger.info(f"  - {file['filename']} (ID: {file['id']})")
+                        spool.write(json.dumps({
+                            'filename': file['filename'],
+                            'knowledge_file_id': file['id'],
+                            'created_at': file['created_at']
+                        }) + '\n')
         except Exception as e:
+            # 清單不完整時無法判斷漏傳，不產生報告，也不更動 manifest
             self.logger.error(f"Failed to get knowledge base files: {e}")
-            return all_files
-    
-    async def check_upload_integrity(self):
-        """檢查上傳完整性，識別重複和漏傳的檔案"""
-        self.logger.info("Checking upload integrity...")
-        
-        # 獲取知識庫中所有檔案 (以 ID 為 key)
-        kb_files = await self.get_all_knowledge_files()
-        kb_file_ids = set(kb_files.keys())
-        
-        # 從 checkpoint 載入所有已上傳的檔案
-        checkpoint = self.load_checkpoint()
-        if not checkpoint:
-            self.logger.warning("No checkpoint found for integrity check")
+            os.remove(extra_spool_file)
             return
-            
-        uploaded_files = set(checkpoint.get('completed_files', []))
-        file_id_mapping = checkpoint.get('file_id_mapping', {})
         
-        # 從 checkpoint 中獲取所有上傳的 file IDs
-        uploaded_file_ids = set(file_id_mapping.values())
+        self.logger.info(f"Successfully fetched {total_kb_files} files from knowledge base")
         
         # 檢查漏傳（在 checkpoint 但不在知識庫中的 ID）
-        missing_ids = uploaded_file_ids - kb_file_ids
-        missing_files = []
-        for filepath, file_id in file_id_mapping.items():
-            if file_id in missing_ids:
-                missing_files.append({
-                    'filename': os.path.basename(filepath),
-                    'filepath': filepath,
-                    'knowledge_file_id': file_id
-                })
-        
-        # 檢查額外檔案（在知識庫但不在 checkpoint 記錄中）
-        extra_ids = kb_file_ids - uploaded_file_ids
-        extra_files = []
-        for file_id in extra_ids:
-            if file_id in kb_files:
-                extra_files.append({
-                    'filename': kb_files[file_id]['filename'],
-                    'knowledge_file_id': file_id,
-                    'created_at': kb_files[file_id]['created_at']
-                })
+        missing_ids = unseen_ids
+        missing_files = [
+            {
+                'filename': os.path.basename(filepath),
+                'filepath': filepath,
+                'knowledge_file_id': file_id
+            }
+            for filepath, file_id in self.checkpoint_store.paths_for_file_ids(missing_ids)
+        ]
         
         # 輸出結果
+        # 已不在知識庫中的檔案從 manifest 移除，下次執行時才會重新上傳
+        if self.manifest is not None and missing_ids:
+            self.manifest.forget_files(self.knowledge_base_id, missing_ids)
+        
         if missing_files:
             self.logger.warning(f"Found {len(missing_files)} missing files (uploaded but not in KB):")
             self.logger.warning("These files may have been uploaded but later deleted by user, or upload failed:")
@@ -502,29 +924,30 @@ class BatchFileUploaderAdvanced:
             if len(missing_files) > 10:
                 self.logger.warning(f"  ... and {len(missing_files) - 10} more missing files")
         
-        if extra_files:
-            self.logger.info(f"Found {len(extra_files)} extra files in KB (not in upload records):")
-            self.logger.info("These files may be duplicates or uploaded by other methods:")
-            for file in extra_files[:10]:
-                self.logger.info(f"  - {file['filename']} (ID: {file['knowledge_file_id']})")
-        
-        # 儲存完整性檢查報告
-        integrity_report = {
-            'timestamp': datetime.now().isoformat(),
-            'summary': {
-                'total_kb_files': len(kb_files),
-                'total_uploaded_files': len(uploaded_files),
-                'total_uploaded_ids': len(uploaded_file_ids),
-                'missing': len(missing_files),
-                'extra': len(extra_files)
-            },
-            'missing_files': missing_files,
-            'extra_files': extra_files
+        if extra_count:
+            self.logger.info(f"Found {extra_count} extra files in KB (not in upload records)")
+        
+        # 儲存完整性檢查報告（額外檔案從暫存檔逐行串接）
+        summary = {
+            'total_kb_files': total_kb_files,
+            'total_uploaded_files': total_uploaded_files,
+            'total_uploaded_ids': total_uploaded_ids,
+            'missing': len(missing_files),
+            'extra': extra_count
         }
         
         report_file = os.path.join(self.report_dir, f"integrity_check_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-        with open(report_file, 'w') as f:
-            json.dump(integrity_report, f, indent=2)
+        with open(report_file, 'w') as f, open(extra_spool_file, 'r') as spool:
+            f.write('{\n  "timestamp": ' + json.dumps(datetime.now().isoformat()))
+            f.write(',\n  "summary": ')
+            f.write(json.dumps(summary, indent=2).replace('\n', '\n  '))
+            f.write(',\n  "missing_files": ')
+            f.write(json.dumps(missing_files, indent=2).replace('\n', '\n  '))
+            f.write(',\n  "extra_files": [')
+            for i, line in enumerate(spool):
+                f.write(('\n    ' if i == 0 else ',\n    ') + line.rstrip('\n'))
+            f.write('\n  ]\n}\n')
+        os.remove(extra_spool_file)
         
         self.logger.info(f"Integrity check report saved to {report_file}")
     
@@ -545,56 +968,87 @@ class BatchFileUploaderAdvanced:
             os.makedirs(self.report_dir, exist_ok=True)
             # 更新 checkpoint 檔案路徑
             self.checkpoint_file = os.path.join(self.checkpoint_dir, "upload_checkpoint.json")
+            self.checkpoint_db_file = os.path.join(self.checkpoint_dir, "upload_checkpoint.sqlite3")
+            if self._checkpoint_store is not None:
+                self._checkpoint_store.close()
+                self._checkpoint_store = None
         
         self.logger.info(f"Scanning directory: {directory}")
         self.logger.info(f"Output directory: {self.output_dir}")
         
-        all_tasks = self.scan_files(directory)
-        
-        checkpoint = self.load_checkpoint()
-        if checkpoint:
-            self.logger.info("Found checkpoint, resuming upload...")
-            completed_files = set(checkpoint.get('completed_files', []))
-            all_tasks = [task for task in all_tasks if task.file_path not in completed_files]
+        completed_count = self.checkpoint_store.completed_count()
+        if completed_count:
+            self.logger.info(f"Found checkpoint with {completed_count} completed files, resuming upload...")
         
         # 不再在開始時檢查已存在的檔案，改為最後比對
         
-        total_files = len(all_tasks)
-        self.logger.info(f"Found {total_files} files to upload")
-        
-        if total_files == 0:
-            self.logger.info("No files to upload")
-            return
-        
-        self.tasks_queue = deque(all_tasks)
-        # 取得已完成的檔案數量（如果有 checkpoint）
-        if checkpoint:
-            completed_files = set(checkpoint.get('completed_files', []))
-        
-        # Process all tasks at once
-        # 不要清空 tasks_queue，讓 upload_batch_async 在處理完成後逐個移除
-        all_upload_tasks = list(self.tasks_queue)
+        # 邊掃描邊上傳：任務登記在任務表中，狀態轉換時即時更新計數
+        self.tasks = TaskTable()
+        self._resumed_count = 0
+        self._changed_count = 0
+        self._total_upload_time = 0.0
+        self._success_spool_file = os.path.join(self.report_dir, '.successful_files.jsonl')
         
         if not self._shutdown:
             # 使用 tqdm 創建進度條，同時設置 logging 以避免衝突
-            import sys
-            from tqdm.contrib.logging import logging_redirect_tqdm
-            
-            with logging_redirect_tqdm():
-                with tqdm(total=len(all_upload_tasks), 
-                         desc="Uploading files",
-                         unit="files",
-                         ncols=120,
-                         position=0,
-                         leave=True,
-                         file=sys.stdout) as progress_bar:
-                    await self.upload_batch_async(all_upload_tasks, progress_bar)
+            with open(self._success_spool_file, 'w') as self._success_spool:
+                with logging_redirect_tqdm():
+                    with tqdm(total=0,
+                             desc="Uploading files",
+                             unit="files",
+                             ncols=120,
+                             position=0,
+                             leave=True,
+                             file=sys.stdout) as progress_bar:
+                        await self.upload_batch_async(self.iter_files(directory), progress_bar)
+            self._success_spool = None
+        
+        total_files = self.tasks.total
+        if total_files == 0:
+            os.remove(self._success_spool_file)
+            self.logger.info(f"No files to upload ({self._resumed_count} already completed)")
+            return
         
         print()
         self.logger.info("Upload process completed")
-        self.logger.info(f"Total files: {total_files}")
-        self.logger.info(f"Successfully uploaded: {len(self.completed_tasks)}")
-        self.logger.info(f"Failed uploads: {len(self.failed_tasks)}")
+        self.logger.info(f"Total files: {total_files} (plus {self._resumed_count} already completed)")
+        if self.config.incremental_scan:
+            self.logger.info(f"Changed since last upload: {self._changed_count}")
+            if self._replaced_files:
+                deleted = sum(1 for entry in self._replaced_files if entry['deleted'])
+                self.logger.info(
+                    f"Replaced previous versions: {len(self._replaced_files)} ({deleted} deleted from the KB)"
+                )
+        self.logger.info(f"Successfully uploaded: {self.tasks.count(UploadStatus.SUCCESS)}")
+        self.logger.info(f"Skipped (same content already in KB): {self.tasks.count(UploadStatus.SKIPPED)}")
+        self.logger.info(f"Failed uploads: {self.tasks.count(UploadStatus.FAILED)}")
+        for name, stats in self.stage_summary().items():
+            self.logger.info(
+                f"Stage {name}: {stats['completed']} done, {stats['failed']} failed, "
+                f"{stats['throughput_per_sec']}/s, utilization {stats['utilization']:.0%} of {stats['workers']} workers"
+            )
+        if self._registrar is not None:
+            self.logger.info(
+                f"Registered {self._registrar.files_registered} files in {self._registrar.requests_sent} requests"
+            )
+        if self._reupload_bytes_saved:
+            self.logger.info(
+                f"Registration retries reused uploaded S3 objects: "
+                f"{self._reupload_bytes_saved / (1024 * 1024):.1f} MiB not re-uploaded"
+            )
+        if self._tracker is not None:
+            counts = self._tracker.status_counts
+            self.logger.info(
+                f"Processing status: {counts['done']} done, {counts['failed']} failed "
+                f"({self._tracker.requests_sent} status requests)"
+            )
+        if self._processing_slots is not None:
+            self.logger.info(
+                f"{self._processing_throttled} registrations waited to stay under "
+                f"{self.config.max_processing} files processing"
+            )
+        
+        self.save_checkpoint()
         
         # 在上傳完成後進行檔案比對
         await self.check_upload_integrity()
@@ -603,34 +1057,47 @@ class BatchFileUploaderAdvanced:
     
     def save_final_report(self):
         """儲存最終上傳報告"""
-        report = {
-            'summary': {
-                'total_files': len(self.completed_tasks) + len(self.failed_tasks),
-                'successful_uploads': len(self.completed_tasks),
-                'failed_uploads': len(self.failed_tasks),
-                'average_upload_time': sum(t.upload_time for t in self.completed_tasks if t.upload_time) / len(self.completed_tasks) if self.completed_tasks else 0
-            },
-            'successful_files': [
-                {
-                    'file_path': task.file_path,
-                    'file_size': task.file_size,
-                    'upload_time': task.upload_time
-                }
-                for task in self.completed_tasks
-            ],
-            'failed_files': [
-                {
-                    'file_path': task.file_path,
-                    'error': task.error_message,
-                    'retry_count': task.retry_count
-                }
-                for task in self.failed_tasks
-            ]
+        uploaded_count = self.tasks.count(UploadStatus.SUCCESS)
+        summary = {
+            'total_files': self.tasks.count(UploadStatus.SUCCESS, UploadStatus.SKIPPED, UploadStatus.FAILED),
+            'successful_uploads': uploaded_count,
+            'skipped_duplicates': self.tasks.count(UploadStatus.SKIPPED),
+            'failed_uploads': self.tasks.count(UploadStatus.FAILED),
+            'average_upload_time': self._total_upload_time / uploaded_count if uploaded_count else 0
         }
+        if self._tracker is not None:
+            summary['processing_done'] = self._tracker.status_counts['done']
+            summary['processing_failed'] = self._tracker.status_counts['failed']
+        failed_files = [
+            {
+                'file_path': task.file_path,
+                'error': task.error_message,
+                'retry_count': task.retry_count,
+                'completed_stage': task.completed_stage
+            }
+            for task in self.tasks.with_status(UploadStatus.FAILED)
+        ]
         
         report_file = os.path.join(self.report_dir, f"upload_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-        with open(report_file, 'w') as f:
-            json.dump(report, f, indent=2)
+        # 成功的檔案已在上傳過程中逐筆寫入暫存檔，這裡逐行串接，不需要把整份清單載入記憶體
+        with open(report_file, 'w') as f, open(self._success_spool_file, 'r') as spool:
+            f.write('{\n  "summary": ')
+            f.write(json.dumps(summary, indent=2).replace('\n', '\n  '))
+            f.write(',\n  "pipeline_stages": ')
+            f.write(json.dumps(self.stage_summary(), indent=2).replace('\n', '\n  '))
+            f.write(',\n  "successful_files": [')
+            for i, line in enumerate(spool):
+                f.write(('\n    ' if i == 0 else ',\n    ') + line.rstrip('\n'))
+            f.write('\n  ],\n  "failed_files": ')
+            f.write(json.dumps(failed_files, indent=2).replace('\n', '\n  '))
+            if self._replaced_files:
+                f.write(',\n  "replaced_files": ')
+                f.write(json.dumps(self._replaced_files, indent=2).replace('\n', '\n  '))
+            if self._tracker is not None:
+                f.write(',\n  "processing_failed_files": ')
+                f.write(json.dumps(self._processing_failed, indent=2).replace('\n', '\n  '))
+            f.write('\n}\n')
+        os.remove(self._success_spool_file)
         
         self.logger.info(f"Final report saved to {report_file}")
 
@@ -644,7 +1111,9 @@ async def main():
         max_concurrent_uploads=10,
         max_retries=3,
         retry_delay=2.0,
-        timeout_seconds=300
+        timeout_seconds=300,
+        adaptive_concurrency=True,
+        initial_concurrent_uploads=4,
     )
     
     uploader = BatchFileUploaderAdvanced(API_KEY, KNOWLEDGE_BASE_ID, config, source_directory=FILES_DIRECTORY)
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class CheckpointStore:
+    """
+    SQLite (WAL) checkpoint store for BatchFileUploaderAdvanced
+
+    每完成一個檔案只寫入一列（O(1)），不再重新讀取並覆寫整個 JSON 檔案。
+    每 compact_every 次寫入執行一次 WAL checkpoint，避免 WAL 檔案無限成長。
+
+    舊版的 upload_checkpoint.json 會在第一次開啟時自動匯入；export_json() 可輸出相同格式的快照，
+    供人工檢視或其他工具讀取。
+    """
+
+    def __init__(self, db_path: str, legacy_json_path: str = None, compact_every: int = 10000):
+        """
+        Args:
+            db_path: SQLite 檔案路徑
+            legacy_json_path: 舊版 JSON checkpoint 路徑，資料庫為空時會匯入
+            compact_every: 每幾次寫入執行一次 WAL checkpoint
+        """
+        self.db_path = db_path
+        self.compact_every = compact_every
+        self._writes_since_compact = 0
+        # 中斷處理（SIGINT）可能在同一執行緒持有鎖時觸發，因此使用可重入鎖
+        self._lock = threading.RLock()
+
+        # 上傳流程與中斷處理可能在不同執行緒呼叫，統一以 _lock 保護連線
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS completed (
+                file_path TEXT PRIMARY KEY,
+                knowledge_file_id TEXT,
+                completed_at REAL NOT NULL,
+                size INTEGER,
+                mtime_ns INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS failed (
+                file_path TEXT PRIMARY KEY,
+                error TEXT,
+                failed_at REAL NOT NULL
+            );
+            """
+        )
+        # 早期建立的資料庫沒有 size / mtime_ns 欄位
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(completed)")}
+        for column in ('size', 'mtime_ns'):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE completed ADD COLUMN {column} INTEGER")
+        # 完整性檢查以 knowledge_file_id 反查檔案路徑
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_file_id ON completed (knowledge_file_id)")
+        self.conn.commit()
+
+        if legacy_json_path and os.path.exists(legacy_json_path) and self.completed_count() == 0:
+            self._import_json(legacy_json_path)
+
+    def _import_json(self, json_path: str):
+        """匯入舊版 JSON checkpoint"""
+        with open(json_path, 'r') as f:
+            data = json.load(f)
+
+        now = time.time()
+        mapping = data.get('file_id_mapping', {})
+        completed = set(data.get('completed_files', [])) | set(mapping)
+        failed = [item if isinstance(item, (list, tuple)) else (item, None) for item in data.get('failed_files', [])]
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO completed (file_path, knowledge_file_id, completed_at) VALUES (?, ?, ?)",
+                ((path, mapping.get(path), now) for path in completed),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO failed (file_path, error, failed_at) VALUES (?, ?, ?)",
+                ((path, error, now) for path, error in failed),
+            )
+
+    def _after_write(self):
+        # 呼叫端需持有 _lock，且交易已提交
+        self._writes_since_compact += 1
+        if self._writes_since_compact >= self.compact_every:
+            self._writes_since_compact = 0
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def mark_completed(
+        self,
+        file_path: str,
+        knowledge_file_id: Optional[str] = None,
+        size: Optional[int] = None,
+        mtime_ns: Optional[int] = None,
+    ):
+        """記錄完成的檔案；size / mtime_ns 供下次增量掃描判斷檔案是否變更"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO completed (file_path, knowledge_file_id, completed_at, size, mtime_ns) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (file_path, knowledge_file_id, time.time(), size, mtime_ns),
+                )
+                self.conn.execute("DELETE FROM failed WHERE file_path = ?", (file_path,))
+            self._after_write()
+
+    def mark_failed(self, file_path: str, error: Optional[str]):
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO failed (file_path, error, failed_at) VALUES (?, ?, ?)",
+                    (file_path, error, time.time()),
+                )
+            self._after_write()
+
+    def completed_count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM completed").fetchone()[0]
+
+    def completed_record(self, file_path: str) -> Optional[Tuple[Optional[int], Optional[int], Optional[str]]]:
+        """已完成時回傳 (size, mtime_ns, knowledge_file_id)，未完成時回傳 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, knowledge_file_id FROM completed WHERE file_path = ?", (file_path,)
+            ).fetchone()
+            return tuple(row) if row else None
+
+    def completed_paths(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self.conn.execute("SELECT file_path FROM completed")}
+
+    def file_id_mapping(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(
+                self.conn.execute(
+                    "SELECT file_path, knowledge_file_id FROM completed WHERE knowledge_file_id IS NOT NULL"
+                )
+            )
+
+    def uploaded_file_ids(self) -> Set[str]:
+        with self._lock:
+            return {
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT DISTINCT knowledge_file_id FROM completed WHERE knowledge_file_id IS NOT NULL"
+                )
+            }
+
+    def paths_for_file_ids(self, knowledge_file_ids: Iterable[str]) -> List[Tuple[str, str]]:
+        """回傳 (file_path, knowledge_file_id)，依 ID 分批查詢"""
+        ids = list(knowledge_file_ids)
+        rows = []
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows.extend(
+                    tuple(row)
+                    for row in self.conn.execute(
+                        f"SELECT file_path, knowledge_file_id FROM completed WHERE knowledge_file_id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+        return rows
+
+    def failed_files(self) -> List[Tuple[str, Optional[str]]]:
+        with self._lock:
+            return [tuple(row) for row in self.conn.execute("SELECT file_path, error FROM failed")]
+
+    def load(self) -> Optional[dict]:
+        """回傳與舊版 JSON checkpoint 相同格式的內容；沒有任何紀錄時回傳 None"""
+        completed = self.completed_paths()
+        failed = self.failed_files()
+        if not completed and not failed:
+            return None
+        return {
+            'completed_files': list(completed),
+            'file_id_mapping': self.file_id_mapping(),
+            'failed_files': failed,
+        }
+
+    def compact(self):
+        """把 WAL 寫回主資料庫並截斷 WAL 檔案"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._writes_since_compact = 0
+
+    def export_json(self, json_path: str, pending_files: Iterable[str] = ()):
+        """輸出舊版格式的 JSON 快照（先寫暫存檔再取代，中斷時不會留下不完整的檔案）"""
+        data = self.load() or {'completed_files': [], 'file_id_mapping': {}, 'failed_files': []}
+        snapshot = {
+            'timestamp': datetime.now().isoformat(),
+            'completed_files': data['completed_files'],
+            'file_id_mapping': data['file_id_mapping'],
+            'failed_files': data['failed_files'],
+            'pending_files': list(pending_files),
+        }
+        tmp_path = f"{json_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, json_path)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
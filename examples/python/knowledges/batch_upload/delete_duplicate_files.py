@@ -1,22 +1,34 @@
 import sys
 import os
 import json
-import time
+import asyncio
 from datetime import datetime
+from tqdm import tqdm
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from utils import MaiAgentHelper
+from utils import AdaptiveConcurrencyLimiter, AsyncMaiAgentHelper, KnowledgeFileDeleter
+from kb_mirror import KnowledgeBaseMirror
 
 # Configuration - Replace with your actual values
 API_KEY = '<your-api-key>'
 KNOWLEDGE_BASE_ID = '<your-knowledge-base-id>'   # 你的知識庫 ID
 
+# Maximum number of concurrent batch-delete requests; the limiter ramps up to this while the API stays healthy
+MAX_CONCURRENT_DELETES = 16
+# Files deleted per batch-delete request
+DELETE_BATCH_SIZE = 100
+
 # Path to your integrity check report - Replace with your actual path
 INTEGRITY_REPORT_PATH = '<path-to-your-integrity-check-report>'  # e.g., 'upload_outputs/json_files_4e9ffa82/reports/....json'
 
+# Find duplicates in the local knowledge base mirror (kb_mirror.py) instead of an integrity report:
+# files with the same filename and size, keeping the earliest upload of each
+USE_LOCAL_MIRROR = False
+
 # Validation
 assert API_KEY != '<your-api-key>', 'Please set your API key'
 assert KNOWLEDGE_BASE_ID != '<your-knowledge-base-id>', 'Please set your knowledge base id'
-assert INTEGRITY_REPORT_PATH != '<path-to-your-integrity-check-report>', 'Please set the path to your integrity check report'
+assert USE_LOCAL_MIRROR or INTEGRITY_REPORT_PATH != '<path-to-your-integrity-check-report>', \
+    'Please set the path to your integrity check report'
 
 
 def load_duplicate_files(file_path: str):
@@ -53,6 +65,35 @@ def load_duplicate_files(file_path: str):
         return []
 
 
+def load_duplicate_files_from_mirror(mirror: KnowledgeBaseMirror):
+    """
+    Sync the local mirror and return files whose filename and size match an earlier upload
+    
+    Returns:
+        List of duplicate files to delete
+    """
+    async def sync():
+        async with AsyncMaiAgentHelper(API_KEY) as helper:
+            return await mirror.sync(helper, KNOWLEDGE_BASE_ID)
+    
+    fetched = asyncio.run(sync())
+    print(f"🔄 Synced {fetched} files into the local mirror ({mirror.count(KNOWLEDGE_BASE_ID)} total)")
+    
+    duplicate_files = [
+        {
+            'filename': file['filename'],
+            'knowledge_file_id': file['id'],
+            'created_at': file['created_at']
+        }
+        for file in mirror.duplicate_files(KNOWLEDGE_BASE_ID)
+    ]
+    if duplicate_files:
+        print(f"📋 Found {len(duplicate_files)} duplicate files in the local mirror")
+    else:
+        print("✅ No duplicate files found in the local mirror")
+    return duplicate_files
+
+
 def delete_duplicate_files(duplicate_files: list):
     """
     Delete duplicate files from knowledge base
@@ -64,8 +105,6 @@ def delete_duplicate_files(duplicate_files: list):
         print("❌ No files to delete")
         return
     
-    maiagent_helper = MaiAgentHelper(API_KEY)
-    
     print("=" * 60)
     print("Files to be deleted:")
     print("=" * 60)
@@ -93,50 +132,42 @@ def delete_duplicate_files(duplicate_files: list):
     print("\n🗑️  Starting deletion process...")
     print("-" * 40)
     
-    deleted_files = []
-    failed_deletions = []
-    
-    for i, file in enumerate(duplicate_files):
-        try:
-            file_id = file['knowledge_file_id']
-            filename = file['filename']
-            
-            # Delete file
-            maiagent_helper.delete_knowledge_file(KNOWLEDGE_BASE_ID, file_id)
-            deleted_files.append(file)
-            print(f"✓ Deleted: {filename}")
-            
-            # Progress indicator
-            if (i + 1) % 10 == 0:
-                print(f"   Progress: {i + 1}/{len(duplicate_files)}")
-            
-            # Rate limiting to avoid overwhelming the API
-            time.sleep(0.5)
-            
-        except Exception as e:
-            # Note: API might return 500 error even when deletion succeeds
-            if "500" in str(e) or "Internal Server Error" in str(e):
-                # Assume deletion was successful despite 500 error
-                deleted_files.append(file)
-                print(f"✓ Deleted: {filename} (API returned 500 but likely successful)")
-            elif "409" in str(e) or "Conflict" in str(e):
-                print(f"⚠️  Skipped: {filename} (file is being processed, cannot delete)")
-                failed_deletions.append({
-                    'file': file,
-                    'error': 'File is being processed'
-                })
-            else:
-                failed_deletions.append({
-                    'file': file,
-                    'error': str(e)
-                })
-                print(f"❌ Failed: {filename} - {e}")
+    async def delete_all():
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(4, MAX_CONCURRENT_DELETES),
+            max_limit=MAX_CONCURRENT_DELETES,
+        )
+        async with AsyncMaiAgentHelper(API_KEY, limit=MAX_CONCURRENT_DELETES) as helper:
+            deleter = KnowledgeFileDeleter(
+                helper,
+                KNOWLEDGE_BASE_ID,
+                batch_size=DELETE_BATCH_SIZE,
+                concurrency=MAX_CONCURRENT_DELETES,
+                limiter=limiter,
+            )
+            with tqdm(total=len(duplicate_files), desc="Deleting", unit="files") as pbar:
+                result = await deleter.delete(
+                    (file['knowledge_file_id'] for file in duplicate_files), on_progress=pbar.update
+                )
+            if not deleter.verified:
+                print("⚠️  Could not list the knowledge base to confirm deletions, using request results")
+            print(f"   {deleter.requests_sent} batch-delete requests")
+            return result
+    
+    deleted_ids, errors = asyncio.run(delete_all())
+    deleted_ids = set(deleted_ids)
+    deleted_files = [file for file in duplicate_files if file['knowledge_file_id'] in deleted_ids]
+    failed_deletions = [
+        {'file': file, 'error': errors[file['knowledge_file_id']]}
+        for file in duplicate_files
+        if file['knowledge_file_id'] in errors
+    ]
     
     # Save deletion log
     deletion_log = {
         'timestamp': datetime.now().isoformat(),
         'knowledge_base_id': KNOWLEDGE_BASE_ID,
-        'integrity_report_used': INTEGRITY_REPORT_PATH,
+        'integrity_report_used': None if USE_LOCAL_MIRROR else INTEGRITY_REPORT_PATH,
         'total_files': len(duplicate_files),
         'successful_deletions': len(deleted_files),
         'failed_deletions_count': len(failed_deletions),
@@ -174,6 +205,7 @@ def main():
     Usage:
     1. Set your API_KEY and KNOWLEDGE_BASE_ID at the top of this file  
     2. Set INTEGRITY_REPORT_PATH to point to your integrity check report
+       (or set USE_LOCAL_MIRROR = True to find duplicates by filename and size in the local mirror)
        Example: 'batch_upload/upload_outputs/json_files_4e9ffa82/reports/integrity_check_20250801_102645.json'
     3. Run: python delete_duplicate_files.py
     
@@ -189,15 +221,30 @@ def main():
     
     print("Knowledge Base Duplicate File Cleaner")
     print("====================================")
-    print(f"Using integrity report: {INTEGRITY_REPORT_PATH}")
+    if USE_LOCAL_MIRROR:
+        print("Using local knowledge base mirror")
+    else:
+        print(f"Using integrity report: {INTEGRITY_REPORT_PATH}")
     print()
     
     # Load and delete duplicate files
-    duplicate_files = load_duplicate_files(INTEGRITY_REPORT_PATH)
-    if duplicate_files:
-        delete_duplicate_files(duplicate_files)
-    else:
-        print("✅ No duplicate files to delete!")
+    mirror = KnowledgeBaseMirror() if USE_LOCAL_MIRROR else None
+    try:
+        if mirror is not None:
+            duplicate_files = load_duplicate_files_from_mirror(mirror)
+        else:
+            duplicate_files = load_duplicate_files(INTEGRITY_REPORT_PATH)
+        if not duplicate_files:
+            print("✅ No duplicate files to delete!")
+            return
+        result = delete_duplicate_files(duplicate_files)
+        if result and mirror is not None:
+            # Keep the local mirror in step with the deletions
+            deleted_files, _ = result
+            mirror.remove(KNOWLEDGE_BASE_ID, (file['knowledge_file_id'] for file in deleted_files))
+    finally:
+        if mirror is not None:
+            mirror.close()
 
 
 if __name__ == '__main__':
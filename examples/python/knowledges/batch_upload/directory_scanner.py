@@ -0,0 +1,119 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScannedFile:
+    path: str
+    size: int
+    mtime_ns: int
+
+
+def list_directory(path: str, skip_hidden: bool = True) -> Tuple[List[os.DirEntry], List[str]]:
+    """
+    列出單一目錄但不 stat，回傳 (檔案的 DirEntry, 子目錄)
+
+    判斷檔案或目錄時直接使用 DirEntry 的 d_type，不需要額外的 stat。
+    與 os.walk 相同，指向目錄的符號連結不會進入，隱藏檔案（. 開頭）會略過，隱藏目錄仍會掃描。
+    """
+    entries, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    if skip_hidden and entry.name.startswith('.'):
+                        continue
+                    entries.append(entry)
+                except OSError as e:
+                    logger.warning(f"Cannot access file {entry.path}: {e}")
+    except OSError as e:
+        logger.warning(f"Cannot scan directory {path}: {e}")
+    return entries, subdirs
+
+
+def stat_entries(entries: List[os.DirEntry]) -> List[ScannedFile]:
+    """每個檔案只呼叫一次 entry.stat() 同時取得大小與修改時間（Windows 上由 scandir 直接提供）"""
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+            files.append(ScannedFile(entry.path, stat.st_size, stat.st_mtime_ns))
+        except OSError as e:
+            logger.warning(f"Cannot access file {entry.path}: {e}")
+    return files
+
+
+def scan_directory(path: str, skip_hidden: bool = True) -> Tuple[List[ScannedFile], List[str]]:
+    """列出單一目錄並 stat 所有檔案，回傳 (檔案, 子目錄)"""
+    entries, subdirs = list_directory(path, skip_hidden)
+    return stat_entries(entries), subdirs
+
+
+def _scan_first_chunk(path: str, skip_hidden: bool, chunk_size: int):
+    """列出目錄並 stat 前 chunk_size 個檔案，其餘的 DirEntry 交由呼叫端分批處理"""
+    entries, subdirs = list_directory(path, skip_hidden)
+    return stat_entries(entries[:chunk_size]), entries[chunk_size:], subdirs
+
+
+class DirectoryScanner:
+    """
+    Lazy, parallel directory scanner
+
+    以 generator 逐一產生檔案，呼叫端不必等整個目錄樹掃描完。workers > 1 時多個目錄同時在背景執行緒中
+    列出並 stat；在 NFS / SMB 等網路檔案系統上，每次 readdir / stat 都要一次網路往返，平行處理可大幅縮短掃描時間。
+    單一目錄的檔案超過 stat_chunk_size 個時，其餘檔案每 stat_chunk_size 個一組分給其他執行緒 stat，
+    只有一個大目錄的資料集也能平行掃描。結果依目錄提交順序產生，輸出順序固定。
+
+    Usage:
+        for scanned in DirectoryScanner(workers=16).iter_files('/mnt/nfs/corpus'):
+            print(scanned.path, scanned.size)
+    """
+
+    def __init__(self, workers: int = 8, skip_hidden: bool = True, stat_chunk_size: int = 256):
+        self.workers = max(1, workers)
+        self.skip_hidden = skip_hidden
+        self.stat_chunk_size = max(1, stat_chunk_size)
+
+    def iter_files(self, root: str) -> Iterator[ScannedFile]:
+        if self.workers == 1:
+            pending = deque([root])
+            while pending:
+                files, subdirs = scan_directory(pending.popleft(), self.skip_hidden)
+                pending.extend(subdirs)
+                yield from files
+            return
+
+        # 同時最多 workers * 2 個目錄在處理中，其餘目錄只保留路徑
+        max_in_flight = self.workers * 2
+        chunk_size = self.stat_chunk_size
+        pending = deque([root])
+        in_flight = deque()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    in_flight.append(
+                        executor.submit(_scan_first_chunk, pending.popleft(), self.skip_hidden, chunk_size)
+                    )
+                files, remaining, subdirs = in_flight.popleft().result()
+                pending.extend(subdirs)
+                # 大目錄剩下的檔案分組平行 stat，依序產生以維持輸出順序
+                chunks = [
+                    executor.submit(stat_entries, remaining[start:start + chunk_size])
+                    for start in range(0, len(remaining), chunk_size)
+                ]
+                yield from files
+                for chunk in chunks:
+                    yield from chunk.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
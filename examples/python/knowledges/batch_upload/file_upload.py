@@ -0,0 +1,33 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+
+async def upload_single_file(helper, file_path: str, limiter, registrar) -> Tuple[bool, Dict[str, Any]]:
+    """
+    上傳單一檔案並註冊到知識庫，回傳 (是否成功, 報告用的紀錄)
+
+    fix_failed_files.py 與 upload_missing_files.py 共用：預簽名與 S3 上傳在 limiter 的名額內進行，
+    註冊則交給 registrar 與其他剛上傳完成的檔案合併成同一個請求。
+    """
+    original_filename = os.path.basename(file_path)
+    try:
+        async with limiter.slot():
+            upload_url = await helper.get_upload_url(file_path, 'chatbot-file')
+            file_key = await helper.upload_file_to_s3(file_path, upload_url)
+
+        knowledge_file = await registrar.register(file_key, original_filename)
+    except Exception as e:
+        return False, {
+            'file_path': file_path,
+            'filename': original_filename,
+            'error': str(e),
+            'upload_time': datetime.now().isoformat()
+        }
+
+    return True, {
+        'file_path': file_path,
+        'filename': original_filename,
+        'new_file_id': knowledge_file.get('id') if isinstance(knowledge_file, dict) else None,
+        'upload_time': datetime.now().isoformat()
+    }
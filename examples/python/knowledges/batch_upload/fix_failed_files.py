@@ -1,14 +1,22 @@
 import sys
 import os
 import json
-import time
 import asyncio
+import time
 import aiohttp
-import aiofiles
 from datetime import datetime
 from tqdm import tqdm
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import MaiAgentHelper
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils import (
+    AdaptiveConcurrencyLimiter,
+    AsyncMaiAgentHelper,
+    KnowledgeFileDeleter,
+    KnowledgeFileRegistrar,
+    ProcessingTracker,
+)
+from utils.rate_limiter import ITEM_ERROR_STATUSES
+from kb_mirror import KnowledgeBaseMirror
+from file_upload import upload_single_file
 
 # Configuration - Replace with your actual values
 API_KEY = '<your-api-key>'
@@ -16,11 +24,36 @@ KNOWLEDGE_BASE_ID = '<your-knowledge-base-id>'   # 你的知識庫 ID
 FILES_DIRECTORY = '<your-files-directory>'    # 你要上傳的檔案目錄
 STATUS_REPORT_PATH = '<path-to-your-status-report>'  # Path to status scan report, e.g., 'status_scan_20250801_124703.json'
 
+# Concurrency ceilings; the adaptive limiter ramps up to these while the API stays healthy
+MAX_CONCURRENT_DELETES = 16
+# Files deleted per batch-delete request
+DELETE_BATCH_SIZE = 100
+MAX_CONCURRENT_UPLOADS = 5
+# Files registered to the knowledge base per API call
+REGISTER_BATCH_SIZE = 50
+
+# Read failed files from the local knowledge base mirror (kb_mirror.py) instead of a status scan report
+USE_LOCAL_MIRROR = False
+
+# 'reparse': ask the server to parse the failed files again (no upload); files that cannot be reparsed
+#            or fail again fall back to delete + re-upload
+# 'reupload': always delete + re-upload
+FIX_MODE = 'reparse'
+# Optional parser overrides for reparsing, keyed by file extension (e.g. {'.pdf': '<parser-name>'});
+# by default only file ids are sent and the server keeps each file's current parser
+REPARSE_PARSERS = {}
+DEFAULT_REPARSE_PARSER = None
+REPARSE_BATCH_SIZE = 100          # Files per batch-reparse request
+MAX_CONCURRENT_REPARSES = 4
+WAIT_FOR_REPARSE = True           # Wait for reparsed files to finish, and re-upload those that fail again
+
 # Validation
 assert API_KEY != '<your-api-key>', 'Please set your API key'
 assert KNOWLEDGE_BASE_ID != '<your-knowledge-base-id>', 'Please set your knowledge base id'
 assert FILES_DIRECTORY != '<your-files-directory>', 'Please set your files directory'
-assert STATUS_REPORT_PATH != '<path-to-your-status-report>', 'Please set the path to your status scan report'
+assert FIX_MODE in ('reparse', 'reupload'), "FIX_MODE must be 'reparse' or 'reupload'"
+assert USE_LOCAL_MIRROR or STATUS_REPORT_PATH != '<path-to-your-status-report>', \
+    'Please set the path to your status scan report'
 
 
 class FailedFilesFixer:
@@ -28,10 +61,12 @@ class FailedFilesFixer:
         self.api_key = api_key
         self.knowledge_base_id = knowledge_base_id
         self.files_directory = files_directory
-        self.maiagent_helper = MaiAgentHelper(api_key)
         self.base_url = 'https://api.maiagent.ai/api/v1/'
         
         # Results tracking
+        self.reparsed_files = []
+        self.failed_reparses = []
+        self.reparse_still_failed = []
         self.deleted_files = []
         self.failed_deletions = []
         self.successful_uploads = []
@@ -55,7 +90,107 @@ class FailedFilesFixer:
             print(f"❌ Error reading status report: {e}")
             return []
     
-    def delete_failed_files(self, failed_files: list):
+    async def load_failed_files_from_mirror(self, mirror: KnowledgeBaseMirror):
+        """Sync the local mirror and return files whose status is 'failed'"""
+        async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url) as helper:
+            fetched = await mirror.sync(helper, self.knowledge_base_id)
+        print(f"🔄 Synced {fetched} files into the local mirror ({mirror.count(self.knowledge_base_id)} total)")
+        
+        failed_files = [
+            {'id': file['id'], 'filename': file['filename'], 'status': file['status'], 'created_at': file['created_at']}
+            for file in mirror.iter_files(self.knowledge_base_id, statuses=['failed'])
+        ]
+        print(f"📋 Found {len(failed_files)} failed files in the local mirror")
+        return failed_files
+    
+    @staticmethod
+    def reparse_entry(file: dict) -> dict:
+        """Build the batch-reparse payload entry for a file; a parser is only added when configured"""
+        extension = os.path.splitext(file.get('filename') or '')[1].lower()
+        parser = REPARSE_PARSERS.get(extension, DEFAULT_REPARSE_PARSER)
+        entry = {'id': file['id']}
+        if parser:
+            entry['parser'] = parser
+        return entry
+    
+    async def reparse_failed_files(self, failed_files: list):
+        """
+        Reparse failed files in place with chunked, concurrent batch-reparse requests
+        
+        失敗的檔案已經在知識庫中，只需要請伺服器重新解析，不必刪除後重新上傳。
+        批次請求回應 400 / 409 / 422 時逐一重送，只有無法重新解析的檔案會改用刪除並重新上傳。
+        WAIT_FOR_REPARSE 時會等待重新解析完成，再次失敗的檔案同樣改用刪除並重新上傳。
+        
+        Returns:
+            list: files that still need delete + re-upload
+        """
+        if not failed_files:
+            return []
+        
+        print("=" * 60)
+        print("Reparsing Failed Files")
+        print("=" * 60)
+        
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(2, MAX_CONCURRENT_REPARSES),
+            max_limit=MAX_CONCURRENT_REPARSES,
+        )
+        chunks = [failed_files[i:i + REPARSE_BATCH_SIZE] for i in range(0, len(failed_files), REPARSE_BATCH_SIZE)]
+        reparse_requested_at = {}
+        
+        async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url, limit=MAX_CONCURRENT_REPARSES + 1) as helper:
+            with tqdm(total=len(failed_files), desc="Reparsing", unit="files") as pbar:
+                async def reparse_chunk(chunk):
+                    try:
+                        async with limiter.slot():
+                            # Polls ignore a done/failed status older than this request (see ProcessingTracker)
+                            requested_at = int(time.time() * 1000)
+                            for file in chunk:
+                                reparse_requested_at[file['id']] = requested_at
+                            await helper.batch_reparse_knowledge_base_files(
+                                self.knowledge_base_id, [self.reparse_entry(file) for file in chunk]
+                            )
+                    except aiohttp.ClientResponseError as e:
+                        if len(chunk) > 1 and e.status in ITEM_ERROR_STATUSES:
+                            # One bad id rejects the whole request: resend one by one so only that file falls back
+                            await asyncio.gather(*(reparse_chunk([file]) for file in chunk))
+                            return
+                        self.failed_reparses.extend({'file': file, 'error': str(e)} for file in chunk)
+                    except Exception as e:
+                        self.failed_reparses.extend({'file': file, 'error': str(e)} for file in chunk)
+                    else:
+                        self.reparsed_files.extend(chunk)
+                    pbar.update(len(chunk))
+                    pbar.set_postfix(reparsed=len(self.reparsed_files),
+                                     failed=len(self.failed_reparses),
+                                     concurrency=limiter.limit)
+                
+                await asyncio.gather(*(reparse_chunk(chunk) for chunk in chunks))
+            
+            print(f"\n✅ Reparse requested: {len(self.reparsed_files)} files, {len(self.failed_reparses)} failed")
+            
+            if WAIT_FOR_REPARSE and self.reparsed_files:
+                print(f"⏳ Waiting for {len(self.reparsed_files)} files to finish parsing...")
+                async with ProcessingTracker(helper, self.knowledge_base_id, limiter=limiter) as tracker:
+                    with tqdm(total=len(self.reparsed_files), desc="Parsing", unit="files") as pbar:
+                        def on_processed(knowledge_file, file):
+                            pbar.update(1)
+                            if knowledge_file['status'] == 'failed':
+                                self.reparse_still_failed.append(file)
+                        
+                        for file in self.reparsed_files:
+                            tracker.track(
+                                file['id'],
+                                created_at=file.get('created_at'),
+                                callback=lambda knowledge_file, file=file: on_processed(knowledge_file, file),
+                                requested_at=reparse_requested_at.get(file['id']),
+                            )
+                        await tracker.wait_all()
+                print(f"✅ Parsing finished: {len(self.reparse_still_failed)} files failed again")
+        
+        return [entry['file'] for entry in self.failed_reparses] + self.reparse_still_failed
+    
+    async def delete_failed_files(self, failed_files: list):
         """Delete failed files from knowledge base"""
         if not failed_files:
             return []
@@ -81,122 +216,45 @@ class FailedFilesFixer:
         
         print("\n🗑️  Deleting failed files...")
         
-        for i, file in enumerate(failed_files):
-            try:
-                file_id = file['id']
-                filename = file['filename']
-                
-                self.maiagent_helper.delete_knowledge_file(self.knowledge_base_id, file_id)
-                self.deleted_files.append(file)
-                print(f"✓ Deleted: {filename}")
-                
-                if (i + 1) % 10 == 0:
-                    print(f"   Progress: {i + 1}/{len(failed_files)}")
-                
-                time.sleep(0.3)  # Rate limiting
-                
-            except Exception as e:
-                # Handle API returning 500 but deletion actually succeeding
-                if "500" in str(e) or "Internal Server Error" in str(e):
-                    self.deleted_files.append(file)
-                    print(f"✓ Deleted: {filename} (API returned 500 but likely successful)")
-                else:
-                    self.failed_deletions.append({'file': file, 'error': str(e)})
-                    print(f"❌ Failed to delete: {filename} - {e}")
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(4, MAX_CONCURRENT_DELETES),
+            max_limit=MAX_CONCURRENT_DELETES,
+        )
+        async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url, limit=MAX_CONCURRENT_DELETES) as helper:
+            deleter = KnowledgeFileDeleter(
+                helper,
+                self.knowledge_base_id,
+                batch_size=DELETE_BATCH_SIZE,
+                concurrency=MAX_CONCURRENT_DELETES,
+                limiter=limiter,
+            )
+            with tqdm(total=len(failed_files), desc="Deleting", unit="files") as pbar:
+                deleted_ids, errors = await deleter.delete(
+                    (file['id'] for file in failed_files), on_progress=pbar.update
+                )
+            if not deleter.verified:
+                print("⚠️  Could not list the knowledge base to confirm deletions, using request results")
+        
+        deleted_ids = set(deleted_ids)
+        self.deleted_files.extend(file for file in failed_files if file['id'] in deleted_ids)
+        self.failed_deletions.extend(
+            {'file': file, 'error': errors[file['id']]} for file in failed_files if file['id'] in errors
+        )
         
         print(f"\n✅ Deletion completed: {len(self.deleted_files)} deleted, {len(self.failed_deletions)} failed")
         return self.deleted_files
     
-    async def get_upload_url(self, session: aiohttp.ClientSession, file_path: str):
-        """Get presigned upload URL"""
-        url = f"{self.base_url}upload-presigned-url/"
-        headers = {
-            'Authorization': f'Api-Key {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        file_size = os.path.getsize(file_path)
-        filename = os.path.basename(file_path)
-        
-        payload = {
-            'filename': filename,
-            'modelName': 'chatbot-file',
-            'fieldName': 'file',
-            'fileSize': file_size
-        }
-        
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
-    
-    async def upload_to_s3(self, session: aiohttp.ClientSession, file_path: str, upload_info: dict):
-        """Upload file to S3"""
-        async with aiofiles.open(file_path, 'rb') as f:
-            file_data = await f.read()
-        
-        data = aiohttp.FormData()
-        for key, value in upload_info['fields'].items():
-            data.add_field(key, value)
-        
-        data.add_field('file', file_data, 
-                      filename=os.path.basename(file_path),
-                      content_type='application/octet-stream')
-        
-        upload_url = upload_info['url']
-        
-        async with session.post(upload_url, data=data) as response:
-            if response.status == 204:
-                return upload_info['fields']['key']
-            else:
-                error_text = await response.text()
-                raise Exception(f"S3 upload failed: {response.status} - {error_text}")
-    
-    async def register_file(self, session: aiohttp.ClientSession, file_key: str, original_filename: str):
-        """Register file to knowledge base"""
-        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/"
-        headers = {'Authorization': f'Api-Key {self.api_key}'}
-        
-        payload = {
-            'files': [{
-                'file': file_key,
-                'filename': original_filename
-            }]
-        }
-        
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
-    
-    async def upload_single_file(self, session: aiohttp.ClientSession, file_path: str):
+    async def upload_single_file(
+        self,
+        helper: AsyncMaiAgentHelper,
+        file_path: str,
+        limiter: AdaptiveConcurrencyLimiter,
+        registrar: KnowledgeFileRegistrar,
+    ):
         """Upload a single file"""
-        try:
-            upload_info = await self.get_upload_url(session, file_path)
-            file_key = await self.upload_to_s3(session, file_path, upload_info)
-            original_filename = os.path.basename(file_path)
-            response = await self.register_file(session, file_key, original_filename)
-            
-            # Extract new file ID
-            new_file_id = None
-            if response and isinstance(response, list) and len(response) > 0 and 'id' in response[0]:
-                new_file_id = response[0]['id']
-            
-            self.successful_uploads.append({
-                'file_path': file_path,
-                'filename': original_filename,
-                'new_file_id': new_file_id,
-                'upload_time': datetime.now().isoformat()
-            })
-            
-            return True
-            
-        except Exception as e:
-            self.failed_uploads.append({
-                'file_path': file_path,
-                'filename': os.path.basename(file_path),
-                'error': str(e),
-                'upload_time': datetime.now().isoformat()
-            })
-            return False
+        success, record = await upload_single_file(helper, file_path, limiter, registrar)
+        (self.successful_uploads if success else self.failed_uploads).append(record)
+        return success
     
     async def reupload_files(self, deleted_files: list):
         """Re-upload the deleted files"""
@@ -237,20 +295,25 @@ class FailedFilesFixer:
         print(f"\n🔄 Starting re-upload of {len(files_to_upload)} files...")
         
         # Upload files
-        connector = aiohttp.TCPConnector(limit=5)
-        timeout = aiohttp.ClientTimeout(total=300)
+        # Rate limiting: concurrency adapts to server responses, backs off on 429/5xx and honors Retry-After
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(2, MAX_CONCURRENT_UPLOADS),
+            max_limit=MAX_CONCURRENT_UPLOADS,
+        )
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url, limit=MAX_CONCURRENT_UPLOADS + 1) as helper, \
+                KnowledgeFileRegistrar(helper, self.knowledge_base_id, max_batch_size=REGISTER_BATCH_SIZE) as registrar:
             with tqdm(total=len(files_to_upload), desc="Re-uploading", unit="files") as pbar:
-                for file_path in files_to_upload:
-                    success = await self.upload_single_file(session, file_path)
+                async def upload_and_track(file_path):
+                    success = await self.upload_single_file(helper, file_path, limiter, registrar)
                     pbar.update(1)
                     
                     if success:
                         pbar.set_postfix(success=len(self.successful_uploads), 
-                                       failed=len(self.failed_uploads))
-                    
-                    await asyncio.sleep(0.1)
+                                       failed=len(self.failed_uploads),
+                                       concurrency=limiter.limit)
+                
+                await asyncio.gather(*(upload_and_track(file_path) for file_path in files_to_upload))
     
     def save_results(self):
         """Save operation results to log file"""
@@ -258,13 +321,20 @@ class FailedFilesFixer:
             'timestamp': datetime.now().isoformat(),
             'knowledge_base_id': self.knowledge_base_id,
             'files_directory': self.files_directory,
-            'status_report_used': STATUS_REPORT_PATH,
+            'status_report_used': None if USE_LOCAL_MIRROR else STATUS_REPORT_PATH,
+            'fix_mode': FIX_MODE,
             'summary': {
+                'reparsed_files': len(self.reparsed_files),
+                'failed_reparses': len(self.failed_reparses),
+                'reparse_still_failed': len(self.reparse_still_failed),
                 'deleted_files': len(self.deleted_files),
                 'failed_deletions': len(self.failed_deletions),
                 'successful_uploads': len(self.successful_uploads),
                 'failed_uploads': len(self.failed_uploads)
             },
+            'reparsed_files': self.reparsed_files,
+            'failed_reparses': self.failed_reparses,
+            'reparse_still_failed': self.reparse_still_failed,
             'deleted_files': self.deleted_files,
             'failed_deletions': self.failed_deletions,
             'successful_uploads': self.successful_uploads,
@@ -284,12 +354,14 @@ async def main():
     
     This script will:
     1. Read a status scan report to identify failed files
-    2. Delete the failed files from the knowledge base
-    3. Re-upload the files from the local directory
-    4. Save a detailed log of all operations
+    2. Reparse the failed files in place (FIX_MODE = 'reparse')
+    3. Delete the files that could not be reparsed (or every failed file in 'reupload' mode)
+    4. Re-upload those files from the local directory
+    5. Save a detailed log of all operations
     
     Usage:
     1. Set your API_KEY, KNOWLEDGE_BASE_ID, FILES_DIRECTORY, and STATUS_REPORT_PATH
+       (or set USE_LOCAL_MIRROR = True to read failed files from the local mirror)
     2. Make sure you have a status scan report with failed files
     3. Ensure the original files exist in FILES_DIRECTORY
     4. Run: python fix_failed_files.py
@@ -299,22 +371,51 @@ async def main():
     print("==================")
     print(f"Knowledge Base: {KNOWLEDGE_BASE_ID}")
     print(f"Files Directory: {FILES_DIRECTORY}")
-    print(f"Status Report: {STATUS_REPORT_PATH}")
+    print(f"Status Report: {'local mirror' if USE_LOCAL_MIRROR else STATUS_REPORT_PATH}")
+    print(f"Fix Mode: {FIX_MODE}")
     print()
     
     fixer = FailedFilesFixer(API_KEY, KNOWLEDGE_BASE_ID, FILES_DIRECTORY)
-    
-    # Load failed files
-    failed_files = fixer.load_failed_files(STATUS_REPORT_PATH)
-    if not failed_files:
-        print("✅ No failed files found!")
-        return
-    
-    # Delete failed files
-    deleted_files = fixer.delete_failed_files(failed_files)
-    if not deleted_files:
-        print("❌ No files were deleted, stopping...")
-        return
+    mirror = KnowledgeBaseMirror() if USE_LOCAL_MIRROR else None
+    try:
+        # Load failed files
+        if mirror is not None:
+            failed_files = await fixer.load_failed_files_from_mirror(mirror)
+        else:
+            failed_files = fixer.load_failed_files(STATUS_REPORT_PATH)
+        if not failed_files:
+            print("✅ No failed files found!")
+            return
+        
+        # Reparse in place; only files that cannot be reparsed fall back to delete + re-upload
+        if FIX_MODE == 'reparse':
+            failed_files = await fixer.reparse_failed_files(failed_files)
+            if mirror is not None:
+                mirror.set_status(KNOWLEDGE_BASE_ID, (file['id'] for file in fixer.reparsed_files), 'initial')
+                if WAIT_FOR_REPARSE:
+                    reparsed_ids = {file['id'] for file in fixer.reparsed_files}
+                    failed_again_ids = {file['id'] for file in fixer.reparse_still_failed}
+                    mirror.set_status(KNOWLEDGE_BASE_ID, reparsed_ids - failed_again_ids, 'done')
+                    mirror.set_status(KNOWLEDGE_BASE_ID, failed_again_ids, 'failed')
+            if not failed_files:
+                log_file = fixer.save_results()
+                print(f"\n✅ All {len(fixer.reparsed_files)} failed files were reparsed, no re-upload needed")
+                print(f"📄 Log saved to: {log_file}")
+                return
+            print(f"\n🔁 {len(failed_files)} files will fall back to delete + re-upload")
+        
+        # Delete failed files
+        deleted_files = await fixer.delete_failed_files(failed_files)
+        if not deleted_files:
+            print("❌ No files were deleted, stopping...")
+            fixer.save_results()
+            return
+        if mirror is not None:
+            # Keep the local mirror in step; the re-uploaded files are picked up by the next sync
+            mirror.remove(KNOWLEDGE_BASE_ID, (file['id'] for file in deleted_files))
+    finally:
+        if mirror is not None:
+            mirror.close()
     
     # Re-upload files
     await fixer.reupload_files(deleted_files)
@@ -325,6 +426,9 @@ async def main():
     print("\n" + "=" * 60)
     print("Operation Summary:")
     print("=" * 60)
+    if FIX_MODE == 'reparse':
+        print(f"🔄 Files reparsed: {len(fixer.reparsed_files)}")
+        print(f"❌ Reparse failures: {len(fixer.failed_reparses) + len(fixer.reparse_still_failed)}")
     print(f"🗑️  Files deleted: {len(fixer.deleted_files)}")
     print(f"❌ Delete failures: {len(fixer.failed_deletions)}")
     print(f"✅ Files re-uploaded: {len(fixer.successful_uploads)}")
@@ -0,0 +1,298 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from utils.file_listing import DESCENDING_ORDERING, DescendingPages, timestamp_ms
+
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_outputs', 'kb_mirror.sqlite3')
+
+# 之後還可能改變狀態的檔案，增量同步時會重新讀取
+ACTIVE_STATUSES = ('initial', 'processing')
+
+
+class KnowledgeBaseMirror:
+    """
+    Local SQLite mirror of knowledge-base file state
+
+    把知識庫檔案（id、檔名、大小、狀態、標籤、createdAt）同步到本機的 SQLite，
+    狀態統計、找出失敗或重複的檔案都變成毫秒級的本機查詢，不必每次重新抓取完整清單。
+
+    同步方式：
+    - 完整同步：並行抓取所有分頁，最後刪除這次沒有出現的檔案（已從知識庫刪除）
+    - 增量同步：分頁依 createdAt 由新到舊，逐頁讀取到「已同步的最新檔案」與
+      「最舊的 initial / processing 檔案」之前即停止，只重新讀取新檔案與狀態可能改變的檔案；
+      同步後本機筆數與 API 的 count 不一致（有檔案被刪除）時自動改為完整同步
+
+    Usage:
+        mirror = KnowledgeBaseMirror()
+        async with AsyncMaiAgentHelper(api_key) as helper:
+            await mirror.sync(helper, knowledge_base_id)
+        print(mirror.status_counts(knowledge_base_id))
+    """
+
+    def __init__(self, db_path: str = DEFAULT_MIRROR_PATH, overlap_seconds: float = 300.0):
+        """
+        Args:
+            db_path: SQLite 檔案路徑
+            overlap_seconds: 增量同步時往回多讀取的秒數，涵蓋建立時間較早、但較晚才出現在清單中的檔案
+        """
+        self.db_path = db_path
+        self.overlap_ms = int(overlap_seconds * 1000)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                knowledge_base_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                filename TEXT,
+                size INTEGER,
+                status TEXT,
+                labels TEXT,
+                created_at INTEGER,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (knowledge_base_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_status ON files (knowledge_base_id, status);
+            CREATE INDEX IF NOT EXISTS idx_files_filename ON files (knowledge_base_id, filename);
+            CREATE INDEX IF NOT EXISTS idx_files_created_at ON files (knowledge_base_id, created_at);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                knowledge_base_id TEXT PRIMARY KEY,
+                last_sync REAL,
+                last_full_sync REAL
+            );
+            """
+        )
+        self.conn.commit()
+
+    # ========== 同步 ==========
+
+    def _upsert(self, knowledge_base_id: str, files: Iterable[dict], synced_at: float) -> int:
+        rows = [
+            (
+                knowledge_base_id,
+                file['id'],
+                file.get('filename'),
+                file.get('fileSize', file.get('file_size')),
+                file.get('status'),
+                json.dumps(file.get('labels') or []),
+                timestamp_ms(file.get('createdAt')),
+                synced_at,
+            )
+            for file in files
+            if file.get('id')
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files "
+                "(knowledge_base_id, id, filename, size, status, labels, created_at, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def _mark_synced(self, knowledge_base_id: str, synced_at: float, full: bool):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (knowledge_base_id, last_sync, last_full_sync) VALUES (?, ?, ?) "
+                "ON CONFLICT(knowledge_base_id) DO UPDATE SET last_sync = excluded.last_sync, "
+                "last_full_sync = COALESCE(excluded.last_full_sync, sync_state.last_full_sync)",
+                (knowledge_base_id, synced_at, synced_at if full else None),
+            )
+
+    def last_sync(self, knowledge_base_id: str) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT last_sync FROM sync_state WHERE knowledge_base_id = ?", (knowledge_base_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def last_full_sync(self, knowledge_base_id: str) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT last_full_sync FROM sync_state WHERE knowledge_base_id = ?", (knowledge_base_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    async def full_sync(self, helper, knowledge_base_id: str, page_size: int = 100, concurrency: int = 8) -> int:
+        """並行抓取所有分頁並取代本機資料，回傳知識庫檔案數"""
+        synced_at = time.time()
+        batch = []
+        total = 0
+        async for file in helper.iter_knowledge_base_files(knowledge_base_id, page_size=page_size, prefetch=concurrency):
+            batch.append(file)
+            if len(batch) >= 1000:
+                total += self._upsert(knowledge_base_id, batch, synced_at)
+                batch = []
+        total += self._upsert(knowledge_base_id, batch, synced_at)
+
+        # 這次沒有出現的檔案已從知識庫刪除
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM files WHERE knowledge_base_id = ? AND synced_at < ?", (knowledge_base_id, synced_at)
+            )
+        self._mark_synced(knowledge_base_id, synced_at, full=True)
+        return total
+
+    async def incremental_sync(self, helper, knowledge_base_id: str, page_size: int = 100) -> Optional[int]:
+        """
+        只讀取新檔案與狀態可能改變的檔案，回傳讀取的檔案數
+
+        本機尚未同步過、清單沒有依 createdAt 由新到舊排列，或同步後筆數與 API 的 count 不一致時回傳 None，
+        需要完整同步。
+        """
+        if self.last_sync(knowledge_base_id) is None:
+            return None
+
+        newest, oldest_active = self.conn.execute(
+            "SELECT MAX(created_at), "
+            f"MIN(CASE WHEN status IN ({','.join('?' * len(ACTIVE_STATUSES))}) THEN created_at END) "
+            "FROM files WHERE knowledge_base_id = ?",
+            (*ACTIVE_STATUSES, knowledge_base_id),
+        ).fetchone()
+        stop_before = None
+        if newest is not None:
+            stop_before = newest - self.overlap_ms
+            if oldest_active is not None:
+                stop_before = min(stop_before, oldest_active)
+
+        synced_at = time.time()
+        page = 1
+        fetched = 0
+        total_count = None
+        pages = DescendingPages()
+        while True:
+            data = await helper.list_knowledge_base_files(
+                knowledge_base_id, page=page, page_size=page_size, ordering=DESCENDING_ORDERING
+            )
+            results = data.get('results', []) if isinstance(data, dict) else (data or [])
+            if total_count is None and isinstance(data, dict):
+                total_count = data.get('count')
+
+            # 只有確認清單由新到舊時才能依 stop_before 提前停止；伺服器忽略 ordering 時改為完整同步
+            if not pages.add(results):
+                return None
+            fetched += self._upsert(knowledge_base_id, results, synced_at)
+
+            # 整頁都早於 stop_before 時，更舊的檔案不會有變化
+            if pages.older_than(stop_before) or not isinstance(data, dict) or not data.get('next') or not results:
+                break
+            page += 1
+
+        if total_count is not None and total_count != self.count(knowledge_base_id):
+            return None
+        self._mark_synced(knowledge_base_id, synced_at, full=False)
+        return fetched
+
+    async def sync(
+        self,
+        helper,
+        knowledge_base_id: str,
+        full: bool = False,
+        full_sync_interval: float = 86400.0,
+        page_size: int = 100,
+        concurrency: int = 8,
+    ) -> int:
+        """
+        同步知識庫檔案；可以增量時只讀取有變化的部分，回傳讀取的檔案數
+
+        增量同步看不到較舊檔案的狀態變化（例如重新解析），因此距離上次完整同步超過
+        full_sync_interval 秒時改為完整同步。
+        """
+        last_full_sync = self.last_full_sync(knowledge_base_id)
+        if last_full_sync is None or time.time() - last_full_sync > full_sync_interval:
+            full = True
+        if not full:
+            fetched = await self.incremental_sync(helper, knowledge_base_id, page_size=page_size)
+            if fetched is not None:
+                return fetched
+        return await self.full_sync(helper, knowledge_base_id, page_size=page_size, concurrency=concurrency)
+
+    # ========== 本機更新 ==========
+
+    def remove(self, knowledge_base_id: str, file_ids: Iterable[str]) -> int:
+        """刪除檔案後同步移除本機紀錄"""
+        with self.conn:
+            cursor = self.conn.executemany(
+                "DELETE FROM files WHERE knowledge_base_id = ? AND id = ?",
+                ((knowledge_base_id, file_id) for file_id in file_ids),
+            )
+        return cursor.rowcount
+
+    def set_status(self, knowledge_base_id: str, file_ids: Iterable[str], status: str):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE files SET status = ? WHERE knowledge_base_id = ? AND id = ?",
+                ((status, knowledge_base_id, file_id) for file_id in file_ids),
+            )
+
+    # ========== 查詢 ==========
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'filename': row['filename'],
+            'size': row['size'],
+            'status': row['status'],
+            'labels': json.loads(row['labels']) if row['labels'] else [],
+            'created_at': row['created_at'],
+        }
+
+    def count(self, knowledge_base_id: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM files WHERE knowledge_base_id = ?", (knowledge_base_id,)
+        ).fetchone()[0]
+
+    def status_counts(self, knowledge_base_id: str) -> Dict[str, int]:
+        return dict(
+            self.conn.execute(
+                "SELECT status, COUNT(*) FROM files WHERE knowledge_base_id = ? GROUP BY status",
+                (knowledge_base_id,),
+            ).fetchall()
+        )
+
+    def get(self, knowledge_base_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT * FROM files WHERE knowledge_base_id = ? AND id = ?", (knowledge_base_id, file_id)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def iter_files(self, knowledge_base_id: str, statuses: Iterable[str] = None) -> Iterator[Dict[str, Any]]:
+        """依 createdAt 由新到舊逐筆產生檔案；statuses 指定時只產生這些狀態"""
+        query = "SELECT * FROM files WHERE knowledge_base_id = ?"
+        params: List[Any] = [knowledge_base_id]
+        if statuses is not None:
+            statuses = list(statuses)
+            query += f" AND status IN ({','.join('?' * len(statuses))})"
+            params.extend(statuses)
+        query += " ORDER BY created_at DESC, id"
+        for row in self.conn.execute(query, params):
+            yield self._to_dict(row)
+
+    def duplicate_files(self, knowledge_base_id: str) -> List[Dict[str, Any]]:
+        """
+        檔名與大小相同的檔案中，除了最早建立的那一個以外的其餘檔案
+
+        （大小未知的檔案只比對檔名）
+        """
+        rows = self.conn.execute(
+            """
+            SELECT * FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY filename, size ORDER BY created_at, id
+                ) AS copy_number
+                FROM files WHERE knowledge_base_id = ?
+            ) WHERE copy_number > 1
+            ORDER BY filename, created_at
+            """,
+            (knowledge_base_id,),
+        )
+        return [self._to_dict(row) for row in rows]
+
+    def close(self):
+        self.conn.close()
@@ -1,34 +1,90 @@
+import asyncio
 import json
+import os
+import sys
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils import AsyncMaiAgentHelper, ThreadedAdaptiveConcurrencyLimiter
+from utils.rate_limiter import OVERLOAD_STATUSES, TRANSIENT_ERRORS, parse_retry_after
+from kb_mirror import KnowledgeBaseMirror
 
 # Configuration - Replace with your actual values
 API_KEY = '<your-api-key>'
 KNOWLEDGE_BASE_ID = '<your-knowledge-base-id>'   # 你的知識庫 ID
 BASE_URL = 'https://api.maiagent.ai/api/v1/'
 
+# Query a local SQLite mirror of the knowledge base (kb_mirror.py) instead of crawling every page.
+# The first run performs a full sync; later runs only fetch new files and files still initial/processing.
+USE_LOCAL_MIRROR = True
+
 # Validation
 assert API_KEY != '<your-api-key>', 'Please set your API key'
 assert KNOWLEDGE_BASE_ID != '<your-knowledge-base-id>', 'Please set your knowledge base id'
 
+# 分頁請求遇到這些狀態碼時重試；其他 4xx（例如 401、404）重試也不會成功
+PAGE_RETRY_STATUSES = {408} | OVERLOAD_STATUSES
+
 
 class KnowledgeBaseStatusScanner:
-    def __init__(self, api_key: str, knowledge_base_id: str, base_url: str = BASE_URL):
+    def __init__(self, api_key: str, knowledge_base_id: str, base_url: str = BASE_URL, concurrency: int = 8):
         self.api_key = api_key
         self.knowledge_base_id = knowledge_base_id
         self.base_url = base_url
+        self.concurrency = concurrency
+        
+        # 共用連線池，連線數與並行頁數一致
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # 執行緒池只提供 concurrency 個工作執行緒，實際同時進行的請求數由自適應控制器決定：
+        # 遇到 429/5xx 降低並發，有 Retry-After 時暫停發出新請求
+        self.limiter = ThreadedAdaptiveConcurrencyLimiter(
+            initial_limit=min(4, concurrency), max_limit=concurrency
+        )
+        
+    def _fetch_page(self, page: int, page_size: int, retries: int) -> dict:
+        """Fetch a single page through the adaptive limiter, retrying 408/429/5xx and connection errors"""
+        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/"
+        headers = {'Authorization': f'Api-Key {self.api_key}'}
+        params = {'page': page, 'page_size': page_size}
         
-    def scan_files_by_status(self, max_pages: int = None, page_size: int = 100):
+        for attempt in range(retries + 1):
+            try:
+                with self.limiter.slot():
+                    response = self.session.get(url, headers=headers, params=params, timeout=30)
+                    response.raise_for_status()
+                    return response.json()
+            except requests.HTTPError as e:
+                if e.response.status_code not in PAGE_RETRY_STATUSES or attempt == retries:
+                    raise
+                if parse_retry_after(e.response.headers.get('Retry-After')) is not None:
+                    # 控制器已依 Retry-After 暫停，取得名額後重送即可
+                    continue
+            except TRANSIENT_ERRORS:
+                if attempt == retries:
+                    raise
+            time.sleep(0.5 * (2 ** attempt))
+        
+    def scan_files_by_status(self, max_pages: int = None, page_size: int = 100, page_retries: int = 3):
         """
         Scan knowledge base files and categorize by status
         
+        Pages are fetched concurrently through the adaptive limiter (at most `self.concurrency` at a
+        time, lower while the server returns 429/5xx). A page that still fails after `page_retries`
+        retries is recorded in the report instead of aborting the scan.
+        
         Args:
             max_pages: Maximum number of pages to scan (None for all pages)
             page_size: Number of files per page (default: 100)
+            page_retries: Number of retries for each failed page (default: 3)
         """
-        headers = {'Authorization': f'Api-Key {self.api_key}'}
-        
         print("=" * 60)
         print("Knowledge Base File Status Scanner")
         print("=" * 60)
@@ -42,17 +98,11 @@ class KnowledgeBaseStatusScanner:
             'other': []
         }
         
-        page = 1
-        total_scanned = 0
-        
         # Get total count from first page
-        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/?page=1&page_size={page_size}"
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+        first_page = self._fetch_page(1, page_size, page_retries)
         
-        total_count = data.get('count', 0)
-        per_page = len(data.get('results', []))
+        total_count = first_page.get('count', 0)
+        per_page = len(first_page.get('results', []))
         total_pages = (total_count // per_page) + (1 if total_count % per_page > 0 else 0) if per_page > 0 else 1
         
         scan_pages = min(max_pages or total_pages, total_pages)
@@ -64,56 +114,108 @@ class KnowledgeBaseStatusScanner:
             print(f"Will scan: {scan_pages:,} pages (limited)")
         else:
             print(f"Will scan: {scan_pages:,} pages (all)")
+        print(f"Concurrency: up to {self.concurrency} (adaptive)")
         print()
         
+        # 頁面完成順序不固定，先依頁碼暫存，最後再依序彙整
+        page_results = {1: first_page.get('results', [])}
+        failed_pages = {}
+        
         with tqdm(total=scan_pages, desc="Scanning", unit="pages") as pbar:
-            while page <= scan_pages:
-                try:
-                    url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/?page={page}&page_size={page_size}"
-                    response = requests.get(url, headers=headers, timeout=30)
-                    response.raise_for_status()
-                    data = response.json()
-                    
-                    if 'results' in data:
-                        for file in data['results']:
-                            status = file.get('status', 'unknown')
-                            file_info = {
-                                'id': file.get('id'),
-                                'filename': file.get('filename'),
-                                'status': status,
-                                'created_at': file.get('createdAt')
-                            }
-                            
-                            if status in status_count:
-                                status_count[status].append(file_info)
-                            else:
-                                status_count['other'].append(file_info)
-                            
-                            total_scanned += 1
-                    
+            pbar.update(1)
+            
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = {
+                    executor.submit(self._fetch_page, page, page_size, page_retries): page
+                    for page in range(2, scan_pages + 1)
+                }
+                for future in as_completed(futures):
+                    page = futures[future]
+                    try:
+                        page_results[page] = future.result().get('results', [])
+                    except Exception as e:
+                        failed_pages[page] = str(e)
+                        tqdm.write(f"Error on page {page} after {page_retries} retries: {e}")
                     pbar.update(1)
-                    
-                    if not data.get('next'):
-                        break
-                        
-                    page += 1
-                    
-                except Exception as e:
-                    print(f"\nError on page {page}: {e}")
-                    break
+        
+        total_scanned = 0
+        for page in sorted(page_results):
+            for file in page_results[page]:
+                status = file.get('status', 'unknown')
+                file_info = {
+                    'id': file.get('id'),
+                    'filename': file.get('filename'),
+                    'status': status,
+                    'created_at': file.get('createdAt')
+                }
+                
+                if status in status_count:
+                    status_count[status].append(file_info)
+                else:
+                    status_count['other'].append(file_info)
+                
+                total_scanned += 1
         
         # Display and save results
+        self._display_results(status_count, total_scanned, failed_pages)
+        report_path = self._save_report(status_count, total_scanned, failed_pages)
+        
+        return status_count, report_path
+    
+    def scan_files_from_mirror(self, mirror: KnowledgeBaseMirror, full_sync: bool = False):
+        """
+        Sync the local mirror, then categorize files by status with local queries
+        
+        Args:
+            mirror: Local knowledge base mirror
+            full_sync: Re-fetch every page instead of syncing incrementally
+        """
+        print("=" * 60)
+        print("Knowledge Base File Status Scanner (local mirror)")
+        print("=" * 60)
+        print(f"Knowledge Base ID: {self.knowledge_base_id}")
+        print(f"Mirror: {mirror.db_path}")
+        
+        async def sync():
+            async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url, limit=self.concurrency) as helper:
+                return await mirror.sync(helper, self.knowledge_base_id, full=full_sync, concurrency=self.concurrency)
+        
+        start = time.perf_counter()
+        fetched = asyncio.run(sync())
+        print(f"Synced {fetched:,} files from the API in {time.perf_counter() - start:.1f}s")
+        
+        status_count = {
+            'initial': [],
+            'processing': [],
+            'done': [],
+            'failed': [],
+            'other': []
+        }
+        total_scanned = 0
+        for file in mirror.iter_files(self.knowledge_base_id):
+            status = file['status'] or 'unknown'
+            file_info = {
+                'id': file['id'],
+                'filename': file['filename'],
+                'status': status,
+                'created_at': file['created_at']
+            }
+            status_count[status if status in status_count else 'other'].append(file_info)
+            total_scanned += 1
+        
         self._display_results(status_count, total_scanned)
         report_path = self._save_report(status_count, total_scanned)
         
         return status_count, report_path
     
-    def _display_results(self, status_count: dict, total_scanned: int):
+    def _display_results(self, status_count: dict, total_scanned: int, failed_pages: dict = None):
         """Display scan results"""
         print("\n" + "=" * 60)
         print("Scan Results:")
         print("=" * 60)
         print(f"Total scanned: {total_scanned:,} files")
+        if failed_pages:
+            print(f"⚠️  Pages that could not be fetched: {sorted(failed_pages)}")
         print(f"- Initial status: {len(status_count['initial']):,}")
         print(f"- Processing: {len(status_count['processing']):,}")
         print(f"- Done: {len(status_count['done']):,}")
@@ -145,12 +247,13 @@ class KnowledgeBaseStatusScanner:
         except:
             return str(timestamp)
     
-    def _save_report(self, status_count: dict, total_scanned: int):
+    def _save_report(self, status_count: dict, total_scanned: int, failed_pages: dict = None):
         """Save detailed report to JSON file"""
         report = {
             'scan_time': datetime.now().isoformat(),
             'knowledge_base_id': self.knowledge_base_id,
             'total_scanned': total_scanned,
+            'failed_pages': {str(page): error for page, error in sorted((failed_pages or {}).items())},
             'summary': {
                 'initial': len(status_count['initial']),
                 'processing': len(status_count['processing']),
@@ -184,12 +287,20 @@ def main():
     1. Set your API_KEY and KNOWLEDGE_BASE_ID at the top of this file
     2. Run: python scan_file_status.py
     
-    Optional: Modify max_pages parameter to limit scanning to first N pages
+    Optional: Modify max_pages parameter to limit scanning to first N pages,
+    or concurrency to change how many pages are fetched in parallel.
+    With USE_LOCAL_MIRROR, results come from the local mirror after an incremental sync.
     """
-    scanner = KnowledgeBaseStatusScanner(API_KEY, KNOWLEDGE_BASE_ID)
+    # concurrency controls how many pages are fetched in parallel
+    scanner = KnowledgeBaseStatusScanner(API_KEY, KNOWLEDGE_BASE_ID, concurrency=8)
     
-    # Scan all pages (set max_pages=50 to limit to first 50 pages)
-    status_count, report_path = scanner.scan_files_by_status(max_pages=None)
+    if USE_LOCAL_MIRROR:
+        mirror = KnowledgeBaseMirror()
+        status_count, report_path = scanner.scan_files_from_mirror(mirror)
+        mirror.close()
+    else:
+        # Scan all pages (set max_pages=50 to limit to first 50 pages)
+        status_count, report_path = scanner.scan_files_by_status(max_pages=None)
     
     # Print summary
     problematic_count = len(status_count['initial']) + len(status_count['processing']) + len(status_count['failed'])
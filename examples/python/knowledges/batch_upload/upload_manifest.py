@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional
+
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """計算檔案內容的 SHA-256（分段讀取，記憶體用量固定）"""
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+class UploadManifest:
+    """
+    Persistent content-hash manifest shared by every upload run
+
+    以檔案內容的 SHA-256 對應到各知識庫中的 knowledge_file_id，因此搬移、重新命名來源資料夾，
+    或在另一台機器上（複製 manifest 檔案過去）重新執行時，都不會重複上傳相同內容。
+
+    另外以 (path, size, mtime) 快取每個路徑的雜湊值：檔案沒有變動時不必重新讀取整個檔案。
+
+    Usage:
+        manifest = UploadManifest('content_manifest.sqlite3')
+        digest = manifest.cached_hash(path, size, mtime_ns) or hash_file(path)
+        knowledge_file_id = manifest.get(knowledge_base_id, digest)
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS content (
+                knowledge_base_id TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                knowledge_file_id TEXT NOT NULL,
+                filename TEXT,
+                uploaded_at REAL NOT NULL,
+                PRIMARY KEY (knowledge_base_id, sha256)
+            );
+            CREATE INDEX IF NOT EXISTS idx_content_file_id ON content (knowledge_file_id);
+            CREATE TABLE IF NOT EXISTS path_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            """
+        )
+        self.conn.commit()
+
+    def cached_hash(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        """路徑、大小與修改時間都沒變時，回傳上次計算的雜湊值"""
+        row = self.conn.execute(
+            "SELECT sha256 FROM path_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns),
+        ).fetchone()
+        return row[0] if row else None
+
+    def remember_hash(self, path: str, size: int, mtime_ns: int, sha256: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO path_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (path, size, mtime_ns, sha256),
+        )
+        self.conn.commit()
+
+    def get(self, knowledge_base_id: str, sha256: str) -> Optional[str]:
+        """回傳相同內容在該知識庫中的 knowledge_file_id，沒有則回傳 None"""
+        row = self.conn.execute(
+            "SELECT knowledge_file_id FROM content WHERE knowledge_base_id = ? AND sha256 = ?",
+            (knowledge_base_id, sha256),
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(self, knowledge_base_id: str, sha256: str, size: int, knowledge_file_id: str, filename: str = None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO content "
+            "(knowledge_base_id, sha256, size, knowledge_file_id, filename, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (knowledge_base_id, sha256, size, knowledge_file_id, filename, time.time()),
+        )
+        self.conn.commit()
+
+    def forget_files(self, knowledge_base_id: str, knowledge_file_ids: Iterable[str]) -> int:
+        """移除已不在知識庫中的檔案（例如被手動刪除），下次執行時會重新上傳"""
+        cursor = self.conn.executemany(
+            "DELETE FROM content WHERE knowledge_base_id = ? AND knowledge_file_id = ?",
+            ((knowledge_base_id, file_id) for file_id in knowledge_file_ids),
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def count(self, knowledge_base_id: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM content WHERE knowledge_base_id = ?", (knowledge_base_id,)
+        ).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
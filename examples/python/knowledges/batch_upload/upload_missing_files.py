@@ -1,10 +1,12 @@
 import os
+import sys
 import json
 import asyncio
-import aiohttp
-import aiofiles
 from datetime import datetime
 from tqdm import tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils import AdaptiveConcurrencyLimiter, AsyncMaiAgentHelper, KnowledgeFileRegistrar
+from file_upload import upload_single_file
 
 # Configuration - Replace with your actual values
 API_KEY = '<your-api-key>'
@@ -12,6 +14,11 @@ KNOWLEDGE_BASE_ID = '<your-knowledge-base-id>'   # 你的知識庫 ID
 FILES_DIRECTORY = '<your-files-directory>'    # 你要上傳的檔案目錄
 INTEGRITY_REPORT_PATH = '<path-to-your-integrity-check-report>'  # Path to integrity check report, e.g., 'upload_outputs/json_files_4e9ffa82/reports/....json'
 
+# Concurrency ceiling; the adaptive limiter ramps up to this while the API stays healthy
+MAX_CONCURRENT_UPLOADS = 5
+# Files registered to the knowledge base per API call
+REGISTER_BATCH_SIZE = 50
+
 # Validation
 assert API_KEY != '<your-api-key>', 'Please set your API key'
 assert KNOWLEDGE_BASE_ID != '<your-knowledge-base-id>', 'Please set your knowledge base id'
@@ -63,96 +70,17 @@ class MissingFilesUploader:
             print(f"❌ Error reading integrity report: {e}")
             return []
     
-    async def get_upload_url(self, session: aiohttp.ClientSession, file_path: str):
-        """Get presigned upload URL"""
-        url = f"{self.base_url}upload-presigned-url/"
-        headers = {
-            'Authorization': f'Api-Key {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        file_size = os.path.getsize(file_path)
-        filename = os.path.basename(file_path)
-        
-        payload = {
-            'filename': filename,
-            'modelName': 'chatbot-file',
-            'fieldName': 'file',
-            'fileSize': file_size
-        }
-        
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
-    
-    async def upload_to_s3(self, session: aiohttp.ClientSession, file_path: str, upload_info: dict):
-        """Upload file to S3"""
-        async with aiofiles.open(file_path, 'rb') as f:
-            file_data = await f.read()
-        
-        data = aiohttp.FormData()
-        for key, value in upload_info['fields'].items():
-            data.add_field(key, value)
-        
-        data.add_field('file', file_data, 
-                      filename=os.path.basename(file_path),
-                      content_type='application/octet-stream')
-        
-        upload_url = upload_info['url']
-        
-        async with session.post(upload_url, data=data) as response:
-            if response.status == 204:
-                return upload_info['fields']['key']
-            else:
-                error_text = await response.text()
-                raise Exception(f"S3 upload failed: {response.status} - {error_text}")
-    
-    async def register_file(self, session: aiohttp.ClientSession, file_key: str, original_filename: str):
-        """Register file to knowledge base"""
-        url = f"{self.base_url}knowledge-bases/{self.knowledge_base_id}/files/"
-        headers = {'Authorization': f'Api-Key {self.api_key}'}
-        
-        payload = {
-            'files': [{
-                'file': file_key,
-                'filename': original_filename
-            }]
-        }
-        
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
-    
-    async def upload_single_file(self, session: aiohttp.ClientSession, file_path: str):
+    async def upload_single_file(
+        self,
+        helper: AsyncMaiAgentHelper,
+        file_path: str,
+        limiter: AdaptiveConcurrencyLimiter,
+        registrar: KnowledgeFileRegistrar,
+    ):
         """Upload a single file"""
-        try:
-            upload_info = await self.get_upload_url(session, file_path)
-            file_key = await self.upload_to_s3(session, file_path, upload_info)
-            original_filename = os.path.basename(file_path)
-            response = await self.register_file(session, file_key, original_filename)
-            
-            # Extract new file ID
-            new_file_id = None
-            if response and isinstance(response, list) and len(response) > 0 and 'id' in response[0]:
-                new_file_id = response[0]['id']
-            
-            self.successful_uploads.append({
-                'file_path': file_path,
-                'filename': original_filename,
-                'new_file_id': new_file_id,
-                'upload_time': datetime.now().isoformat()
-            })
-            
-            return True
-            
-        except Exception as e:
-            self.failed_uploads.append({
-                'file_path': file_path,
-                'filename': os.path.basename(file_path),
-                'error': str(e),
-                'upload_time': datetime.now().isoformat()
-            })
-            return False
+        success, record = await upload_single_file(helper, file_path, limiter, registrar)
+        (self.successful_uploads if success else self.failed_uploads).append(record)
+        return success
     
     async def upload_missing_files(self, missing_files: list):
         """
@@ -219,21 +147,25 @@ class MissingFilesUploader:
         # Perform upload
         print(f"\n📤 Starting upload of {len(files_to_upload)} files...")
         
-        connector = aiohttp.TCPConnector(limit=5)  # Limit concurrent uploads
-        timeout = aiohttp.ClientTimeout(total=300)
+        # Rate limiting: concurrency adapts to server responses, backs off on 429/5xx and honors Retry-After
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(2, MAX_CONCURRENT_UPLOADS),
+            max_limit=MAX_CONCURRENT_UPLOADS,
+        )
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with AsyncMaiAgentHelper(self.api_key, base_url=self.base_url, limit=MAX_CONCURRENT_UPLOADS + 1) as helper, \
+                KnowledgeFileRegistrar(helper, self.knowledge_base_id, max_batch_size=REGISTER_BATCH_SIZE) as registrar:
             with tqdm(total=len(files_to_upload), desc="Uploading", unit="files") as pbar:
-                for file_path in files_to_upload:
-                    success = await self.upload_single_file(session, file_path)
+                async def upload_and_track(file_path):
+                    success = await self.upload_single_file(helper, file_path, limiter, registrar)
                     pbar.update(1)
                     
                     if success:
                         pbar.set_postfix(success=len(self.successful_uploads), 
-                                       failed=len(self.failed_uploads))
-                    
-                    # Rate limiting
-                    await asyncio.sleep(0.1)
+                                       failed=len(self.failed_uploads),
+                                       concurrency=limiter.limit)
+                
+                await asyncio.gather(*(upload_and_track(file_path) for file_path in files_to_upload))
         
         # Save upload results
         self._save_upload_results()
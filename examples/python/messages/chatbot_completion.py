@@ -1,4 +1,4 @@
-from utils import MaiAgentHelper
+from utils import CompletionStream, MaiAgentHelper
 from utils.config import API_KEY, BASE_URL, CHATBOT_ID
 import sys
 import os
@@ -64,11 +64,11 @@ def create_attachment(maiagent_helper: MaiAgentHelper, image_path: str) -> list[
     print(f"附件數據準備完成: {attachments}")
     return attachments
 
-def handle_streaming_response(data: dict[str, any]):
-    """處理串流響應"""
-    if 'content' in data and data.get('done') is False:
-        sys.stdout.write(data['content'])
-        sys.stdout.flush()
+def handle_streaming_response(stream: CompletionStream) -> str:
+    """處理串流響應：合併小片段後再輸出，不必每個 token 都 write + flush"""
+    text = stream.write_to(sys.stdout)
+    print()  # 換行
+    return text
 
 def test_with_streaming():
     """
@@ -95,13 +95,13 @@ def test_with_streaming():
     maiagent_helper = get_maiagent_helper()
     
     try:
-        for data in maiagent_helper.create_chatbot_completion(
+        stream = maiagent_helper.create_chatbot_completion(
             CHATBOT_ID,
             TEST_PROMPTS['streaming'],
             is_streaming=True
-        ):
-            handle_streaming_response(data)
-        print()  # 換行
+        )
+        handle_streaming_response(stream)
+        print(f"conversationId: {stream.conversation_id}")
     except Exception as e:
         print(f"錯誤: {str(e)}")
 
@@ -203,14 +203,12 @@ def test_conversation_flow():
         
         # 第二次對話，使用獲取到的 conversationId
         print("第二次對話（帶 conversationId）:")
-        for data in maiagent_helper.create_chatbot_completion(
+        handle_streaming_response(maiagent_helper.create_chatbot_completion(
             CHATBOT_ID,
             TEST_PROMPTS['conversation_second'],
             conversation_id=conversation_id,
             is_streaming=True
-        ):
-            handle_streaming_response(data)
-        print()  # 換行
+        ))
     except Exception as e:
         print(f"錯誤: {str(e)}")
 
@@ -288,14 +286,12 @@ def test_conversation_with_image_attachment():
             return
             
         print("\n開始分析圖片...")
-        for data in maiagent_helper.create_chatbot_completion(
+        handle_streaming_response(maiagent_helper.create_chatbot_completion(
             CHATBOT_ID,
             TEST_PROMPTS['image_analysis'],
             attachments=attachments,
             is_streaming=True
-        ):
-            handle_streaming_response(data)
-        print()  # 換行
+        ))
     except Exception as e:
         print(f"錯誤: {str(e)}")
 
@@ -0,0 +1,427 @@
+"""
+聊天機器人回應的負載測試
+
+重播一份問題語料，以固定並發數（--concurrency，封閉式）或固定到達速率（--rate，開放式）呼叫
+create_chatbot_completion，記錄每個請求的：
+- TTFT：送出請求到收到第一段內容的時間
+- inter-token：相鄰兩段串流內容之間的間隔
+- latency：送出請求到串流結束的總時間
+- tokens/sec：第一段內容之後每秒收到的串流片段數（以串流事件數近似 token 數）
+以及錯誤率與錯誤類型，結果存在 HDR 風格的直方圖（utils.LatencyHistogram），輸出 p50 / p95 / p99 報表。
+
+語料格式：
+- JSONL：每行一個字串，或包含 content（或 question / 問題）的物件，可加上 type（New / Follow）與 attachments
+- Excel（.xlsx）：與批次 QA 相同的格式，第一列為標題，「問題」欄為內容，「型態」欄為 New / Follow
+
+型態為 Follow 的問題會在前一個問題的對話中送出，因此同一組對話內的問題依序執行，不同對話之間並行。
+
+開放式模式下延遲從預定的到達時間開始計算：請求因 --max-in-flight 已滿而在用戶端排隊的時間也算在內，
+避免伺服器變慢時測試端跟著少送請求而低估延遲（coordinated omission）。
+
+Usage:
+    python -m messages.completion_load_test prompts.jsonl --concurrency 20 --requests 500
+    python -m messages.completion_load_test batch_qa/batch_qa_file_example.xlsx --rate 5 --duration 300 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import aiohttp
+from tqdm import tqdm
+
+from utils import AsyncMaiAgentHelper, LatencyHistogram
+from utils.config import API_KEY, BASE_URL, CHATBOT_ID
+
+PERCENTILES = (50, 95, 99)
+XLSX_NAMESPACE = {'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+@dataclass
+class Prompt:
+    content: str
+    follow: bool = False
+    attachments: list = field(default_factory=list)
+
+
+def read_xlsx_rows(path: str) -> List[List[str]]:
+    """讀取 .xlsx 第一個工作表的所有列（只需要標準函式庫）"""
+    with zipfile.ZipFile(path) as archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            root = ElementTree.fromstring(archive.read('xl/sharedStrings.xml'))
+            for item in root.findall('main:si', XLSX_NAMESPACE):
+                shared_strings.append(''.join(text.text or '' for text in item.iter(f"{{{XLSX_NAMESPACE['main']}}}t")))
+        sheets = sorted(name for name in archive.namelist() if name.startswith('xl/worksheets/sheet'))
+        root = ElementTree.fromstring(archive.read(sheets[0]))
+
+    rows = []
+    for row in root.iter(f"{{{XLSX_NAMESPACE['main']}}}row"):
+        values = {}
+        for cell in row.findall('main:c', XLSX_NAMESPACE):
+            column = 0
+            for char in ''.join(c for c in cell.get('r', '') if c.isalpha()):
+                column = column * 26 + ord(char.upper()) - ord('A') + 1
+            cell_type = cell.get('t')
+            if cell_type == 'inlineStr':
+                value = ''.join(text.text or '' for text in cell.iter(f"{{{XLSX_NAMESPACE['main']}}}t"))
+            else:
+                raw = cell.find('main:v', XLSX_NAMESPACE)
+                if raw is None or raw.text is None:
+                    continue
+                value = shared_strings[int(raw.text)] if cell_type == 's' else raw.text
+            values[column - 1 if column else len(values)] = value
+        if values:
+            rows.append([values.get(i, '') for i in range(max(values) + 1)])
+    return rows
+
+
+def load_prompts(path: str) -> List[Prompt]:
+    """讀取 JSONL 或批次 QA 格式的 Excel 語料"""
+    prompts = []
+    if path.lower().endswith('.xlsx'):
+        rows = read_xlsx_rows(path)
+        header = [value.strip() for value in rows[0]] if rows else []
+        content_column = header.index('問題') if '問題' in header else 0
+        type_column = header.index('型態') if '型態' in header else None
+        for row in rows[1:]:
+            content = row[content_column].strip() if content_column < len(row) else ''
+            if not content:
+                continue
+            kind = row[type_column] if type_column is not None and type_column < len(row) else ''
+            prompts.append(Prompt(content, follow=kind.strip().lower() == 'follow'))
+        return prompts
+
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                prompts.append(Prompt(item))
+                continue
+            content = item.get('content') or item.get('question') or item.get('問題')
+            if not content:
+                raise ValueError(f'{path}:{line_number}: missing "content"')
+            kind = str(item.get('type') or item.get('型態') or '').strip().lower()
+            prompts.append(Prompt(content, follow=kind == 'follow', attachments=item.get('attachments') or []))
+    return prompts
+
+
+def group_sessions(prompts: List[Prompt]) -> List[List[Prompt]]:
+    """依 New / Follow 把問題分成對話；開頭的 Follow 視為新對話"""
+    sessions = []
+    for prompt in prompts:
+        if prompt.follow and sessions:
+            sessions[-1].append(prompt)
+        else:
+            sessions.append([prompt])
+    return sessions
+
+
+def iter_sessions(sessions, total_requests: int, shuffle: bool, seed: int) -> Iterator[List[Prompt]]:
+    """重複語料直到送出 total_requests 個問題（最後一組對話可能被截短）"""
+    rng = random.Random(seed)
+    remaining = total_requests
+    while remaining > 0:
+        order = list(sessions)
+        if shuffle:
+            rng.shuffle(order)
+        for session in order:
+            if remaining <= 0:
+                return
+            yield session[:remaining]
+            remaining -= len(session)
+
+
+class LoadTestMetrics:
+    """各項指標的直方圖與錯誤計數"""
+
+    def __init__(self, interval: float = 1.0):
+        self.ttft = LatencyHistogram()
+        self.inter_token = LatencyHistogram()
+        self.latency = LatencyHistogram()
+        # 以千分之一 token/sec 為單位記錄
+        self.tokens_per_second = LatencyHistogram()
+        self.requests = 0
+        self.successes = 0
+        self.tokens = 0
+        # 對話中途失敗而沒有送出的後續問題
+        self.skipped = 0
+        self.errors = Counter()
+        self.interval = interval
+        # 每個時間區間的 [完成數, 錯誤數]，用來看錯誤率是否隨負載上升
+        self.timeline = {}
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def record_success(self, start, first_token, last_token, end, tokens):
+        self.requests += 1
+        self.successes += 1
+        self.tokens += tokens
+        self.latency.record_seconds(end - start)
+        if first_token is not None:
+            self.ttft.record_seconds(first_token - start)
+        if tokens > 1 and last_token > first_token:
+            self.tokens_per_second.record(round((tokens - 1) / (last_token - first_token) * 1000))
+        self._tick(end, error=False)
+
+    def record_error(self, kind: str, end: float):
+        self.requests += 1
+        self.errors[kind] += 1
+        self._tick(end, error=True)
+
+    def _tick(self, end, error):
+        slot = int((end - self.started_at) / self.interval)
+        counts = self.timeline.setdefault(slot, [0, 0])
+        counts[0] += 1
+        if error:
+            counts[1] += 1
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.requests if self.requests else 0.0
+
+    def report(self) -> dict:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            'elapsed_seconds': elapsed,
+            'requests': self.requests,
+            'successes': self.successes,
+            'error_rate': self.error_rate,
+            'errors': dict(self.errors),
+            'skipped_follow_ups': self.skipped,
+            'requests_per_second': self.requests / elapsed if elapsed else 0.0,
+            'tokens_per_second_total': self.tokens / elapsed if elapsed else 0.0,
+            'ttft_ms': self.ttft.summary(PERCENTILES, scale=1000),
+            'inter_token_ms': self.inter_token.summary(PERCENTILES, scale=1000),
+            'latency_ms': self.latency.summary(PERCENTILES, scale=1000),
+            'tokens_per_second': self.tokens_per_second.summary(PERCENTILES, scale=1000),
+            'timeline': [
+                {'second': slot * self.interval, 'completed': counts[0], 'errors': counts[1]}
+                for slot, counts in sorted(self.timeline.items())
+            ],
+            'histograms': {
+                'ttft_us': self.ttft.buckets(),
+                'inter_token_us': self.inter_token.buckets(),
+                'latency_us': self.latency.buckets(),
+                'tokens_per_second_milli': self.tokens_per_second.buckets(),
+            },
+        }
+
+
+def classify_error(error: BaseException) -> str:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f'HTTP {error.status}'
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return 'timeout'
+    return type(error).__name__
+
+
+class CompletionLoadTest:
+    def __init__(self, helper: AsyncMaiAgentHelper, chatbot_id: str, metrics: LoadTestMetrics, streaming: bool = True):
+        self.helper = helper
+        self.chatbot_id = chatbot_id
+        self.metrics = metrics
+        self.streaming = streaming
+        self.in_flight = 0
+        self.progress: Optional[tqdm] = None
+
+    async def send(
+        self, prompt: Prompt, conversation_id: Optional[str], start: float
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        送出一個問題並記錄指標，回傳 (是否成功, 對話 ID)
+
+        成功的回應不一定帶有 conversationId（例如命中快取），此時對話 ID 為 None，後續問題會開新對話
+        """
+        first_token = last_token = None
+        tokens = 0
+        self.in_flight += 1
+        try:
+            if self.streaming:
+                async with await self.helper.create_chatbot_completion(
+                    self.chatbot_id, prompt.content, prompt.attachments, conversation_id, is_streaming=True
+                ) as stream:
+                    async for data in stream:
+                        conversation_id = data.get('conversationId') or conversation_id
+                        if data.get('content'):
+                            now = time.perf_counter()
+                            if first_token is None:
+                                first_token = now
+                            else:
+                                self.metrics.inter_token.record_seconds(now - last_token)
+                            last_token = now
+                            tokens += 1
+                if tokens == 0:
+                    raise RuntimeError('empty response')
+            else:
+                data = await self.helper.create_chatbot_completion(
+                    self.chatbot_id, prompt.content, prompt.attachments, conversation_id
+                )
+                conversation_id = (data or {}).get('conversationId') or conversation_id
+        except Exception as e:
+            self.metrics.record_error(classify_error(e), time.perf_counter())
+            return False, conversation_id
+        finally:
+            self.in_flight -= 1
+            if self.progress is not None:
+                self.progress.update(1)
+                self.progress.set_postfix(
+                    in_flight=self.in_flight, errors=f'{self.metrics.error_rate:.1%}', refresh=False
+                )
+
+        end = time.perf_counter()
+        # 非串流模式沒有逐段內容，TTFT 即為總延遲
+        self.metrics.record_success(start, first_token or end, last_token or end, end, tokens)
+        return True, conversation_id
+
+    async def run_session(self, session: List[Prompt], start: float = None):
+        """依序送出一組對話；中途失敗時略過其餘的後續問題"""
+        conversation_id = None
+        for index, prompt in enumerate(session):
+            begin = start if index == 0 and start is not None else time.perf_counter()
+            ok, conversation_id = await self.send(prompt, conversation_id, begin)
+            if not ok:
+                self.metrics.skipped += len(session) - index - 1
+                if self.progress is not None:
+                    self.progress.update(len(session) - index - 1)
+                return
+
+    async def run_closed(self, sessions: Iterator[List[Prompt]], concurrency: int, deadline: float):
+        """固定並發數：每個 worker 完成一組對話後立即開始下一組"""
+        async def worker():
+            for session in sessions:
+                if time.perf_counter() >= deadline:
+                    return
+                await self.run_session(session)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_open(
+        self, sessions: Iterator[List[Prompt]], rate: float, deadline: float, max_in_flight: int,
+        poisson: bool = True, seed: int = 0,
+    ):
+        """固定到達速率：依排程開始每組對話，不等待前一組完成"""
+        rng = random.Random(seed)
+        limit = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+
+        async def start_session(session, scheduled):
+            async with limit:
+                await self.run_session(session, start=scheduled)
+
+        scheduled = time.perf_counter()
+        for session in sessions:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if scheduled >= deadline:
+                break
+            task = asyncio.ensure_future(start_session(session, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += rng.expovariate(rate) if poisson else 1 / rate
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def print_report(report: dict):
+    print(
+        f"\n{report['requests']} requests in {report['elapsed_seconds']:.1f}s "
+        f"({report['requests_per_second']:.2f} req/s, {report['tokens_per_second_total']:.1f} tokens/s), "
+        f"error rate {report['error_rate']:.2%}"
+    )
+    for kind, count in sorted(report['errors'].items(), key=lambda item: -item[1]):
+        print(f"  {kind}: {count}")
+    if report['skipped_follow_ups']:
+        print(f"  {report['skipped_follow_ups']} follow-up questions skipped after a failed request")
+
+    columns = ['count', 'min', 'mean'] + [f'p{p}' for p in PERCENTILES] + ['max']
+    print(f"\n{'metric':<20}" + ''.join(f'{column:>10}' for column in columns))
+    for name, key in (
+        ('TTFT (ms)', 'ttft_ms'),
+        ('inter-token (ms)', 'inter_token_ms'),
+        ('latency (ms)', 'latency_ms'),
+        ('tokens/sec', 'tokens_per_second'),
+    ):
+        summary = report[key]
+        cells = [f"{summary['count']:>10}"] + [f'{summary[column]:>10.1f}' for column in columns[1:]]
+        print(f'{name:<20}' + ''.join(cells))
+
+
+async def run(args, sessions):
+    prompt_count = sum(len(session) for session in sessions)
+    total_requests = args.requests or (prompt_count if not args.duration else 10 ** 12)
+    iterator = iter_sessions(sessions, total_requests, args.shuffle, args.seed)
+    deadline = time.perf_counter() + args.duration if args.duration else float('inf')
+
+    # 每條串流佔用一條連線：開放式模式不限制連線數，封閉式模式等於並發數
+    limit = 0 if args.rate else args.concurrency
+    metrics = LoadTestMetrics()
+    async with AsyncMaiAgentHelper(
+        args.api_key, base_url=args.base_url, limit=limit, timeout_seconds=args.timeout
+    ) as helper:
+        load_test = CompletionLoadTest(helper, args.chatbot_id, metrics, streaming=not args.no_stream)
+        with tqdm(total=None if total_requests == 10 ** 12 else total_requests, unit='req') as progress:
+            load_test.progress = progress
+            if args.rate:
+                await load_test.run_open(
+                    iterator, args.rate, deadline, args.max_in_flight, poisson=args.arrival == 'poisson', seed=args.seed
+                )
+            else:
+                await load_test.run_closed(iterator, args.concurrency, deadline)
+    metrics.finished_at = time.perf_counter()
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', help='問題語料（.jsonl 或批次 QA 格式的 .xlsx）')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=int, default=10, help='封閉式：同時進行的對話數')
+    mode.add_argument('--rate', type=float, help='開放式：每秒開始的對話數')
+    parser.add_argument('--arrival', choices=('poisson', 'constant'), default='poisson', help='開放式的到達間隔分布')
+    parser.add_argument('--max-in-flight', type=int, default=1000, help='開放式：同時進行的對話數上限')
+    parser.add_argument('--requests', type=int, help='送出的問題總數（重複語料）；預設為語料跑一輪')
+    parser.add_argument('--duration', type=float, help='執行秒數；到時間後不再開始新的對話')
+    parser.add_argument('--shuffle', action='store_true', help='每一輪打亂對話順序')
+    parser.add_argument('--seed', type=int, default=0, help='打亂順序與到達間隔的亂數種子')
+    parser.add_argument('--no-stream', action='store_true', help='使用非串流模式（只記錄總延遲）')
+    parser.add_argument('--timeout', type=int, default=300, help='請求逾時秒數（串流為兩次讀取之間的間隔）')
+    parser.add_argument('--output', help='把完整報表（含直方圖分桶與每秒時間軸）寫入 JSON 檔')
+    parser.add_argument('--chatbot-id', default=CHATBOT_ID, help='聊天機器人 ID，預設讀取 MAIAGENT_CHATBOT_ID')
+    parser.add_argument('--api-key', default=API_KEY, help='API 金鑰，預設讀取 MAIAGENT_API_KEY')
+    parser.add_argument('--base-url', default=BASE_URL, help='API 基礎 URL，預設讀取 MAIAGENT_BASE_URL')
+    args = parser.parse_args()
+
+    sessions = group_sessions(load_prompts(args.corpus))
+    if not sessions:
+        parser.error(f'No prompts found in {args.corpus}')
+    if args.rate is not None and args.rate <= 0:
+        parser.error('--rate must be positive')
+    print(
+        f"Loaded {sum(len(session) for session in sessions)} prompts in {len(sessions)} conversations "
+        f"from {os.path.basename(args.corpus)}"
+    )
+
+    metrics = asyncio.run(run(args, sessions))
+    report = metrics.report()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
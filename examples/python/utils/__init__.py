@@ -1 +1,30 @@
+from importlib import import_module
+
 from .maiagent import MaiAgentHelper
+from .completion_cache import CompletionCache, MemoryCacheBackend, SQLiteCacheBackend
+from .completion_stream import AsyncCompletionStream, CoalescingWriter, CompletionStream
+from .histogram import LatencyHistogram
+from .sse import AsyncJSONEventStream, SSEDecoder, iter_sse_events, iter_sse_json
+
+# 依賴 aiohttp / aiofiles 的工具在第一次使用時才載入，只用同步 MaiAgentHelper 的腳本不必安裝非同步套件
+_LAZY_EXPORTS = {
+    'AsyncMaiAgentHelper': '.async_maiagent',
+    'AdaptiveConcurrencyLimiter': '.rate_limiter',
+    'ThreadedAdaptiveConcurrencyLimiter': '.rate_limiter',
+    'KnowledgeFileRegistrar': '.registrar',
+    'ProcessingTracker': '.processing_tracker',
+    'KnowledgeFileDeleter': '.bulk_delete',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
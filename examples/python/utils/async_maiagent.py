@@ -0,0 +1,582 @@
+import asyncio
+import json
+import math
+import os
+from collections import deque
+from typing import AsyncIterator, Union
+from urllib.parse import urljoin
+
+import aiofiles
+import aiohttp
+
+from .completion_stream import AsyncCompletionStream
+from .sse import AsyncJSONEventStream
+
+
+class AsyncMaiAgentHelper:
+    """
+    MaiAgentHelper 的 asyncio 版本
+
+    所有請求共用同一個 aiohttp.ClientSession，適合在單一 event loop 中同時進行大量操作。
+    與同步版本不同，HTTP 錯誤會直接拋出 aiohttp.ClientResponseError，由呼叫端決定重試或略過。
+
+    Usage:
+        async with AsyncMaiAgentHelper(api_key) as helper:
+            knowledge_bases = await helper.list_knowledge_bases()
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url='https://api.maiagent.ai/api/v1/',
+        session: aiohttp.ClientSession = None,
+        limit=100,
+        limit_per_host=0,
+        timeout_seconds=300,
+        json_loads=None,
+        completion_cache=None,
+    ):
+        """
+        Args:
+            api_key: MaiAgent API 金鑰
+            base_url: API 基礎 URL
+            session: 外部提供的 aiohttp.ClientSession；提供時不會由 helper 關閉
+            limit: 連線池的總連線數上限
+            limit_per_host: 每個主機的連線數上限，0 表示不限制
+            timeout_seconds: 單一請求的總逾時秒數；串流回應改為兩次讀取之間的逾時
+            json_loads: 解析串流事件的 JSON 解碼函式，預設在安裝 orjson 時使用 orjson
+            completion_cache: CompletionCache；設定後新對話的 create_chatbot_completion 會使用快取，
+                知識庫異動請求成功後清除對應的快取
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self._session = session
+        self._owns_session = session is None
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._timeout_seconds = timeout_seconds
+        self.json_loads = json_loads
+        self.completion_cache = completion_cache
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # ClientSession 必須在 event loop 中建立，因此延遲到第一次使用時才建立
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._limit, limit_per_host=self._limit_per_host)
+            timeout = aiohttp.ClientTimeout(total=self._timeout_seconds)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """關閉 helper 自己建立的 session"""
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def _headers(self):
+        return {'Authorization': f'Api-Key {self.api_key}'}
+
+    async def _request(self, method, path, **kwargs):
+        """發送 API 請求並回傳解析後的 JSON；204 或空內容回傳 None"""
+        url = path if path.startswith(('http://', 'https://')) else f'{self.base_url}{path}'
+        async with self.session.request(method, url, headers=self._headers, **kwargs) as response:
+            response.raise_for_status()
+            if self.completion_cache is not None:
+                self.completion_cache.observe_request(method, url, response.status)
+            if response.status == 204:
+                return None
+            body = await response.read()
+            return json.loads(body) if body else None
+
+    # ========== 對話與訊息 ==========
+
+    async def create_conversation(self, web_chat_id):
+        """建立 conversation"""
+        return await self._request('POST', 'conversations/', json={'webChat': web_chat_id})
+
+    async def send_message(self, conversation_id, content, attachments=None):
+        """傳送訊息"""
+        payload = {
+            'conversation': conversation_id,
+            'content': content,
+            'attachments': attachments or [],
+        }
+        return await self._request('POST', 'messages/', json=payload)
+
+    # ========== 檔案上傳 ==========
+
+    async def get_upload_url(self, file_path, model_name, field_name='file'):
+        """獲取預簽名上傳 URL"""
+        assert os.path.exists(file_path), 'File does not exist'
+
+        payload = {
+            'filename': os.path.basename(file_path),
+            'modelName': model_name,
+            'fieldName': field_name,
+            'fileSize': os.path.getsize(file_path),
+        }
+        return await self._request('POST', 'upload-presigned-url/', json=payload)
+
+    async def upload_file_to_s3(self, file_path, upload_data):
+        """上傳檔案到 S3，成功時回傳 file key"""
+        if 'url' not in upload_data:
+            raise ValueError(
+                "Missing 'url' in upload_data response from presigned URL API. This indicates an API error."
+            )
+
+        # 傳入檔案物件而非 bytes，aiohttp 會在背景執行緒中以 64 KiB 區塊讀取並送出，
+        # 記憶體用量只與區塊大小 × 並發數有關，與檔案大小無關
+        with open(file_path, 'rb') as f:
+            # AWS S3 / MinIO 要求 file 必須是最後一個欄位
+            data = aiohttp.FormData()
+            for key, value in upload_data['fields'].items():
+                data.add_field(key, value)
+            data.add_field('file', f, filename=os.path.basename(file_path), content_type='application/octet-stream')
+
+            # 預簽名 URL 已包含授權資訊，不能再附加 Api-Key header
+            async with self.session.post(upload_data['url'], data=data) as response:
+                if response.status != 204:
+                    error_text = await response.text()
+                    raise RuntimeError(f'S3 upload failed: {response.status} - {error_text}')
+
+        return upload_data['fields']['key']
+
+    # ========== 附件 ==========
+
+    async def update_attachment(self, conversation_id, file_id, original_filename):
+        payload = {'file': file_id, 'filename': original_filename, 'type': 'image'}
+        return await self._request('POST', f'conversations/{conversation_id}/attachments/', json=payload)
+
+    async def update_attachment_without_conversation(self, file_id, original_filename, type):
+        payload = {'file': file_id, 'filename': original_filename, 'type': type}
+        return await self._request('POST', 'attachments/', json=payload)
+
+    async def upload_attachment(self, conversation_id, file_path):
+        upload_url = await self.get_upload_url(file_path, 'attachment')
+        file_key = await self.upload_file_to_s3(file_path, upload_url)
+        return await self.update_attachment(conversation_id, file_key, os.path.basename(file_path))
+
+    async def upload_attachment_without_conversation(self, file_path, type):
+        upload_url = await self.get_upload_url(file_path, 'attachment')
+        file_key = await self.upload_file_to_s3(file_path, upload_url)
+        return await self.update_attachment_without_conversation(file_key, os.path.basename(file_path), type)
+
+    async def update_chatbot_files(self, chatbot_id, file_key, original_filename):
+        payload = {'files': [{'file': file_key, 'filename': original_filename}]}
+        return await self._request('POST', f'chatbots/{chatbot_id}/files/', json=payload)
+
+    # ========== 批次問答 ==========
+
+    async def upload_batch_qa_file(self, web_chat_id: str, file_key: str, original_filename: str):
+        payload = {'file': file_key, 'filename': original_filename}
+        return await self._request('POST', f'web-chats/{web_chat_id}/batch-qas/', json=payload)
+
+    async def download_batch_qa_excel(self, webchat_id: str, batch_qa_file_id: str):
+        """下載批次問答 Excel，回傳儲存的檔名"""
+        url = urljoin(self.base_url, f'web-chats/{webchat_id}/batch-qas/{batch_qa_file_id}/export-excel/')
+
+        async with self.session.get(url, headers=self._headers) as response:
+            response.raise_for_status()
+            filename = 'chatbot_records.xlsx'
+            content_disposition = response.headers.get('Content-Disposition')
+            if content_disposition:
+                filename = content_disposition.split('filename=')[1].strip('"')
+
+            async with aiofiles.open(filename, 'wb') as f:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    await f.write(chunk)
+
+        return filename
+
+    # ========== 知識庫檔案 ==========
+
+    async def register_knowledge_files(self, knowledge_base_id, files):
+        """
+        將已上傳到 S3 的檔案註冊到知識庫
+
+        Args:
+            files: [{'file': <file_key>, 'filename': <原始檔名>}, ...]
+
+        Returns:
+            list: 建立的知識庫檔案，順序與 files 相同
+        """
+        return await self._request('POST', f'knowledge-bases/{knowledge_base_id}/files/', json={'files': files})
+
+    async def upload_knowledge_file(self, knowledge_base_id, file_path):
+        """上傳檔案到知識庫"""
+        upload_url = await self.get_upload_url(file_path, 'chatbot-file')
+        file_key = await self.upload_file_to_s3(file_path, upload_url)
+        return await self.register_knowledge_files(
+            knowledge_base_id, [{'file': file_key, 'filename': os.path.basename(file_path)}]
+        )
+
+    async def delete_knowledge_file(self, knowledge_base_id, file_id):
+        """刪除知識庫檔案"""
+        await self._request('DELETE', f'knowledge-bases/{knowledge_base_id}/files/{file_id}/')
+        return True
+
+    async def list_knowledge_base_files(self, knowledge_base_id, page=None, page_size=None, ordering=None):
+        """
+        列出知識庫檔案（單一分頁；要取得全部檔案請使用 iter_knowledge_base_files）
+
+        Args:
+            ordering: 排序欄位，例如 '-created_at' 表示由新到舊；None 時使用伺服器的預設順序
+        """
+        params = {
+            key: value
+            for key, value in (('page', page), ('page_size', page_size), ('ordering', ordering))
+            if value is not None
+        }
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/files/', params=params or None)
+
+    async def get_knowledge_base_file(self, knowledge_base_id, file_id):
+        """獲取知識庫檔案詳情"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/files/{file_id}/')
+
+    async def update_knowledge_base_file_metadata(
+        self, knowledge_base_id, file_id, labels=None, raw_user_define_metadata=None
+    ):
+        """更新知識庫檔案的標籤和元數據"""
+        payload = {}
+        if labels is not None:
+            payload['labels'] = labels
+        if raw_user_define_metadata is not None:
+            payload['rawUserDefineMetadata'] = raw_user_define_metadata
+        return await self._request(
+            'PATCH', f'knowledge-bases/{knowledge_base_id}/files/{file_id}/update-metadata/', json=payload
+        )
+
+    async def batch_delete_knowledge_base_files(self, knowledge_base_id, file_ids):
+        """批次刪除知識庫檔案"""
+        return await self._request(
+            'POST', f'knowledge-bases/{knowledge_base_id}/files/batch-delete/', json={'ids': file_ids}
+        )
+
+    async def batch_reparse_knowledge_base_files(self, knowledge_base_id, file_parsers):
+        """批次重新解析知識庫檔案"""
+        return await self._request(
+            'PATCH', f'knowledge-bases/{knowledge_base_id}/files/batch-reparse/', json=file_parsers
+        )
+
+    # ========== 知識庫 CRUD 操作 ==========
+
+    async def create_knowledge_base(
+        self,
+        name,
+        description=None,
+        embedding_model=None,
+        reranker_model=None,
+        number_of_retrieved_chunks=12,
+        sentence_window_size=2,
+        enable_hyde=False,
+        similarity_cutoff=0.0,
+        enable_rerank=True,
+        chatbots=None,
+    ):
+        """建立知識庫"""
+        payload = {
+            'name': name,
+            'description': description,
+            'embedding_model': embedding_model,
+            'reranker_model': reranker_model,
+            'number_of_retrieved_chunks': number_of_retrieved_chunks,
+            'sentence_window_size': sentence_window_size,
+            'enable_hyde': enable_hyde,
+            'similarity_cutoff': similarity_cutoff,
+            'enable_rerank': enable_rerank,
+            'chatbots': chatbots or [],
+        }
+        payload = {k: v for k, v in payload.items() if v is not None}
+        return await self._request('POST', 'knowledge-bases/', json=payload)
+
+    async def list_knowledge_bases(self):
+        """列出所有知識庫"""
+        return await self._request('GET', 'knowledge-bases/')
+
+    async def get_knowledge_base(self, knowledge_base_id):
+        """獲取知識庫詳情"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/')
+
+    async def update_knowledge_base(
+        self,
+        knowledge_base_id,
+        name=None,
+        description=None,
+        embedding_model=None,
+        reranker_model=None,
+        number_of_retrieved_chunks=None,
+        sentence_window_size=None,
+        enable_hyde=None,
+        similarity_cutoff=None,
+        enable_rerank=None,
+        chatbots=None,
+    ):
+        """更新知識庫"""
+        payload = {
+            'name': name,
+            'description': description,
+            'embedding_model': embedding_model,
+            'reranker_model': reranker_model,
+            'number_of_retrieved_chunks': number_of_retrieved_chunks,
+            'sentence_window_size': sentence_window_size,
+            'enable_hyde': enable_hyde,
+            'similarity_cutoff': similarity_cutoff,
+            'enable_rerank': enable_rerank,
+            'chatbots': chatbots,
+        }
+        payload = {k: v for k, v in payload.items() if v is not None}
+        return await self._request('PUT', f'knowledge-bases/{knowledge_base_id}/', json=payload)
+
+    async def delete_knowledge_base(self, knowledge_base_id):
+        """刪除知識庫"""
+        await self._request('DELETE', f'knowledge-bases/{knowledge_base_id}/')
+
+    async def search_knowledge_base(self, knowledge_base_id, query):
+        """搜尋知識庫內容"""
+        return await self._request('POST', f'knowledge-bases/{knowledge_base_id}/search/', json={'query': query})
+
+    # ========== 知識庫標籤 CRUD 操作 ==========
+
+    async def create_knowledge_base_label(self, knowledge_base_id, name):
+        """建立知識庫標籤"""
+        return await self._request('POST', f'knowledge-bases/{knowledge_base_id}/labels/', json={'name': name})
+
+    async def list_knowledge_base_labels(self, knowledge_base_id):
+        """列出知識庫標籤"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/labels/')
+
+    async def get_knowledge_base_label(self, knowledge_base_id, label_id):
+        """獲取知識庫標籤詳情"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/labels/{label_id}/')
+
+    async def update_knowledge_base_label(self, knowledge_base_id, label_id, name):
+        """更新知識庫標籤"""
+        return await self._request(
+            'PUT', f'knowledge-bases/{knowledge_base_id}/labels/{label_id}/', json={'name': name}
+        )
+
+    async def delete_knowledge_base_label(self, knowledge_base_id, label_id):
+        """刪除知識庫標籤"""
+        await self._request('DELETE', f'knowledge-bases/{knowledge_base_id}/labels/{label_id}/')
+
+    # ========== 知識庫 FAQ CRUD 操作 ==========
+
+    async def create_knowledge_base_faq(self, knowledge_base_id, question, answer, labels=None):
+        """建立知識庫 FAQ"""
+        payload = {'question': question, 'answer': answer, 'labels': labels or []}
+        return await self._request('POST', f'knowledge-bases/{knowledge_base_id}/faqs/', json=payload)
+
+    async def list_knowledge_base_faqs(self, knowledge_base_id):
+        """列出知識庫 FAQ"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/faqs/')
+
+    async def get_knowledge_base_faq(self, knowledge_base_id, faq_id):
+        """獲取知識庫 FAQ 詳情"""
+        return await self._request('GET', f'knowledge-bases/{knowledge_base_id}/faqs/{faq_id}/')
+
+    async def update_knowledge_base_faq(self, knowledge_base_id, faq_id, question=None, answer=None, labels=None):
+        """更新知識庫 FAQ"""
+        payload = {'question': question, 'answer': answer, 'labels': labels}
+        payload = {k: v for k, v in payload.items() if v is not None}
+        return await self._request('PUT', f'knowledge-bases/{knowledge_base_id}/faqs/{faq_id}/', json=payload)
+
+    async def delete_knowledge_base_faq(self, knowledge_base_id, faq_id):
+        """刪除知識庫 FAQ"""
+        await self._request('DELETE', f'knowledge-bases/{knowledge_base_id}/faqs/{faq_id}/')
+
+    async def batch_delete_knowledge_base_faqs(self, knowledge_base_id, faq_ids=None):
+        """批次刪除知識庫 FAQ，不提供 faq_ids 時刪除全部"""
+        return await self._request(
+            'POST', f'knowledge-bases/{knowledge_base_id}/faqs/batch-delete/', json={'ids': faq_ids or []}
+        )
+
+    async def update_knowledge_base_faq_metadata(
+        self, knowledge_base_id, faq_id, labels=None, raw_user_define_metadata=None
+    ):
+        """更新知識庫 FAQ 的標籤和元數據"""
+        payload = {}
+        if labels is not None:
+            payload['labels'] = labels
+        if raw_user_define_metadata is not None:
+            payload['rawUserDefineMetadata'] = raw_user_define_metadata
+        return await self._request(
+            'PATCH', f'knowledge-bases/{knowledge_base_id}/faqs/{faq_id}/update-metadata/', json=payload
+        )
+
+    # ========== 知識庫文件操作 ==========
+
+    async def list_knowledge_base_documents(self, knowledge_base_id, chatbot_file_id):
+        """列出知識庫文件"""
+        return await self._request(
+            'GET', f'knowledge-bases/{knowledge_base_id}/documents/', params={'chatbot_file_id': chatbot_file_id}
+        )
+
+    async def update_knowledge_base_document(self, knowledge_base_id, document_id, content=None, metadata=None):
+        """更新知識庫文件"""
+        payload = {}
+        if content is not None:
+            payload['content'] = content
+        if metadata is not None:
+            payload['metadata'] = metadata
+        return await self._request(
+            'PUT', f'knowledge-bases/{knowledge_base_id}/documents/{document_id}/', json=payload
+        )
+
+    async def delete_knowledge_base_document(self, knowledge_base_id, document_id):
+        """刪除知識庫文件"""
+        await self._request('DELETE', f'knowledge-bases/{knowledge_base_id}/documents/{document_id}/')
+
+    # ========== 自動分頁 ==========
+
+    async def _iter_pages(self, path, params=None, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """
+        逐筆產生分頁 API 的所有項目
+
+        第一頁的 count 決定總頁數後，其餘分頁會在 prefetch 大小的視窗內並行取得，
+        並依頁碼順序產生項目；沒有 count 的端點則退回依 next 連結逐頁讀取。
+        """
+        params = dict(params or {})
+        first_page = await self._request('GET', path, params={**params, 'page': 1, 'page_size': page_size})
+
+        # 未分頁的端點直接回傳陣列
+        if isinstance(first_page, list):
+            for item in first_page:
+                yield item
+            return
+
+        results = first_page.get('results', [])
+        for item in results:
+            yield item
+
+        if not first_page.get('next') or not results:
+            return
+
+        if 'count' not in first_page:
+            next_url = first_page['next']
+            while next_url:
+                page = await self._request('GET', next_url)
+                for item in page.get('results', []):
+                    yield item
+                next_url = page.get('next')
+            return
+
+        total_pages = math.ceil(first_page['count'] / len(results))
+        window = deque()
+        next_page = 2
+        try:
+            while next_page <= total_pages or window:
+                while next_page <= total_pages and len(window) < prefetch:
+                    page_params = {**params, 'page': next_page, 'page_size': page_size}
+                    window.append(asyncio.ensure_future(self._request('GET', path, params=page_params)))
+                    next_page += 1
+
+                page = await window.popleft()
+                for item in page.get('results', []):
+                    yield item
+        finally:
+            # 呼叫端提前停止迭代時，取消尚未完成的請求
+            for task in window:
+                task.cancel()
+
+    def iter_knowledge_bases(self, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """逐筆列出所有知識庫"""
+        return self._iter_pages('knowledge-bases/', page_size=page_size, prefetch=prefetch)
+
+    def iter_knowledge_base_files(self, knowledge_base_id, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """逐筆列出知識庫的所有檔案"""
+        return self._iter_pages(f'knowledge-bases/{knowledge_base_id}/files/', page_size=page_size, prefetch=prefetch)
+
+    def iter_knowledge_base_labels(self, knowledge_base_id, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """逐筆列出知識庫的所有標籤"""
+        return self._iter_pages(f'knowledge-bases/{knowledge_base_id}/labels/', page_size=page_size, prefetch=prefetch)
+
+    def iter_knowledge_base_faqs(self, knowledge_base_id, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """逐筆列出知識庫的所有 FAQ"""
+        return self._iter_pages(f'knowledge-bases/{knowledge_base_id}/faqs/', page_size=page_size, prefetch=prefetch)
+
+    def iter_knowledge_base_documents(
+        self, knowledge_base_id, chatbot_file_id, page_size=100, prefetch=4
+    ) -> AsyncIterator[dict]:
+        """逐筆列出知識庫檔案的所有文件"""
+        return self._iter_pages(
+            f'knowledge-bases/{knowledge_base_id}/documents/',
+            params={'chatbot_file_id': chatbot_file_id},
+            page_size=page_size,
+            prefetch=prefetch,
+        )
+
+    def iter_inbox_items(self, page_size=100, prefetch=4) -> AsyncIterator[dict]:
+        """逐筆列出所有收件匣項目"""
+        return self._iter_pages('inboxes/', page_size=page_size, prefetch=prefetch)
+
+    # ========== 收件匣 ==========
+
+    async def get_inbox_items(self):
+        """獲取所有收件匣項目"""
+        return [item async for item in self.iter_inbox_items()]
+
+    # ========== 聊天機器人對話 ==========
+
+    async def create_chatbot_completion(
+        self,
+        chatbot_id: str,
+        content: str,
+        attachments: list = None,
+        conversation_id: str = None,
+        is_streaming: bool = False,
+    ) -> Union[dict, AsyncCompletionStream]:
+        """
+        建立聊天機器人回應
+
+        Returns:
+            串流模式時回傳 AsyncCompletionStream（請用 async for 讀取事件或 deltas() 讀取文字，
+            建議搭配 async with 以便提前結束時立即釋放連線），
+            非串流模式回傳 dict；命中 completion_cache 時回傳快取內容（帶有 cached: True）
+        """
+        url = f'chatbots/{chatbot_id}/completions/'
+        payload = {
+            'conversation': conversation_id,
+            'message': {'content': content, 'attachments': attachments or []},
+            'is_streaming': is_streaming,
+        }
+
+        # 後續問題取決於對話歷史，只快取新對話
+        cache = self.completion_cache if conversation_id is None else None
+        if cache is not None:
+            cached = cache.get(chatbot_id, content, attachments)
+            if cached is not None:
+                return AsyncCompletionStream(_aiter(cache.replay_events(cached))) if is_streaming else cached
+
+        if not is_streaming:
+            response = await self._request('POST', url, json=payload)
+            if cache is not None:
+                cache.set(chatbot_id, content, attachments, response)
+            return response
+        on_done = None
+        if cache is not None:
+            on_done = lambda message: cache.set(chatbot_id, content, attachments, message)  # noqa: E731
+        return await self._handle_streaming_completion(f'{self.base_url}{url}', payload, on_done=on_done)
+
+    async def _handle_streaming_completion(self, url: str, payload: dict, on_done=None) -> AsyncCompletionStream:
+        """送出串流請求，回傳逐一產生事件的串流；HTTP 錯誤在此直接拋出"""
+        # 長回應可能超過總逾時，串流只限制兩次讀取之間的間隔
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self._timeout_seconds)
+        response = await self.session.post(url, headers=self._headers, json=payload, timeout=timeout)
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientResponseError:
+            response.release()
+            raise
+        return AsyncCompletionStream(AsyncJSONEventStream(response, json_loads=self.json_loads), on_done=on_done)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
@@ -0,0 +1,173 @@
+"""
+知識庫檔案的批次刪除
+
+KnowledgeFileDeleter 把要刪除的 ID 平均分成多個批次，透過 `files/batch-delete/` 並行送出
+（受自適應並發控制器限制：遇到 429/5xx 降低並發、遵守 Retry-After），
+最後以一次檔案清單確認哪些檔案真的已經刪除，不必再依錯誤訊息猜測（例如 API 回應 500 但實際上已刪除）。
+
+- 429 / 502 / 503 / 504、逾時等暫時性錯誤：等待後重試同一批次（有 Retry-After 時由並發控制器暫停，否則指數退避）
+- 400 / 409 / 422（例如其中一個檔案正在解析）：批次對半拆開重送，只有出問題的檔案失敗
+- 401 / 403 / 404 等其他錯誤與個別檔案無關：整批直接失敗
+
+Usage:
+    async with AsyncMaiAgentHelper(api_key) as helper:
+        deleter = KnowledgeFileDeleter(helper, knowledge_base_id, batch_size=100)
+        deleted_ids, failed = await deleter.delete(file_ids)
+        for file_id, error in failed.items():
+            print(file_id, error)
+"""
+import asyncio
+import math
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import aiohttp
+
+from .rate_limiter import ITEM_ERROR_STATUSES, TRANSIENT_ERRORS, AdaptiveConcurrencyLimiter, parse_retry_after
+
+RETRY_STATUSES = {408, 429, 502, 503, 504}
+
+
+class KnowledgeFileDeleter:
+    def __init__(
+        self,
+        helper,
+        knowledge_base_id: str,
+        batch_size: int = 100,
+        min_batch_size: int = 25,
+        concurrency: int = 8,
+        limiter: AdaptiveConcurrencyLimiter = None,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        verify: bool = True,
+        list_concurrency: int = 8,
+    ):
+        """
+        Args:
+            helper: AsyncMaiAgentHelper
+            knowledge_base_id: 知識庫 ID
+            batch_size: 每次請求最多刪除的檔案數
+            min_batch_size: 為了讓 concurrency 個請求同時進行而拆小批次時，每批至少的檔案數
+            concurrency: 同時進行的刪除請求數上限
+            limiter: 刪除請求使用的並發控制器；None 時建立上限為 concurrency 的自適應控制器
+            max_retries: 暫時性錯誤的重試次數
+            retry_delay: 沒有 Retry-After 時第一次重試前等待的秒數，之後每次加倍
+            verify: 刪除後讀取一次檔案清單確認結果
+            list_concurrency: 確認時同時抓取的分頁數
+        """
+        self.helper = helper
+        self.knowledge_base_id = knowledge_base_id
+        self.batch_size = max(1, batch_size)
+        self.min_batch_size = max(1, min(min_batch_size, self.batch_size))
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(
+            initial_limit=min(4, self.concurrency), max_limit=self.concurrency
+        )
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.verify = verify
+        self.list_concurrency = list_concurrency
+        self.requests_sent = 0
+        # 最近一次 delete() 的結果是否經過檔案清單確認
+        self.verified = False
+
+    def plan_batches(self, file_ids: List[str]) -> List[List[str]]:
+        """
+        把 ID 平均分成多個批次
+
+        批次數至少要讓每批不超過 batch_size；ID 不多時拆成最多 concurrency 批（每批不少於 min_batch_size），
+        讓所有並發名額都有事做，也避免最後剩下一個很小的批次。
+        """
+        if not file_ids:
+            return []
+        count = max(
+            math.ceil(len(file_ids) / self.batch_size),
+            min(self.concurrency, len(file_ids) // self.min_batch_size),
+            1,
+        )
+        size = math.ceil(len(file_ids) / count)
+        return [file_ids[start:start + size] for start in range(0, len(file_ids), size)]
+
+    async def delete(
+        self, file_ids: Iterable[str], on_progress: Callable[[int], None] = None
+    ) -> Tuple[List[str], Dict[str, str]]:
+        """
+        刪除檔案，回傳 (已刪除的 ID, {未刪除的 ID: 錯誤訊息})
+
+        Args:
+            file_ids: 要刪除的知識庫檔案 ID
+            on_progress: 每個批次完成時以該批次的檔案數呼叫
+        """
+        file_ids = list(dict.fromkeys(file_ids))
+        self.verified = False
+        errors: Dict[str, str] = {}
+        await asyncio.gather(
+            *(self._delete_batch(batch, errors, on_progress) for batch in self.plan_batches(file_ids))
+        )
+
+        if self.verify and file_ids:
+            try:
+                remaining = await self._remaining(file_ids)
+            except Exception:
+                # 無法確認時只能相信請求結果
+                pass
+            else:
+                self.verified = True
+                deleted = [file_id for file_id in file_ids if file_id not in remaining]
+                failed = {
+                    file_id: errors.get(file_id, 'File is still in the knowledge base')
+                    for file_id in file_ids
+                    if file_id in remaining
+                }
+                return deleted, failed
+
+        return [file_id for file_id in file_ids if file_id not in errors], errors
+
+    async def _post(self, file_ids: List[str]):
+        self.requests_sent += 1
+        async with self.limiter.slot():
+            return await self.helper.batch_delete_knowledge_base_files(self.knowledge_base_id, file_ids)
+
+    async def _delete_batch(self, file_ids: List[str], errors: Dict[str, str], on_progress, attempt: int = 0):
+        try:
+            await self._post(file_ids)
+        except aiohttp.ClientResponseError as e:
+            if e.status in RETRY_STATUSES and attempt < self.max_retries:
+                # 有 Retry-After 時並發控制器已暫停，取得名額後重送即可
+                if parse_retry_after((e.headers or {}).get('Retry-After')) is None:
+                    await self._backoff(attempt)
+                await self._delete_batch(file_ids, errors, on_progress, attempt + 1)
+                return
+            if len(file_ids) > 1 and e.status in ITEM_ERROR_STATUSES:
+                # 單一檔案（例如正在解析而回應 409）會讓整批失敗：對半拆開，找出出問題的檔案
+                half = len(file_ids) // 2
+                await asyncio.gather(
+                    self._delete_batch(file_ids[:half], errors, on_progress),
+                    self._delete_batch(file_ids[half:], errors, on_progress),
+                )
+                return
+            errors.update((file_id, f"{e.status}: {e.message}") for file_id in file_ids)
+        except TRANSIENT_ERRORS as e:
+            if attempt < self.max_retries:
+                await self._backoff(attempt)
+                await self._delete_batch(file_ids, errors, on_progress, attempt + 1)
+                return
+            errors.update((file_id, str(e) or type(e).__name__) for file_id in file_ids)
+        except Exception as e:
+            errors.update((file_id, str(e)) for file_id in file_ids)
+
+        if on_progress is not None:
+            on_progress(len(file_ids))
+
+    async def _backoff(self, attempt: int):
+        await asyncio.sleep(self.retry_delay * (2 ** attempt))
+
+    async def _remaining(self, file_ids: List[str]) -> set:
+        """讀取一次檔案清單，回傳仍在知識庫中的 ID"""
+        wanted = set(file_ids)
+        remaining = set()
+        async for file in self.helper.iter_knowledge_base_files(
+            self.knowledge_base_id, prefetch=self.list_concurrency
+        ):
+            if file.get('id') in wanted:
+                remaining.add(file['id'])
+        return remaining
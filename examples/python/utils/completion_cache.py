@@ -0,0 +1,295 @@
+"""
+聊天機器人回應的完全比對快取
+
+常見問題（例如台灣高鐵知識庫的 FAQ）經常被一字不差地重複詢問，每次都要完整跑一次 RAG + LLM。
+CompletionCache 以 (chatbot_id, 正規化後的問題, 附件 ID) 為鍵保存完整回應：
+- 後端：MemoryCacheBackend（行程內 LRU）或 SQLiteCacheBackend（磁碟，多個行程可共用）
+- 每筆資料有 TTL；知識庫或聊天機器人的檔案有異動時依 bind_knowledge_base() 的對應清除相關的快取
+- 只快取新對話的第一個問題：帶 conversation_id 的後續問題取決於對話歷史，不會讀寫快取
+
+傳給 MaiAgentHelper / AsyncMaiAgentHelper 的 completion_cache 參數後，create_chatbot_completion 會自動使用快取，
+helper 送出的知識庫異動請求（上傳、刪除、重新解析檔案、修改 FAQ 等）成功後也會自動清除對應的快取。
+命中時非串流模式回傳 dict，串流模式回傳以快取內容重播的 CompletionStream，兩者都帶有 `cached: True`，
+且 conversationId 為 None（快取的回應不屬於任何對話）。
+
+Usage:
+    cache = CompletionCache(SQLiteCacheBackend('completion_cache.sqlite3'), ttl=3600)
+    cache.bind_knowledge_base(knowledge_base_id, [chatbot_id])
+    helper = MaiAgentHelper(api_key, completion_cache=cache)
+    response = helper.create_chatbot_completion(chatbot_id, '高鐵可以帶寵物嗎？')
+
+    # 在其他地方（例如後台）修改知識庫後手動清除
+    cache.knowledge_base_changed(knowledge_base_id)
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import urlsplit
+
+MUTATING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_KNOWLEDGE_BASE_PATH = re.compile(r'/knowledge-bases/([^/]+)/(?:([^/]+)/)?')
+_CHATBOT_FILES_PATH = re.compile(r'/chatbots/([^/]+)/files/')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_content(content: str) -> str:
+    """正規化問題內容：NFKC（全形轉半形）、忽略大小寫、合併連續空白"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', content or '')).strip().casefold()
+
+
+def cache_key(chatbot_id: str, content: str, attachments: Iterable = None) -> str:
+    """以 (chatbot_id, 正規化後的問題, 排序後的附件 ID) 計算快取鍵"""
+    attachment_ids = sorted(
+        str(attachment.get('id') if isinstance(attachment, dict) else attachment)
+        for attachment in attachments or []
+    )
+    raw = json.dumps([chatbot_id, normalize_content(content), attachment_ids], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """行程內的 LRU 快取；超過 max_entries 時淘汰最久沒有使用的資料"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] is not None and entry['expires_at'] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_chatbots(self, chatbot_ids: Iterable[str]) -> int:
+        chatbot_ids = set(chatbot_ids)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry['chatbot_id'] in chatbot_ids]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    SQLite 磁碟快取；重新啟動後仍然有效，也可以讓多個行程共用
+
+    讀取時更新 last_used，寫入時超過 max_entries 則淘汰最久沒有使用的資料。
+    """
+
+    def __init__(self, db_path: str, max_entries: Optional[int] = 100_000):
+        """
+        Args:
+            db_path: SQLite 檔案路徑
+            max_entries: 保留的資料筆數上限；None 表示不限制（只依 TTL 過期）
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS completion_cache (
+                key TEXT PRIMARY KEY,
+                chatbot_id TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_completion_cache_chatbot ON completion_cache (chatbot_id);
+            CREATE INDEX IF NOT EXISTS idx_completion_cache_last_used ON completion_cache (last_used);
+            """
+        )
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT chatbot_id, response, created_at, expires_at FROM completion_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                if row[3] is not None and row[3] <= now:
+                    self.conn.execute("DELETE FROM completion_cache WHERE key = ?", (key,))
+                    return None
+                self.conn.execute("UPDATE completion_cache SET last_used = ? WHERE key = ?", (now, key))
+        return {'chatbot_id': row[0], 'response': json.loads(row[1]), 'created_at': row[2], 'expires_at': row[3]}
+
+    def set(self, key: str, entry: dict):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completion_cache "
+                "(key, chatbot_id, response, created_at, expires_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    entry['chatbot_id'],
+                    json.dumps(entry['response'], ensure_ascii=False),
+                    entry['created_at'],
+                    entry['expires_at'],
+                    entry['created_at'],
+                ),
+            )
+            if self.max_entries is not None:
+                self.conn.execute(
+                    "DELETE FROM completion_cache WHERE key IN ("
+                    "SELECT key FROM completion_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def delete_chatbots(self, chatbot_ids: Iterable[str]) -> int:
+        chatbot_ids = list(set(chatbot_ids))
+        with self._lock, self.conn:
+            return self.conn.executemany(
+                "DELETE FROM completion_cache WHERE chatbot_id = ?", [(chatbot_id,) for chatbot_id in chatbot_ids]
+            ).rowcount
+
+    def clear(self) -> int:
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM completion_cache").rowcount
+
+    def purge_expired(self) -> int:
+        """刪除已過期的資料"""
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM completion_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM completion_cache").fetchone()[0]
+
+
+class CompletionCache:
+    def __init__(self, backend=None, ttl: Optional[float] = 3600, replay_chunk_size: int = 32):
+        """
+        Args:
+            backend: MemoryCacheBackend 或 SQLiteCacheBackend；None 時使用預設大小的 MemoryCacheBackend
+            ttl: 每筆資料的存活秒數；None 表示不過期（只依異動清除）
+            replay_chunk_size: 以串流重播快取內容時每個事件的字元數
+        """
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = ttl
+        self.replay_chunk_size = max(1, replay_chunk_size)
+        self.hits = 0
+        self.misses = 0
+        self._knowledge_bases: Dict[str, Set[str]] = {}
+
+    # ========== 讀寫 ==========
+
+    def get(self, chatbot_id: str, content: str, attachments: Iterable = None) -> Optional[dict]:
+        """回傳快取的回應 dict（帶有 cached: True）；沒有命中時回傳 None"""
+        entry = self.backend.get(cache_key(chatbot_id, content, attachments))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(entry['response'], conversationId=None, done=True, cached=True)
+
+    def set(self, chatbot_id: str, content: str, attachments: Iterable, response: dict, ttl: Optional[float] = None):
+        """
+        保存完整回應；沒有內容或尚未完成的回應不會保存
+
+        Args:
+            ttl: 覆寫這筆資料的存活秒數
+        """
+        if not isinstance(response, dict) or not response.get('content') or response.get('done') is False:
+            return
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        # 對話 ID 屬於原本的對話，不保存
+        stored = {key: value for key, value in response.items() if key not in ('conversationId', 'cached')}
+        self.backend.set(
+            cache_key(chatbot_id, content, attachments),
+            {
+                'chatbot_id': chatbot_id,
+                'response': stored,
+                'created_at': now,
+                'expires_at': now + ttl if ttl is not None else None,
+            },
+        )
+
+    def replay_events(self, response: dict) -> List[dict]:
+        """把快取的回應切成與 completions 串流格式相同的事件"""
+        content = response.get('content') or ''
+        size = self.replay_chunk_size
+        events = [
+            {'conversationId': None, 'content': content[start:start + size], 'done': False, 'cached': True}
+            for start in range(0, len(content), size)
+        ]
+        events.append({'conversationId': None, 'content': '', 'done': True, 'cached': True})
+        return events
+
+    # ========== 清除 ==========
+
+    def bind_knowledge_base(self, knowledge_base_id: str, chatbot_ids: Iterable[str]):
+        """記錄哪些聊天機器人使用這個知識庫，知識庫異動時只清除這些聊天機器人的快取"""
+        self._knowledge_bases.setdefault(knowledge_base_id, set()).update(chatbot_ids)
+
+    def invalidate(self, chatbot_id: str = None) -> int:
+        """清除指定聊天機器人的快取；未指定時清除全部，回傳刪除的筆數"""
+        if chatbot_id is None:
+            return self.backend.clear()
+        return self.backend.delete_chatbots([chatbot_id])
+
+    def knowledge_base_changed(self, knowledge_base_id: str) -> int:
+        """知識庫內容改變時呼叫；沒有 bind 過的知識庫無法判斷影響範圍，清除全部快取"""
+        chatbot_ids = self._knowledge_bases.get(knowledge_base_id)
+        if not chatbot_ids:
+            return self.backend.clear()
+        return self.backend.delete_chatbots(chatbot_ids)
+
+    def observe_request(self, method: str, url: str, status: int):
+        """
+        helper 每個請求完成後呼叫：成功的知識庫異動請求清除對應的快取
+
+        建立知識庫（POST knowledge-bases/）與搜尋（POST .../search/）不會改變既有的回答，因此略過。
+        """
+        if method.upper() not in MUTATING_METHODS or not 200 <= status < 300:
+            return
+        path = urlsplit(url).path
+        match = _KNOWLEDGE_BASE_PATH.search(path)
+        if match is not None:
+            if match.group(2) != 'search':
+                self.knowledge_base_changed(match.group(1))
+            return
+        match = _CHATBOT_FILES_PATH.search(path)
+        if match is not None:
+            self.invalidate(match.group(1))
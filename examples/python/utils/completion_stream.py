@@ -0,0 +1,224 @@
+"""
+聊天機器人串流回應的結果物件
+
+CompletionStream（同步）與 AsyncCompletionStream（asyncio）包裝 create_chatbot_completion(is_streaming=True)
+產生的事件：
+- 直接迭代時仍然產生原本的事件 dict，既有的 `for data in ...` 程式不需要修改
+- `deltas()` 只產生每段新增的文字
+- 內容片段存在 list 中，`.text` 需要時才 join 一次，不會因為反覆 `+=` 而變成 O(n²)
+- `.conversation_id`、`.done`、`.final_message` 在串流結束後提供完整的回應
+
+CoalescingWriter 把小片段合併後再寫入終端機或 socket，依累積的大小或距離上次寫入的時間決定何時送出，
+避免每個 token 都呼叫一次 write + flush。
+
+Usage:
+    stream = helper.create_chatbot_completion(chatbot_id, 'Hello', is_streaming=True)
+    stream.write_to(sys.stdout)
+    print(stream.conversation_id, len(stream.text))
+
+    with helper.create_chatbot_completion(chatbot_id, 'Hello', is_streaming=True) as stream:
+        for delta in stream.deltas():
+            handle(delta)
+"""
+import time
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional
+
+
+class CoalescingWriter:
+    """合併小片段後再寫入；離開 with 區塊或呼叫 flush() 時送出剩下的內容"""
+
+    def __init__(self, file, max_size: int = 4096, max_delay: float = 0.05):
+        """
+        Args:
+            file: 有 write() 的物件（例如 sys.stdout、socket.makefile('w')），有 flush() 時寫入後一併呼叫
+            max_size: 累積超過此長度時立即寫入（str 為字元數，bytes 為位元組數）
+            max_delay: 距離上次寫入超過此秒數時，下一個片段立即寫入；串流停頓後的第一個片段不會被延遲
+        """
+        self.file = file
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.writes = 0
+        self._parts: List = []
+        self._size = 0
+        self._last_flush = float('-inf')
+
+    def write(self, data):
+        if not data:
+            return
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.max_size or time.monotonic() - self._last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            data = self._parts[0] if len(self._parts) == 1 else self._parts[0][:0].join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.file.write(data)
+            self.writes += 1
+            flush = getattr(self.file, 'flush', None)
+            if flush is not None:
+                flush()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+class _CompletionState:
+    """累積事件內容；同步與非同步版本共用"""
+
+    def __init__(self, on_done: Optional[Callable[[dict], None]] = None):
+        self._on_done = on_done
+        self.conversation_id: Optional[str] = None
+        self.done = False
+        self.final_event: Optional[dict] = None
+        self.event_count = 0
+        self._parts: List[str] = []
+        self._text: Optional[str] = ''
+
+    def _consume(self, data: dict) -> Optional[str]:
+        """記錄一個事件，回傳新增的文字（沒有時為 None）"""
+        self.event_count += 1
+        if data.get('conversationId'):
+            self.conversation_id = data['conversationId']
+        content = data.get('content') or ''
+        if data.get('done'):
+            self.done = True
+            self.final_event = data
+            # 結束事件帶有完整內容時只在沒有收到任何片段的情況下採用，避免內容重複
+            delta = content if content and not self._parts else None
+            if delta:
+                self._parts.append(delta)
+                self._text = None
+            if self._on_done is not None:
+                self._on_done(self.final_message)
+            return delta
+        elif not content:
+            return None
+        self._parts.append(content)
+        self._text = None
+        return content
+
+    @property
+    def text(self) -> str:
+        """目前累積的完整文字"""
+        if self._text is None:
+            self._text = ''.join(self._parts)
+            self._parts = [self._text]
+        return self._text
+
+    @property
+    def final_message(self) -> dict:
+        """以最後一個事件為基礎、content 換成完整文字的回應（與非串流模式的回應格式相同）"""
+        message = dict(self.final_event or {})
+        message.update(conversationId=self.conversation_id, content=self.text, done=self.done)
+        return message
+
+
+class CompletionStream(_CompletionState):
+    def __init__(self, events: Iterable[dict], on_done: Optional[Callable[[dict], None]] = None):
+        """
+        Args:
+            events: 串流事件 dict 的 iterator（例如 MaiAgentHelper._handle_streaming_completion 的 generator）
+            on_done: 收到結束事件時以 final_message 呼叫（例如寫入回應快取）
+        """
+        super().__init__(on_done)
+        self._events = iter(events)
+
+    def __iter__(self) -> Iterator[dict]:
+        for data in self._events:
+            self._consume(data)
+            yield data
+
+    def deltas(self) -> Iterator[str]:
+        """逐一產生新增的文字"""
+        for data in self._events:
+            delta = self._consume(data)
+            if delta:
+                yield delta
+
+    def read(self) -> str:
+        """讀完剩下的事件，回傳完整文字"""
+        for data in self._events:
+            self._consume(data)
+        return self.text
+
+    def write_to(self, file, max_size: int = 4096, max_delay: float = 0.05) -> str:
+        """把剩下的內容經由 CoalescingWriter 寫入 file，回傳完整文字"""
+        with CoalescingWriter(file, max_size=max_size, max_delay=max_delay) as writer:
+            for delta in self.deltas():
+                writer.write(delta)
+        return self.text
+
+    def close(self):
+        """提前結束時關閉底層的 HTTP 回應"""
+        close = getattr(self._events, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncCompletionStream(_CompletionState):
+    def __init__(self, events: AsyncIterator[dict], on_done: Optional[Callable[[dict], None]] = None):
+        """
+        Args:
+            events: 串流事件 dict 的 async iterator（例如 AsyncJSONEventStream）
+            on_done: 收到結束事件時以 final_message 呼叫（例如寫入回應快取）
+        """
+        super().__init__(on_done)
+        self._events = events
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        data = await self._events.__anext__()
+        self._consume(data)
+        return data
+
+    async def deltas(self) -> AsyncIterator[str]:
+        """逐一產生新增的文字"""
+        async for data in self._events:
+            delta = self._consume(data)
+            if delta:
+                yield delta
+
+    async def read(self) -> str:
+        """讀完剩下的事件，回傳完整文字"""
+        async for data in self._events:
+            self._consume(data)
+        return self.text
+
+    async def write_to(self, file, max_size: int = 4096, max_delay: float = 0.05) -> str:
+        """把剩下的內容經由 CoalescingWriter 寫入 file，回傳完整文字"""
+        with CoalescingWriter(file, max_size=max_size, max_delay=max_delay) as writer:
+            async for delta in self.deltas():
+                writer.write(delta)
+        return self.text
+
+    def close(self):
+        """提前結束時關閉底層的 HTTP 回應"""
+        close = getattr(self._events, 'close', None)
+        if close is not None:
+            close()
+
+    async def aclose(self):
+        aclose = getattr(self._events, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
@@ -0,0 +1,56 @@
+"""
+依 createdAt 由新到舊讀取知識庫檔案清單的共用工具
+
+鏡像的增量同步、解析狀態輪詢與註冊結果查詢都以 ordering=-created_at 讀取清單，讀到夠舊的分頁就停止。
+伺服器忽略 ordering 時這樣會漏讀，因此 DescendingPages 逐頁（包含跨頁）確認清單確實由新到舊，
+只有確認後才能依建立時間提前停止。
+
+Usage:
+    pages = DescendingPages()
+    data = await helper.list_knowledge_base_files(knowledge_base_id, page=1, ordering=DESCENDING_ORDERING)
+    pages.add(data['results'])
+    if pages.older_than(stop_before):
+        ...  # 後面的分頁只會更舊
+"""
+from typing import Iterable, List, Optional
+
+# createdAt 由新到舊
+DESCENDING_ORDERING = '-created_at'
+
+
+def timestamp_ms(value) -> Optional[int]:
+    """createdAt / updatedAt 為毫秒時間戳；無法解析時回傳 None"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DescendingPages:
+    def __init__(self):
+        self.descending = True
+        self._previous: Optional[int] = None
+        self._page: List[Optional[int]] = []
+
+    def add(self, files: Iterable[dict]) -> bool:
+        """記錄下一頁的檔案，回傳到目前為止清單是否由新到舊"""
+        self._page = [timestamp_ms(file.get('createdAt')) for file in files]
+        known = [value for value in self._page if value is not None]
+        if self._previous is not None:
+            known.insert(0, self._previous)
+        if any(newer < older for newer, older in zip(known, known[1:])):
+            self.descending = False
+        if known:
+            self._previous = known[-1]
+        return self.descending
+
+    def older_than(self, threshold: Optional[int]) -> bool:
+        """清單由新到舊且最後一頁全部早於 threshold 時回傳 True，之後的分頁不必再讀"""
+        return (
+            self.descending
+            and threshold is not None
+            and bool(self._page)
+            and all(value is not None and value < threshold for value in self._page)
+        )
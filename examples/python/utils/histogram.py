@@ -0,0 +1,130 @@
+"""
+HDR 風格的延遲直方圖
+
+數值以整數（預設為微秒）記錄在對數分桶中：每個 2 的次方區間再平均分成固定數量的子桶，
+相對誤差固定（significant_digits=2 時小於 1%），記錄是 O(1)，記憶體只和實際出現的區間數有關，
+不需要保存每一筆樣本也能算出 p50 / p95 / p99。兩個直方圖可以 merge，適合分別記錄後再彙整。
+
+Usage:
+    histogram = LatencyHistogram()
+    histogram.record_seconds(0.123)
+    print(histogram.percentile(99) / 1000, 'ms')
+    print(histogram.summary(scale=1000))  # 以毫秒表示
+"""
+import math
+from typing import Dict, Iterable, List, Tuple
+
+
+class LatencyHistogram:
+    def __init__(self, significant_digits: int = 2, unit_per_second: int = 1_000_000):
+        """
+        Args:
+            significant_digits: 保留的有效位數（1～5），決定子桶數量與相對誤差
+            unit_per_second: record_seconds() 換算成整數時每秒的單位數，預設為微秒
+        """
+        if not 1 <= significant_digits <= 5:
+            raise ValueError('significant_digits must be between 1 and 5')
+        self.significant_digits = significant_digits
+        self.unit_per_second = unit_per_second
+        # 子桶數為 2 的次方且至少 2 * 10^digits，確保每個區間的解析度足夠
+        self._sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self._half_count = 1 << (self._sub_bucket_bits - 1)
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self._sub_bucket_bits)
+        return bucket * self._half_count + (value >> bucket)
+
+    def _bounds(self, index: int) -> Tuple[int, int]:
+        """回傳 index 對應的 [最小值, 最大值]"""
+        bucket = max(0, (index - self._half_count) // self._half_count)
+        sub = index - bucket * self._half_count
+        low = sub << bucket
+        return low, low + (1 << bucket) - 1
+
+    def record(self, value: int, count: int = 1):
+        """記錄一個非負整數值"""
+        value = int(value)
+        if value < 0:
+            raise ValueError('LatencyHistogram only records non-negative values')
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def record_seconds(self, seconds: float):
+        """以秒記錄，換算成 unit_per_second 的整數"""
+        self.record(round(max(0.0, seconds) * self.unit_per_second))
+
+    def merge(self, other: 'LatencyHistogram'):
+        """把另一個直方圖的內容加進來（兩者的 significant_digits 必須相同）"""
+        if other.significant_digits != self.significant_digits:
+            raise ValueError('Cannot merge histograms with different significant_digits')
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentiles(self, percents: Iterable[float]) -> List[int]:
+        """一次計算多個百分位數（0～100），只需走訪一次分桶"""
+        percents = list(percents)
+        if not self.count:
+            return [0] * len(percents)
+        targets = sorted(
+            (max(1, math.ceil(percent / 100 * self.count)), position) for position, percent in enumerate(percents)
+        )
+        results = [0] * len(percents)
+        cumulative = 0
+        pending = iter(targets)
+        target = next(pending)
+        for index in sorted(self._counts):
+            cumulative += self._counts[index]
+            while target is not None and cumulative >= target[0]:
+                # 以分桶的上界回報，再限制在實際的最小值與最大值之間
+                results[target[1]] = min(max(self._bounds(index)[1], self.min), self.max)
+                target = next(pending, None)
+            if target is None:
+                break
+        return results
+
+    def percentile(self, percent: float) -> int:
+        return self.percentiles([percent])[0]
+
+    def buckets(self) -> List[Tuple[int, int, int]]:
+        """回傳非空分桶的 (最小值, 最大值, 次數)，依數值排序"""
+        return [(*self._bounds(index), self._counts[index]) for index in sorted(self._counts)]
+
+    def summary(self, percents=(50, 95, 99), scale: float = 1) -> dict:
+        """
+        回傳 count / min / mean / 各百分位數 / max
+
+        Args:
+            percents: 要計算的百分位數
+            scale: 數值除以此值後輸出，例如記錄單位為微秒時 scale=1000 表示以毫秒輸出
+        """
+        values = self.percentiles(percents)
+        result = {
+            'count': self.count,
+            'min': (self.min or 0) / scale,
+            'mean': self.mean / scale,
+        }
+        for percent, value in zip(percents, values):
+            result[f'p{percent:g}'] = value / scale
+        result['max'] = (self.max or 0) / scale
+        return result
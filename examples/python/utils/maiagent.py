@@ -1,25 +1,85 @@
 import json
+import math
 import os
-import sseclient
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
-from typing import Union, Generator
+from typing import Union, Generator, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .completion_stream import CompletionStream
+from .multipart import MultipartFileEncoder
+from .sse import iter_sse_json
 
 
 class MaiAgentHelper:
     def __init__(
         self,
         api_key,
-        base_url='https://api.maiagent.ai/api/v1/'
+        base_url='https://api.maiagent.ai/api/v1/',
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        host_pool_sizes=None,
+        json_loads=None,
+        completion_cache=None,
     ):
+        """
+        Args:
+            api_key: MaiAgent API 金鑰
+            base_url: API 基礎 URL
+            pool_connections: 快取連線池的主機數量
+            pool_maxsize: 每個主機保留的 keep-alive 連線數
+            pool_block: 連線池用盡時是否等待，而不是另外建立新連線
+            host_pool_sizes: 針對特定主機（URL 前綴）覆寫連線池大小，例如
+                {'https://s3.ap-northeast-1.amazonaws.com/': 20}
+            json_loads: 解析串流事件的 JSON 解碼函式，預設在安裝 orjson 時使用 orjson
+            completion_cache: CompletionCache；設定後新對話的 create_chatbot_completion 會使用快取，
+                知識庫異動請求成功後清除對應的快取
+        """
         self.api_key = api_key
         self.base_url = base_url
+        self.json_loads = json_loads
+        self.completion_cache = completion_cache
+        self.session = self._build_session(pool_connections, pool_maxsize, pool_block, host_pool_sizes)
+        # 所有請求都經過同一個 session，在這裡觀察知識庫異動，不必修改每個方法
+        self.session.hooks['response'].append(self._observe_response)
+
+    @staticmethod
+    def _build_session(pool_connections, pool_maxsize, pool_block, host_pool_sizes):
+        """建立共用連線池的 Session，讓 API 與 S3 呼叫重複使用 TCP/TLS 連線"""
+        session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        # requests 會以最長的前綴挑選 adapter，因此個別主機可以有自己的連線池大小
+        for prefix, maxsize in (host_pool_sizes or {}).items():
+            session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=pool_block))
+
+        return session
+
+    def _observe_response(self, response, *args, **kwargs):
+        if self.completion_cache is not None:
+            self.completion_cache.observe_request(response.request.method, response.url, response.status_code)
+
+    def close(self):
+        """關閉連線池中的所有連線"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def create_conversation(self, web_chat_id):
         try:
             # 建立 conversation
-            response = requests.post(
+            response = self.session.post(
                 url=f'{self.base_url}conversations/',
                 headers={'Authorization': f'Api-Key {self.api_key}'},
                 json={
@@ -40,7 +100,7 @@ class MaiAgentHelper:
     def send_message(self, conversation_id, content, attachments=None):
         try:
             # 傳送訊息
-            response = requests.post(
+            response = self.session.post(
                 url=f'{self.base_url}messages/',
                 headers={'Authorization': f'Api-Key {self.api_key}'},
                 json={
@@ -69,7 +129,7 @@ class MaiAgentHelper:
 
         payload = {'filename': filename, 'modelName': model_name, 'fieldName': field_name, 'fileSize': file_size}
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = self.session.post(url, headers=headers, data=json.dumps(payload))
 
         response.raise_for_status()
 
@@ -85,20 +145,10 @@ class MaiAgentHelper:
         # 從 API response 取得上傳 URL（不再使用寫死的 storage_url）
         upload_url = upload_data['url']
 
-        with open(file_path, 'rb') as file:
-            # 使用 tuple list 明確控制順序
-            # AWS S3 / MinIO 要求 file 必須是最後一個欄位
-            fields = [
-                ('key', (None, upload_data['fields']['key'])),
-                ('x-amz-algorithm', (None, upload_data['fields']['x-amz-algorithm'])),
-                ('x-amz-credential', (None, upload_data['fields']['x-amz-credential'])),
-                ('x-amz-date', (None, upload_data['fields']['x-amz-date'])),
-                ('policy', (None, upload_data['fields']['policy'])),
-                ('x-amz-signature', (None, upload_data['fields']['x-amz-signature'])),
-                ('file', (os.path.basename(file_path), file)),  # file 必須在最後
-            ]
-
-            response = requests.post(upload_url, files=fields)
+        # 以串流方式送出 multipart body，記憶體用量與檔案大小無關
+        # AWS S3 / MinIO 要求 file 必須是最後一個欄位，MultipartFileEncoder 會把檔案放在最後
+        with MultipartFileEncoder(upload_data['fields'], 'file', file_path) as encoder:
+            response = self.session.post(upload_url, data=encoder, headers={'Content-Type': encoder.content_type})
 
             if response.status_code == 204:
                 print('File uploaded successfully')
@@ -122,7 +172,7 @@ class MaiAgentHelper:
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(response.text)
@@ -148,7 +198,7 @@ class MaiAgentHelper:
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(response.text)
@@ -170,7 +220,7 @@ class MaiAgentHelper:
         payload = {'files': [{'file': file_key, 'filename': original_filename}]}
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(response.text)
@@ -184,7 +234,7 @@ class MaiAgentHelper:
         url = f'{self.base_url}web-chats/{web_chat_id}/batch-qas/'
 
         try:
-            response = requests.post(
+            response = self.session.post(
                 url,
                 headers={
                     'Authorization': f'Api-Key {self.api_key}',
@@ -214,7 +264,7 @@ class MaiAgentHelper:
             'Authorization': f'Api-Key {self.api_key}',
         }
 
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url, headers=headers)
 
         if response.status_code == 200:
             content_disposition = response.headers.get('Content-Disposition')
@@ -242,21 +292,24 @@ class MaiAgentHelper:
         file_key = self.upload_file_to_s3(file_path, upload_url)
         return self.update_attachment_without_conversation(file_key, os.path.basename(file_path), type)
 
-    def upload_knowledge_file(self, knowledge_base_id, file_path):
-        """上傳檔案到知識庫"""
-        upload_url = self.get_upload_url(file_path, 'chatbot-file')
-        file_key = self.upload_file_to_s3(file_path, upload_url)
+    def register_knowledge_files(self, knowledge_base_id, files):
+        """
+        將已上傳到 S3 的檔案註冊到知識庫（一次請求可註冊多個檔案）
 
+        Args:
+            files: [{'file': <file_key>, 'filename': <原始檔名>}, ...]
+
+        Returns:
+            list: 建立的知識庫檔案，順序與 files 相同
+        """
         url = f'{self.base_url}knowledge-bases/{knowledge_base_id}/files/'
-        
+
         headers = {
             'Authorization': f'Api-Key {self.api_key}',
         }
 
-        payload = {'files': [{'file': file_key, 'filename': os.path.basename(file_path)}]}
-
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json={'files': files})
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -267,6 +320,35 @@ class MaiAgentHelper:
             print(e)
             exit(1)
 
+    def upload_knowledge_file(self, knowledge_base_id, file_path):
+        """上傳檔案到知識庫"""
+        upload_url = self.get_upload_url(file_path, 'chatbot-file')
+        file_key = self.upload_file_to_s3(file_path, upload_url)
+
+        return self.register_knowledge_files(
+            knowledge_base_id, [{'file': file_key, 'filename': os.path.basename(file_path)}]
+        )
+
+    def upload_knowledge_files(self, knowledge_base_id, file_paths, batch_size=50):
+        """
+        上傳多個檔案到知識庫，每 batch_size 個檔案只發送一次註冊請求
+
+        Returns:
+            list: 建立的知識庫檔案，順序與 file_paths 相同
+        """
+        knowledge_files = []
+        pending = []
+        for file_path in file_paths:
+            upload_url = self.get_upload_url(file_path, 'chatbot-file')
+            file_key = self.upload_file_to_s3(file_path, upload_url)
+            pending.append({'file': file_key, 'filename': os.path.basename(file_path)})
+            if len(pending) >= batch_size:
+                knowledge_files.extend(self.register_knowledge_files(knowledge_base_id, pending))
+                pending = []
+        if pending:
+            knowledge_files.extend(self.register_knowledge_files(knowledge_base_id, pending))
+        return knowledge_files
+
     def delete_knowledge_file(self, knowledge_base_id, file_id):
         """刪除知識庫檔案"""
         url = f'{self.base_url}knowledge-bases/{knowledge_base_id}/files/{file_id}/'
@@ -276,7 +358,7 @@ class MaiAgentHelper:
         }
 
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.session.delete(url, headers=headers)
             
             if response.status_code == 204:
                 print(f'Successfully deleted knowledge file with ID: {file_id}')
@@ -324,7 +406,7 @@ class MaiAgentHelper:
         payload = {k: v for k, v in payload.items() if v is not None}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -344,7 +426,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -364,7 +446,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -410,7 +492,7 @@ class MaiAgentHelper:
             payload['chatbots'] = chatbots
         
         try:
-            response = requests.put(url, headers=headers, json=payload)
+            response = self.session.put(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -430,7 +512,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.session.delete(url, headers=headers)
             response.raise_for_status()
             print(f'Successfully deleted knowledge base with ID: {knowledge_base_id}')
         except requests.exceptions.RequestException as e:
@@ -452,7 +534,7 @@ class MaiAgentHelper:
         payload = {'query': query}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -476,7 +558,7 @@ class MaiAgentHelper:
         payload = {'name': name}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -496,7 +578,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -516,7 +598,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -538,7 +620,7 @@ class MaiAgentHelper:
         payload = {'name': name}
         
         try:
-            response = requests.put(url, headers=headers, json=payload)
+            response = self.session.put(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -558,7 +640,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.session.delete(url, headers=headers)
             response.raise_for_status()
             print(f'Successfully deleted knowledge base label with ID: {label_id}')
         except requests.exceptions.RequestException as e:
@@ -580,7 +662,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -600,7 +682,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -626,7 +708,7 @@ class MaiAgentHelper:
             payload['rawUserDefineMetadata'] = raw_user_define_metadata
         
         try:
-            response = requests.patch(url, headers=headers, json=payload)
+            response = self.session.patch(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -648,7 +730,7 @@ class MaiAgentHelper:
         payload = {'ids': file_ids}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             print(f'Successfully deleted {len(file_ids)} files')
         except requests.exceptions.RequestException as e:
@@ -668,7 +750,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.patch(url, headers=headers, json=file_parsers)
+            response = self.session.patch(url, headers=headers, json=file_parsers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -696,7 +778,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -716,7 +798,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -736,7 +818,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -764,7 +846,7 @@ class MaiAgentHelper:
             payload['labels'] = labels
         
         try:
-            response = requests.put(url, headers=headers, json=payload)
+            response = self.session.put(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -784,7 +866,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.session.delete(url, headers=headers)
             response.raise_for_status()
             print(f'Successfully deleted knowledge base FAQ with ID: {faq_id}')
         except requests.exceptions.RequestException as e:
@@ -806,7 +888,7 @@ class MaiAgentHelper:
         payload = {'ids': faq_ids or []}
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             response.raise_for_status()
             if faq_ids:
                 print(f'Successfully deleted {len(faq_ids)} FAQs')
@@ -835,7 +917,7 @@ class MaiAgentHelper:
             payload['rawUserDefineMetadata'] = raw_user_define_metadata
         
         try:
-            response = requests.patch(url, headers=headers, json=payload)
+            response = self.session.patch(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -859,7 +941,7 @@ class MaiAgentHelper:
         params = {'chatbot_file_id': chatbot_file_id}
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.session.get(url, headers=headers, params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -885,7 +967,7 @@ class MaiAgentHelper:
             payload['metadata'] = metadata
         
         try:
-            response = requests.put(url, headers=headers, json=payload)
+            response = self.session.put(url, headers=headers, json=payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -905,7 +987,7 @@ class MaiAgentHelper:
         }
         
         try:
-            response = requests.delete(url, headers=headers)
+            response = self.session.delete(url, headers=headers)
             response.raise_for_status()
             print(f'Successfully deleted knowledge base document with ID: {document_id}')
         except requests.exceptions.RequestException as e:
@@ -916,31 +998,108 @@ class MaiAgentHelper:
             print(e)
             exit(1)
 
-    def get_inbox_items(self):
-        inbox_items = []
-
-        url = f'{self.base_url}inboxes/'
-        while True:
-            try:
-                response = requests.get(
-                    url=url,
-                    headers={'Authorization': f'Api-Key {self.api_key}'},
-                )
-                response.raise_for_status()
-                inbox_items.extend(response.json()['results'])
-            except requests.exceptions.RequestException as e:
-                print(response.text)
-                print(e)
-                exit(1)
-            except Exception as e:
-                print(e)
-                exit(1)
+    # ========== 自動分頁 ==========
 
-            url = response.json()['next']
-            if url is None:
-                break
+    def _get_page(self, url, params=None):
+        """取得單一分頁，錯誤時拋出 requests.HTTPError"""
+        response = self.session.get(url, headers={'Authorization': f'Api-Key {self.api_key}'}, params=params)
+        response.raise_for_status()
+        return response.json()
 
-        return inbox_items
+    def _iter_pages(self, url, params=None, page_size=100, prefetch=4) -> Iterator[dict]:
+        """
+        逐筆產生分頁 API 的所有項目
+
+        第一頁的 count 決定總頁數後，其餘分頁會在 prefetch 大小的視窗內並行取得，
+        並依頁碼順序產生項目；沒有 count 的端點則退回依 next 連結逐頁讀取。
+        """
+        params = dict(params or {})
+        first_page = self._get_page(url, {**params, 'page': 1, 'page_size': page_size})
+
+        # 未分頁的端點直接回傳陣列
+        if isinstance(first_page, list):
+            yield from first_page
+            return
+
+        results = first_page.get('results', [])
+        yield from results
+
+        if not first_page.get('next') or not results:
+            return
+
+        if 'count' not in first_page:
+            next_url = first_page['next']
+            while next_url:
+                page = self._get_page(next_url)
+                yield from page.get('results', [])
+                next_url = page.get('next')
+            return
+
+        total_pages = math.ceil(first_page['count'] / len(results))
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        window = deque()
+        next_page = 2
+        try:
+            while next_page <= total_pages or window:
+                while next_page <= total_pages and len(window) < prefetch:
+                    page_params = {**params, 'page': next_page, 'page_size': page_size}
+                    window.append(executor.submit(self._get_page, url, page_params))
+                    next_page += 1
+
+                page = window.popleft().result()
+                yield from page.get('results', [])
+        finally:
+            # 呼叫端提前停止迭代時，取消尚未開始的請求
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_knowledge_bases(self, page_size=100, prefetch=4) -> Iterator[dict]:
+        """逐筆列出所有知識庫"""
+        return self._iter_pages(f'{self.base_url}knowledge-bases/', page_size=page_size, prefetch=prefetch)
+
+    def iter_knowledge_base_files(self, knowledge_base_id, page_size=100, prefetch=4) -> Iterator[dict]:
+        """逐筆列出知識庫的所有檔案"""
+        return self._iter_pages(
+            f'{self.base_url}knowledge-bases/{knowledge_base_id}/files/', page_size=page_size, prefetch=prefetch
+        )
+
+    def iter_knowledge_base_labels(self, knowledge_base_id, page_size=100, prefetch=4) -> Iterator[dict]:
+        """逐筆列出知識庫的所有標籤"""
+        return self._iter_pages(
+            f'{self.base_url}knowledge-bases/{knowledge_base_id}/labels/', page_size=page_size, prefetch=prefetch
+        )
+
+    def iter_knowledge_base_faqs(self, knowledge_base_id, page_size=100, prefetch=4) -> Iterator[dict]:
+        """逐筆列出知識庫的所有 FAQ"""
+        return self._iter_pages(
+            f'{self.base_url}knowledge-bases/{knowledge_base_id}/faqs/', page_size=page_size, prefetch=prefetch
+        )
+
+    def iter_knowledge_base_documents(
+        self, knowledge_base_id, chatbot_file_id, page_size=100, prefetch=4
+    ) -> Iterator[dict]:
+        """逐筆列出知識庫檔案的所有文件"""
+        return self._iter_pages(
+            f'{self.base_url}knowledge-bases/{knowledge_base_id}/documents/',
+            params={'chatbot_file_id': chatbot_file_id},
+            page_size=page_size,
+            prefetch=prefetch,
+        )
+
+    def iter_inbox_items(self, page_size=100, prefetch=4) -> Iterator[dict]:
+        """逐筆列出所有收件匣項目"""
+        return self._iter_pages(f'{self.base_url}inboxes/', page_size=page_size, prefetch=prefetch)
+
+    def get_inbox_items(self):
+        try:
+            return list(self.iter_inbox_items())
+        except requests.exceptions.RequestException as e:
+            if e.response is not None:
+                print(e.response.text)
+            print(e)
+            exit(1)
+        except Exception as e:
+            print(e)
+            exit(1)
 
     def display_inbox_items(self, inbox_items):
         for inbox_item in inbox_items:
@@ -949,7 +1108,7 @@ class MaiAgentHelper:
             webchat_name = inbox_item['channel']['name']
             print(f'Inbox ID: {inbox_id}, Webchat ID: {webchat_id}, Webchat Name: {webchat_name}')
 
-    def create_chatbot_completion(self, chatbot_id: str, content: str, attachments: list = None, conversation_id: str = None, is_streaming: bool = False) -> Union[dict, Generator]:
+    def create_chatbot_completion(self, chatbot_id: str, content: str, attachments: list = None, conversation_id: str = None, is_streaming: bool = False) -> Union[dict, CompletionStream]:
         """
         建立聊天機器人回應
 
@@ -961,7 +1120,8 @@ class MaiAgentHelper:
             is_streaming: 是否使用串流模式
 
         Returns:
-            串流模式時回傳 Generator，非串流模式回傳 dict
+            串流模式時回傳 CompletionStream（迭代時產生事件 dict，也提供 .text、.deltas()、.write_to()），
+            非串流模式回傳 dict；命中 completion_cache 時回傳快取內容（帶有 cached: True）
             回應格式: {
                 "conversationId": str,
                 "content": str,
@@ -983,10 +1143,23 @@ class MaiAgentHelper:
             'is_streaming': is_streaming
         }
 
+        # 後續問題取決於對話歷史，只快取新對話
+        cache = self.completion_cache if conversation_id is None else None
+        if cache is not None:
+            cached = cache.get(chatbot_id, content, attachments)
+            if cached is not None:
+                return CompletionStream(cache.replay_events(cached)) if is_streaming else cached
+
         try:
             if not is_streaming:
-                return self._handle_non_streaming_completion(url, headers, payload)
-            return self._handle_streaming_completion(url, headers, payload)
+                response = self._handle_non_streaming_completion(url, headers, payload)
+                if cache is not None:
+                    cache.set(chatbot_id, content, attachments, response)
+                return response
+            on_done = None
+            if cache is not None:
+                on_done = lambda message: cache.set(chatbot_id, content, attachments, message)  # noqa: E731
+            return CompletionStream(self._handle_streaming_completion(url, headers, payload), on_done=on_done)
                 
         except requests.exceptions.RequestException as e:
             error_msg = f"請求失敗: {str(e)}"
@@ -996,7 +1169,7 @@ class MaiAgentHelper:
 
     def _handle_non_streaming_completion(self, url: str, headers: dict, payload: dict) -> dict:
         """處理非串流模式的回應"""
-        response = requests.post(
+        response = self.session.post(
             url,
             headers=headers,
             json=payload
@@ -1006,20 +1179,16 @@ class MaiAgentHelper:
 
     def _handle_streaming_completion(self, url: str, headers: dict, payload: dict) -> Generator:
         """處理串流模式的回應"""
-        response = requests.post(
+        response = self.session.post(
             url,
             headers=headers,
             json=payload,
             stream=True
         )
-        response.raise_for_status()
-        
-        client = sseclient.SSEClient(response)
-        for event in client.events():
-            if event.data:
-                try:
-                    data = json.loads(event.data)
-                    yield data
-                except json.JSONDecodeError as e:
-                    print(f"JSON 解析失敗: {event.data}")
-                    continue
+        try:
+            response.raise_for_status()
+            # chunk_size=None：收到多少就處理多少，不等待固定大小的區塊；無法解析的事件會記錄 warning 後略過
+            yield from iter_sse_json(response.iter_content(chunk_size=None), json_loads=self.json_loads)
+        finally:
+            # 呼叫端提前 break 或 generator 被回收時也會執行，避免未讀完的連線一直佔住連線池
+            response.close()
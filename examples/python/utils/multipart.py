@@ -0,0 +1,91 @@
+import io
+import os
+import uuid
+
+
+def _quote_param(value):
+    """依 HTML5 規則跳脫 multipart header 參數（與瀏覽器、urllib3 相同）"""
+    return value.replace('\r', '%0D').replace('\n', '%0A').replace('"', '%22')
+
+
+class MultipartFileEncoder:
+    """
+    以串流方式產生 multipart/form-data 內容
+
+    requests 的 files= 會先把整個檔案讀進記憶體組成 body；這個類別則提供 read() 與 len()，
+    讓 requests 以固定大小的區塊從磁碟讀取並送出，同時仍能帶上正確的 Content-Length。
+    記憶體用量只與區塊大小有關，與檔案大小無關。
+
+    Usage:
+        with MultipartFileEncoder(upload_data['fields'], 'file', file_path) as encoder:
+            session.post(url, data=encoder, headers={'Content-Type': encoder.content_type})
+    """
+
+    def __init__(self, fields, file_field, file_path, filename=None, content_type='application/octet-stream'):
+        """
+        Args:
+            fields: 依序放在檔案前面的一般欄位（dict 或 (name, value) 列表）
+            file_field: 檔案欄位名稱，永遠放在最後（S3 / MinIO 的要求）
+            file_path: 要上傳的檔案路徑
+            filename: multipart 中的檔名，預設為檔案路徑的 basename
+            content_type: 檔案的 Content-Type
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+
+        items = fields.items() if isinstance(fields, dict) else fields
+        head = io.BytesIO()
+        for name, value in items:
+            head.write(f'--{self.boundary}\r\n'.encode())
+            head.write(f'Content-Disposition: form-data; name="{_quote_param(name)}"\r\n\r\n'.encode())
+            head.write(str(value).encode('utf-8'))
+            head.write(b'\r\n')
+
+        filename = filename or os.path.basename(file_path)
+        head.write(f'--{self.boundary}\r\n'.encode())
+        head.write(
+            f'Content-Disposition: form-data; name="{_quote_param(file_field)}"; '
+            f'filename="{_quote_param(filename)}"\r\n'.encode('utf-8')
+        )
+        head.write(f'Content-Type: {content_type}\r\n\r\n'.encode())
+        head.seek(0)
+
+        self._file = open(file_path, 'rb')
+        file_size = os.fstat(self._file.fileno()).st_size
+        tail = io.BytesIO(f'\r\n--{self.boundary}--\r\n'.encode())
+
+        self._length = len(head.getbuffer()) + file_size + len(tail.getbuffer())
+        self._parts = [head, self._file, tail]
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def len(self):
+        return self._length
+
+    def read(self, size=-1):
+        """依序從各段讀取，最多回傳 size 個位元組；size < 0 時讀取剩餘全部"""
+        if size is None or size < 0:
+            return b''.join(part.read() for part in self._parts)
+
+        chunks = []
+        remaining = size
+        while remaining > 0 and self._parts:
+            chunk = self._parts[0].read(remaining)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
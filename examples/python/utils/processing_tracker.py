@@ -0,0 +1,252 @@
+"""
+追蹤知識庫檔案的解析狀態（initial / processing → done / failed）
+
+ProcessingTracker 接收剛註冊的 knowledge_file_id，在背景以批次方式輪詢：
+追蹤的檔案較多時以 ordering=-created_at 由新到舊讀取檔案清單，一個分頁就能同時取得 page_size 個檔案的狀態，
+只有少量檔案（或清單中找不到的檔案）才逐一查詢。輪詢間隔一開始很短，之後逐次拉長；有新檔案加入時重新從最短間隔開始。
+
+每個檔案對應一個 future，到達 done / failed 時完成（結果為檔案資料），也可以指定 callback 立即處理失敗的檔案。
+重新解析的檔案以 track(..., requested_at=...) 追蹤：在看到 initial / processing 或 updatedAt 晚於請求時間之前，
+清單中的 done / failed 視為重新解析前的舊狀態，不會結束追蹤。
+
+Usage:
+    async with ProcessingTracker(helper, knowledge_base_id) as tracker:
+        future = tracker.track(knowledge_file['id'], created_at=knowledge_file.get('createdAt'))
+        knowledge_file = await future
+        print(knowledge_file['status'])  # 'done' or 'failed'
+"""
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+import aiohttp
+
+from .file_listing import DESCENDING_ORDERING, DescendingPages, timestamp_ms
+from .rate_limiter import AdaptiveConcurrencyLimiter
+
+TERMINAL_STATUSES = ('done', 'failed')
+
+
+class _TrackedFile:
+    __slots__ = ('future', 'created_at', 'callback', 'requested_at', 'seen_active')
+
+    def __init__(self, future, created_at, callback, requested_at=None):
+        self.future = future
+        self.created_at = created_at
+        self.callback = callback
+        self.requested_at = requested_at
+        self.seen_active = False
+
+
+class ProcessingTracker:
+    def __init__(
+        self,
+        helper,
+        knowledge_base_id: str,
+        min_interval: float = 2.0,
+        max_interval: float = 60.0,
+        backoff: float = 1.5,
+        list_threshold: int = 20,
+        page_size: int = 100,
+        concurrency: int = 8,
+        limiter: AdaptiveConcurrencyLimiter = None,
+        stale_timeout: float = 300.0,
+    ):
+        """
+        Args:
+            helper: AsyncMaiAgentHelper
+            knowledge_base_id: 知識庫 ID
+            min_interval: 最短輪詢間隔（秒）
+            max_interval: 最長輪詢間隔（秒）
+            backoff: 每輪之後間隔乘上的倍數
+            list_threshold: 追蹤的檔案數達到此值時改讀檔案清單，否則逐一查詢
+            page_size: 讀取檔案清單時每頁的檔案數
+            concurrency: 逐一查詢時同時進行的請求數
+            limiter: 輪詢請求使用的並發控制器；None 表示不限制
+            stale_timeout: 帶 requested_at 的檔案沒有 updatedAt 可以比對時，超過此秒數仍是 done / failed 就採用該狀態
+        """
+        self.helper = helper
+        self.knowledge_base_id = knowledge_base_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.list_threshold = list_threshold
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.stale_timeout = stale_timeout
+        self.requests_sent = 0
+        self.status_counts: Dict[str, int] = {status: 0 for status in TERMINAL_STATUSES}
+        self._pending: Dict[str, _TrackedFile] = {}
+        self._interval = min_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        """尚未完成解析的檔案數"""
+        return len(self._pending)
+
+    def track(
+        self, file_id: str, created_at=None, callback: Callable[[dict], None] = None, requested_at=None
+    ) -> asyncio.Future:
+        """
+        開始追蹤一個檔案，回傳解析完成（done / failed）時完成的 future
+
+        Args:
+            file_id: knowledge_file_id
+            created_at: 註冊回應中的 createdAt（毫秒時間戳），用來判斷清單讀到哪一頁即可停止
+            callback: 解析完成時以檔案資料呼叫
+            requested_at: 重新解析請求送出的時間（毫秒時間戳）；之前的 done / failed 狀態會被忽略
+        """
+        tracked = self._pending.get(file_id)
+        if tracked is not None:
+            return tracked.future
+
+        future = asyncio.get_running_loop().create_future()
+        # 只使用 callback 的呼叫者不會 await future，避免檔案被刪除時出現未取回例外的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._pending[file_id] = _TrackedFile(future, timestamp_ms(created_at), callback, timestamp_ms(requested_at))
+        # 新檔案剛進入解析佇列，從最短間隔重新開始
+        self._interval = self.min_interval
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return future
+
+    async def wait_all(self):
+        """等待目前追蹤的所有檔案完成解析"""
+        futures = [tracked.future for tracked in self._pending.values()]
+        if futures:
+            await asyncio.gather(*futures, return_exceptions=True)
+
+    async def close(self):
+        """停止輪詢；尚未完成的 future 會被取消"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for tracked in self._pending.values():
+            tracked.future.cancel()
+        self._pending.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await asyncio.sleep(self._interval)
+            try:
+                await self.poll()
+            except Exception:
+                # 讀取清單失敗時下一輪再查詢
+                pass
+            self._interval = min(self.max_interval, self._interval * self.backoff)
+
+    async def _request(self, coro_factory):
+        self.requests_sent += 1
+        if self.limiter is None:
+            return await coro_factory()
+        async with self.limiter.slot():
+            return await coro_factory()
+
+    async def poll(self):
+        """查詢一輪所有追蹤中檔案的狀態"""
+        if len(self._pending) >= self.list_threshold:
+            unseen = await self._poll_listing()
+        else:
+            unseen = set(self._pending)
+        if unseen:
+            await self._poll_individually(unseen)
+
+    async def _poll_listing(self) -> set:
+        """依 createdAt 由新到舊讀取檔案清單，回傳清單中沒有出現的追蹤檔案"""
+        unseen = set(self._pending)
+        created = [tracked.created_at for tracked in self._pending.values()]
+        # 所有追蹤檔案都有建立時間時，讀到比最舊的還舊的分頁即可停止
+        oldest = min(created) if created and None not in created else None
+
+        page = 1
+        pages = DescendingPages()
+        while unseen:
+            data = await self._request(
+                lambda: self.helper.list_knowledge_base_files(
+                    self.knowledge_base_id, page=page, page_size=self.page_size, ordering=DESCENDING_ORDERING
+                )
+            )
+            results = data.get('results', []) if isinstance(data, dict) else (data or [])
+            for file in results:
+                if file.get('id') in unseen:
+                    unseen.discard(file['id'])
+                    self._update(file)
+
+            # 伺服器忽略 ordering 時不能依建立時間提前停止，改為讀到最後一頁（next 為空）
+            pages.add(results)
+            past_oldest = pages.older_than(oldest)
+            if past_oldest or not isinstance(data, dict) or not data.get('next') or not results:
+                break
+            page += 1
+        return unseen
+
+    async def _poll_individually(self, file_ids):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def poll_one(file_id):
+            async with semaphore:
+                try:
+                    file = await self._request(
+                        lambda: self.helper.get_knowledge_base_file(self.knowledge_base_id, file_id)
+                    )
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 404:
+                        # 檔案已被刪除，不會再有結果
+                        self._resolve(file_id, error=e)
+                    return
+                except Exception:
+                    # 暫時性錯誤，下一輪再查詢
+                    return
+            if file:
+                self._update(file)
+
+        await asyncio.gather(*(poll_one(file_id) for file_id in file_ids))
+
+    def _update(self, file: dict):
+        tracked = self._pending.get(file.get('id'))
+        if tracked is None:
+            return
+        if file.get('status') not in TERMINAL_STATUSES:
+            tracked.seen_active = True
+            return
+        if tracked.requested_at is not None and not tracked.seen_active and self._is_stale(file, tracked):
+            # 伺服器還沒開始重新解析，仍是請求前的狀態
+            return
+        self._resolve(file['id'], file=file)
+
+    def _is_stale(self, file: dict, tracked: _TrackedFile) -> bool:
+        updated_at = timestamp_ms(file.get('updatedAt'))
+        if updated_at is not None:
+            return updated_at <= tracked.requested_at
+        return time.time() * 1000 - tracked.requested_at < self.stale_timeout * 1000
+
+    def _resolve(self, file_id: str, file: dict = None, error: Exception = None):
+        tracked = self._pending.pop(file_id, None)
+        if tracked is None:
+            return
+        if file is not None:
+            self.status_counts[file['status']] += 1
+        if not tracked.future.done():
+            if error is not None:
+                tracked.future.set_exception(error)
+            else:
+                tracked.future.set_result(file)
+        if tracked.callback is not None and file is not None:
+            tracked.callback(file)
+
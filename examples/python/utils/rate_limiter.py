@@ -0,0 +1,257 @@
+"""
+自適應並發控制（AIMD）
+
+依照伺服器的實際回應調整同時進行的請求數：
+- 回應健康時每完成約 limit 個請求就把上限加 1（additive increase）
+- 遇到 429 / 5xx / 連線錯誤，或延遲明顯高於基準時把上限乘以 decrease_factor（multiplicative decrease）
+- 有 Retry-After 時，在指定時間內暫停發出新請求
+
+Usage:
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=32)
+    async with limiter.slot():
+        await helper.delete_knowledge_file(knowledge_base_id, file_id)
+
+    threaded_limiter = ThreadedAdaptiveConcurrencyLimiter(initial_limit=4, max_limit=16)
+    with threaded_limiter.slot():
+        helper.delete_knowledge_file(knowledge_base_id, file_id)
+
+slot 內拋出的 HTTP 例外（aiohttp.ClientResponseError、requests.HTTPError）會自動判讀狀態碼與 Retry-After；
+沒有拋例外但拿到錯誤回應時，可以呼叫 slot.record(status, retry_after) 手動回報。
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+# 批次請求因為其中某些項目（驗證錯誤、衝突）而失敗的狀態碼：拆開重送可以找出有問題的項目
+ITEM_ERROR_STATUSES = {400, 409, 422}
+
+# 沒有 HTTP 狀態碼、但代表伺服器或網路壅塞的例外
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    TimeoutError,
+    ConnectionError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒數或 HTTP 日期），回傳秒數；無法解析時回傳 None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_exception(exc):
+    """從例外取出 (status, retry_after, transient)"""
+    response = getattr(exc, 'response', None)
+    if isinstance(exc, aiohttp.ClientResponseError):
+        headers = exc.headers or {}
+        return exc.status, parse_retry_after(headers.get('Retry-After')), False
+    if isinstance(exc, requests.HTTPError) and response is not None:
+        return response.status_code, parse_retry_after(response.headers.get('Retry-After')), False
+    return None, None, isinstance(exc, TRANSIENT_ERRORS)
+
+
+class _AdaptiveLimiterBase:
+    def __init__(
+        self,
+        initial_limit=4,
+        min_limit=1,
+        max_limit=32,
+        decrease_factor=0.5,
+        latency_tolerance=None,
+    ):
+        """
+        Args:
+            initial_limit: 初始並發上限
+            min_limit: 並發上限的下限
+            max_limit: 並發上限的上限
+            decrease_factor: 遇到壅塞時上限乘上的比例
+            latency_tolerance: 延遲超過基準延遲幾倍時視為壅塞；None 表示不依延遲調整，
+                適合每次工作量差異很大的操作（例如不同大小的檔案上傳）
+        """
+        assert 1 <= min_limit <= initial_limit <= max_limit, 'Require 1 <= min_limit <= initial_limit <= max_limit'
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._successes = 0
+        self._baseline_latency = None
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+
+        # 統計資訊
+        self.total_requests = 0
+        self.total_overloads = 0
+
+    @property
+    def limit(self) -> int:
+        """目前的並發上限"""
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _has_capacity(self) -> bool:
+        return self._in_flight < self.limit
+
+    def _block_delay(self) -> float:
+        return self._blocked_until - time.monotonic()
+
+    def _on_release(self, latency, status=None, retry_after=None, transient=False):
+        """依據請求結果調整並發上限"""
+        self._in_flight -= 1
+        self.total_requests += 1
+        now = time.monotonic()
+
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+        overloaded = transient or status in OVERLOAD_STATUSES
+        healthy_status = status is None or status < 400
+        if not overloaded and healthy_status and self.latency_tolerance and self._baseline_latency:
+            overloaded = latency > self._baseline_latency * self.latency_tolerance
+
+        if overloaded:
+            self.total_overloads += 1
+            # 同一波壅塞通常會讓多個進行中的請求同時失敗，冷卻期間只降一次
+            cooldown = max(self._baseline_latency or 0.0, 1.0)
+            if now - self._last_decrease >= cooldown:
+                self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                self._last_decrease = now
+            self._successes = 0
+            return
+
+        if status is not None and status >= 400:
+            # 其他用戶端錯誤（400、404、409 等）與伺服器負載無關，不調整上限
+            return
+
+        if self._baseline_latency is None or latency < self._baseline_latency:
+            self._baseline_latency = latency
+        else:
+            # 基準延遲緩慢跟隨，避免一次偶然的快速回應讓基準永遠偏低
+            self._baseline_latency = self._baseline_latency * 0.95 + latency * 0.05
+
+        self._successes += 1
+        if self._successes >= self.limit:
+            self._limit = min(self.max_limit, self._limit + 1)
+            self._successes = 0
+
+
+class _Slot:
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._start = None
+        self._status = None
+        self._retry_after = None
+
+    def record(self, status, retry_after=None):
+        """手動回報回應狀態碼與 Retry-After（秒數或原始 header 值）"""
+        self._status = status
+        self._retry_after = parse_retry_after(retry_after) if isinstance(retry_after, str) else retry_after
+
+    def _outcome(self, exc):
+        if exc is not None:
+            status, retry_after, transient = classify_exception(exc)
+            return time.monotonic() - self._start, status, retry_after, transient
+        return time.monotonic() - self._start, self._status, self._retry_after, False
+
+
+class _AsyncSlot(_Slot):
+    async def __aenter__(self):
+        await self._limiter.acquire()
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self._limiter.release(*self._outcome(exc))
+
+
+class _ThreadedSlot(_Slot):
+    def __enter__(self):
+        self._limiter.acquire()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._limiter.release(*self._outcome(exc))
+
+
+class AdaptiveConcurrencyLimiter(_AdaptiveLimiterBase):
+    """asyncio 版本的自適應並發控制"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = asyncio.Condition()
+
+    def slot(self) -> _AsyncSlot:
+        return _AsyncSlot(self)
+
+    async def acquire(self):
+        while True:
+            delay = self._block_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            async with self._condition:
+                if self._has_capacity() and self._block_delay() <= 0:
+                    self._in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def release(self, latency, status=None, retry_after=None, transient=False):
+        async with self._condition:
+            self._on_release(latency, status, retry_after, transient)
+            self._condition.notify_all()
+
+
+class ThreadedAdaptiveConcurrencyLimiter(_AdaptiveLimiterBase):
+    """多執行緒版本的自適應並發控制，搭配 ThreadPoolExecutor 使用"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def slot(self) -> _ThreadedSlot:
+        return _ThreadedSlot(self)
+
+    def acquire(self):
+        while True:
+            delay = self._block_delay()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+
+            with self._condition:
+                if self._has_capacity() and self._block_delay() <= 0:
+                    self._in_flight += 1
+                    return
+                self._condition.wait(timeout=max(0.05, self._block_delay()))
+
+    def release(self, latency, status=None, retry_after=None, transient=False):
+        with self._condition:
+            self._on_release(latency, status, retry_after, transient)
+            self._condition.notify_all()
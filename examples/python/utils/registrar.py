@@ -0,0 +1,232 @@
+"""
+知識庫檔案的批次註冊（micro-batching）
+
+`knowledge-bases/{id}/files/` 一次可以註冊多個檔案。KnowledgeFileRegistrar 收集上傳完成的 S3 key，
+累積到 max_batch_size 個或等待超過 max_delay 秒時一次送出，再依 file key 把回傳的檔案對應回每個呼叫者。
+逾時、5xx 或回應缺少檔案時，伺服器可能已經建立了部分檔案：先從檔案清單（最多 RECOVERY_MAX_PAGES 頁）找回這些檔案，
+只有確定沒有建立的檔案才會失敗，避免呼叫者重試時重複註冊同一個 S3 key。
+400 / 409 / 422 時逐一重送找出有問題的檔案；401 / 403 / 404 等其他錯誤直接讓整個批次失敗。
+小檔案為主的資料集可以把註冊請求數降低一個數量級以上。
+
+Usage:
+    async with KnowledgeFileRegistrar(helper, knowledge_base_id) as registrar:
+        knowledge_file = await registrar.register(file_key, 'report.pdf')
+        print(knowledge_file['id'])
+"""
+import asyncio
+import time
+from typing import Optional
+
+import aiohttp
+
+from .file_listing import DESCENDING_ORDERING, DescendingPages
+from .rate_limiter import ITEM_ERROR_STATUSES, AdaptiveConcurrencyLimiter
+
+# 查詢結果不明確的批次時，讀取檔案清單的每頁檔案數與最多讀取的頁數
+RECOVERY_PAGE_SIZE = 100
+RECOVERY_MAX_PAGES = 5
+# 比對 createdAt 時容許的用戶端與伺服器時鐘誤差
+RECOVERY_CLOCK_SKEW_MS = 5 * 60 * 1000
+
+
+class KnowledgeFileRegistrar:
+    def __init__(
+        self,
+        helper,
+        knowledge_base_id: str,
+        max_batch_size: int = 50,
+        max_delay: float = 0.2,
+        limiter: AdaptiveConcurrencyLimiter = None,
+        max_concurrency: int = None,
+    ):
+        """
+        Args:
+            helper: AsyncMaiAgentHelper
+            knowledge_base_id: 知識庫 ID
+            max_batch_size: 每次請求最多註冊的檔案數
+            max_delay: 第一個檔案進入批次後，最多等待幾秒就送出
+            limiter: 送出批次時使用的並發控制器；None 表示不限制
+            max_concurrency: 同時進行的註冊請求數上限；None 表示不限制
+        """
+        self.helper = helper
+        self.knowledge_base_id = knowledge_base_id
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay
+        self.limiter = limiter
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.requests_sent = 0
+        self.files_registered = 0
+        self._pending = []
+        self._timer = None
+        self._in_flight = set()
+
+    async def register(self, file_key: str, filename: str) -> dict:
+        """加入下一個批次並等待註冊完成，回傳建立的知識庫檔案；批次失敗時拋出該例外"""
+        return await self.submit(file_key, filename)
+
+    def submit(self, file_key: str, filename: str) -> asyncio.Future:
+        """加入下一個批次但不等待，回傳註冊完成時的 future（結果與 register() 相同）"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({'file': file_key, 'filename': filename}, future))
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+        return future
+
+    def flush(self):
+        """立即送出目前累積的檔案"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def close(self):
+        """送出剩餘的檔案並等待所有批次完成"""
+        self.flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _post(self, files):
+        if self._semaphore is not None:
+            async with self._semaphore:
+                return await self._post_limited(files)
+        return await self._post_limited(files)
+
+    async def _post_limited(self, files):
+        self.requests_sent += 1
+        if self.limiter is None:
+            return await self.helper.register_knowledge_files(self.knowledge_base_id, files)
+        async with self.limiter.slot():
+            return await self.helper.register_knowledge_files(self.knowledge_base_id, files)
+
+    async def _send(self, batch):
+        sent_at = int(time.time() * 1000)
+        try:
+            created = await self._post([item for item, _ in batch])
+            if not isinstance(created, list):
+                raise RuntimeError(f"Expected a list of knowledge files in response, got {type(created).__name__}")
+        except aiohttp.ClientResponseError as e:
+            if len(batch) > 1 and e.status in ITEM_ERROR_STATUSES:
+                # 驗證錯誤會讓整個批次失敗：逐一重新送出，只有出問題的檔案會失敗
+                await asyncio.gather(*(self._send([entry]) for entry in batch))
+                return
+            if e.status == 408 or e.status >= 500:
+                # 逾時或 5xx 時伺服器可能已經建立檔案，先查詢清單再決定是否失敗
+                await self._recover(batch, e, sent_at)
+                return
+            # 401 / 403 / 404 / 429 等：伺服器沒有處理這個請求
+            self._fail(batch, e)
+            return
+        except asyncio.TimeoutError as e:
+            await self._recover(batch, e, sent_at)
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        unmatched = self._resolve_matches(batch, created)
+        if unmatched:
+            error = RuntimeError(
+                f"{len(unmatched)} of {len(batch)} files missing from the registration response"
+            )
+            await self._recover(unmatched, error, sent_at)
+
+    def _resolve_matches(self, batch, knowledge_files) -> list:
+        """依 file key（其次是檔名）把回傳的檔案對應回呼叫者，回傳沒有對應到的項目"""
+        unmatched = []
+        remaining = list(knowledge_files)
+        for item, future in batch:
+            index = _find_match(item, remaining)
+            if index is None:
+                unmatched.append((item, future))
+                continue
+            knowledge_file = remaining.pop(index)
+            self.files_registered += 1
+            if not future.done():
+                future.set_result(knowledge_file)
+        return unmatched
+
+    async def _recover(self, batch, error, sent_at):
+        """
+        結果不明確的批次：從檔案清單找出已經建立的檔案，只有確定沒有建立的檔案才以 error 失敗
+
+        直接讓呼叫者重試會把同一個 S3 key 再註冊一次，在知識庫中產生重複的檔案。
+        """
+        try:
+            found = await self._find_registered([item for item, _ in batch], sent_at)
+        except Exception:
+            # 無法確認時維持原本的錯誤
+            found = []
+        self._fail(self._resolve_matches(batch, found), error)
+
+    async def _list_page(self, page):
+        if self.limiter is None:
+            return await self.helper.list_knowledge_base_files(
+                self.knowledge_base_id, page=page, page_size=RECOVERY_PAGE_SIZE, ordering=DESCENDING_ORDERING
+            )
+        async with self.limiter.slot():
+            return await self.helper.list_knowledge_base_files(
+                self.knowledge_base_id, page=page, page_size=RECOVERY_PAGE_SIZE, ordering=DESCENDING_ORDERING
+            )
+
+    async def _find_registered(self, items, sent_at) -> list:
+        """
+        依 createdAt 由新到舊讀取清單，直到找到所有 file key 或讀到比這次請求更早的分頁
+
+        最多讀取 RECOVERY_MAX_PAGES 頁；伺服器忽略 ordering 時無法判斷，立即停止。
+        """
+        keys = {item['file'] for item in items}
+        since = sent_at - RECOVERY_CLOCK_SKEW_MS
+        found = []
+        pages = DescendingPages()
+        for page in range(1, RECOVERY_MAX_PAGES + 1):
+            if not keys:
+                break
+            data = await self._list_page(page)
+            results = data.get('results', []) if isinstance(data, dict) else (data or [])
+            for knowledge_file in results:
+                key = next((key for key in keys if _matches_key(knowledge_file.get('file'), key)), None)
+                if key is not None:
+                    keys.discard(key)
+                    found.append(knowledge_file)
+            if not pages.add(results) or pages.older_than(since):
+                break
+            if not isinstance(data, dict) or not data.get('next') or not results:
+                break
+        return found
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+
+def _matches_key(value, file_key: str) -> bool:
+    """回傳的 file 可能是 key 本身，也可能是包含 key 的 URL"""
+    if not value:
+        return False
+    return value == file_key or str(value).split('?', 1)[0].endswith('/' + file_key)
+
+
+def _find_match(item: dict, knowledge_files: list) -> Optional[int]:
+    for index, knowledge_file in enumerate(knowledge_files):
+        if _matches_key(knowledge_file.get('file'), item['file']):
+            return index
+    # 回應沒有 file 欄位時退回以檔名比對
+    for index, knowledge_file in enumerate(knowledge_files):
+        if not knowledge_file.get('file') and knowledge_file.get('filename') == item['filename']:
+            return index
+    return None
@@ -0,0 +1,286 @@
+"""
+增量式 Server-Sent Events 解碼器
+
+直接處理 `response.iter_content()` / `aiohttp` 讀到的位元組區塊：
+未完成的部分留在 bytearray 緩衝區，每次只切出完整的行，不會反覆串接字串；
+`data` 欄位以原始位元組交給 JSON 解碼器（json.loads 與 orjson 都接受 bytes），省去一次解碼。
+
+安裝 orjson 時 `iter_sse_json` 預設使用 orjson，否則使用標準函式庫的 json。
+
+Usage:
+    response = session.post(url, json=payload, stream=True)
+    for data in iter_sse_json(response.iter_content(chunk_size=None)):
+        print(data['content'], end='')
+
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            print(event.event, event.data)
+
+    async with AsyncJSONEventStream(aiohttp_response) as stream:
+        async for data in stream:
+            print(data['content'], end='')
+"""
+import json
+import logging
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson 為選用套件
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSONLoads = Callable[[Union[bytes, str]], Any]
+
+# orjson 解析 bytes 比標準函式庫快數倍；沒有安裝時退回 json.loads
+default_json_loads: JSONLoads = orjson.loads if orjson is not None else json.loads
+
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: Union[str, bytes]
+    id: Optional[str]
+    retry: Optional[int]
+
+
+class SSEDecoder:
+    """依照 SSE 規格把位元組區塊解碼成事件；一個 decoder 只處理一條串流"""
+
+    def __init__(self, decode_data: bool = True):
+        """
+        Args:
+            decode_data: True 時 event.data 為 str；False 時保留為 bytes，直接交給 JSON 解碼器
+        """
+        self.decode_data = decode_data
+        self.last_event_id: Optional[str] = None
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+        self._event = b''
+        self._retry: Optional[int] = None
+        # 串流出現 \r 之前以空行（\n\n）整段切出事件；之後改為逐行解析，支援 \r\n 與 \r 換行
+        self._line_mode = False
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """加入一個區塊，回傳其中完成的事件（可能為空）"""
+        buffer = self._buffer
+        # 之前的內容已確認沒有完整事件，只需要從新區塊（和前一個位元組）開始找
+        start = max(0, len(buffer) - 1)
+        buffer += chunk
+        if not self._line_mode:
+            if b'\r' in chunk:
+                self._line_mode = True
+            else:
+                end = buffer.rfind(b'\n\n', start)
+                if end < 0:
+                    return []
+                frames = bytes(buffer[:end]).split(b'\n\n')
+                del buffer[:end + 2]
+                return self._process_frames(frames)
+
+        end = max(buffer.rfind(b'\n'), buffer.rfind(b'\r')) + 1
+        if end == 0:
+            return []
+        if buffer[end - 1] == 0x0D and end == len(buffer):
+            # 結尾的 \r 可能是跨區塊 \r\n 的前半，等下一個區塊再處理
+            end -= 1
+            if end == 0:
+                return []
+
+        lines = bytes(buffer[:end]).splitlines()
+        del buffer[:end]
+        return self._process_lines(lines)
+
+    def close(self) -> List[SSEEvent]:
+        """
+        串流結束時呼叫，處理剩下的內容
+
+        規格會捨棄沒有以空行結束的事件；為了不遺失最後一個片段，這裡仍然送出（與 sseclient 的行為相同）。
+        """
+        lines = bytes(self._buffer).splitlines()
+        self._buffer.clear()
+        events = self._process_lines(lines)
+        if self._data:
+            events.append(self._dispatch())
+        self._event = b''
+        self._retry = None
+        return events
+
+    def _process_frames(self, frames: List[bytes]) -> List[SSEEvent]:
+        events = []
+        for frame in frames:
+            if frame[:6] == b'data: ' and b'\n' not in frame:
+                # 最常見的情況：只有一行 data 的事件
+                data = frame[6:]
+                events.append(SSEEvent(
+                    'message', data.decode('utf-8', 'replace') if self.decode_data else data, self.last_event_id, self._retry
+                ))
+            else:
+                frame_lines = frame.split(b'\n')
+                frame_lines.append(b'')
+                events.extend(self._process_lines(frame_lines))
+        return events
+
+    def _process_lines(self, lines: List[bytes]) -> List[SSEEvent]:
+        events = []
+        for line in lines:
+            if not line:
+                if self._data:
+                    events.append(self._dispatch())
+                else:
+                    self._event = b''
+                continue
+
+            if line.startswith(b'data:'):
+                value = line[5:]
+                self._data.append(value[1:] if value[:1] == b' ' else value)
+                continue
+            if line[:1] == b':':
+                # 註解（例如 keep-alive 用的 ": ping"）
+                continue
+
+            field, colon, value = line.partition(b':')
+            if colon and value[:1] == b' ':
+                value = value[1:]
+            if field == b'data':
+                self._data.append(value)
+            elif field == b'event':
+                self._event = value
+            elif field == b'id':
+                if b'\0' not in value:
+                    self.last_event_id = value.decode('utf-8', 'replace')
+            elif field == b'retry':
+                if value.isdigit():
+                    self._retry = int(value)
+        return events
+
+    def _dispatch(self) -> SSEEvent:
+        data = self._data[0] if len(self._data) == 1 else b'\n'.join(self._data)
+        event = SSEEvent(
+            event=self._event.decode('utf-8', 'replace') if self._event else 'message',
+            data=data.decode('utf-8', 'replace') if self.decode_data else data,
+            id=self.last_event_id,
+            retry=self._retry,
+        )
+        self._data = []
+        self._event = b''
+        return event
+
+
+def iter_sse_events(chunks: Iterable[bytes], decode_data: bool = True) -> Iterator[SSEEvent]:
+    """逐一產生位元組區塊中的 SSE 事件"""
+    decoder = SSEDecoder(decode_data=decode_data)
+    for chunk in chunks:
+        if chunk:
+            yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+def iter_sse_json(
+    chunks: Iterable[bytes],
+    json_loads: Optional[JSONLoads] = None,
+    on_error: Optional[Callable[[bytes, Exception], None]] = None,
+) -> Iterator[Any]:
+    """
+    逐一產生 SSE 事件 data 欄位解析後的 JSON
+
+    Args:
+        chunks: 位元組區塊
+        json_loads: JSON 解碼函式，預設為 default_json_loads（有 orjson 時使用 orjson）
+        on_error: data 無法解析時以 (原始 data, 例外) 呼叫；未指定時記錄 warning 並略過該事件
+    """
+    loads = json_loads or default_json_loads
+    for event in iter_sse_events(chunks, decode_data=False):
+        if not event.data:
+            continue
+        try:
+            yield loads(event.data)
+        except ValueError as e:  # json.JSONDecodeError 與 orjson.JSONDecodeError 都是 ValueError
+            if on_error is not None:
+                on_error(event.data, e)
+            else:
+                logger.warning('Skipping SSE event with invalid JSON: %r', event.data[:200])
+
+
+class AsyncJSONEventStream:
+    """
+    aiohttp 回應的 SSE JSON 事件串流（async iterator）
+
+    只在呼叫端要求下一個事件時才從 socket 讀取：呼叫端處理得慢時 aiohttp 的讀取緩衝區滿了就會暫停讀取，
+    TCP 視窗隨之縮小，伺服器端也會跟著放慢（backpressure），每條串流佔用的記憶體維持固定。
+
+    串流讀完時連線回到連線池；提前結束（break 後離開 async with、呼叫 aclose()、任務被取消）時立即關閉連線，
+    沒有使用 async with 的呼叫端在物件被回收時也會關閉連線。
+    """
+
+    def __init__(self, response, json_loads: Optional[JSONLoads] = None, on_error=None):
+        """
+        Args:
+            response: aiohttp.ClientResponse
+            json_loads: JSON 解碼函式，預設為 default_json_loads
+            on_error: data 無法解析時以 (原始 data, 例外) 呼叫；未指定時記錄 warning 並略過該事件
+        """
+        self.response = response
+        self.closed = False
+        self._loads = json_loads or default_json_loads
+        self._on_error = on_error
+        self._decoder = SSEDecoder(decode_data=False)
+        self._events = deque()
+        self._eof = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            while self._events:
+                data = self._events.popleft().data
+                if not data:
+                    continue
+                try:
+                    return self._loads(data)
+                except ValueError as e:
+                    if self._on_error is not None:
+                        self._on_error(data, e)
+                    else:
+                        logger.warning('Skipping SSE event with invalid JSON: %r', data[:200])
+
+            if self._eof or self.closed:
+                self.close()
+                raise StopAsyncIteration
+            try:
+                chunk = await self.response.content.readany()
+            except BaseException:
+                # 包含 CancelledError：任務被取消時立即釋放連線
+                self.close()
+                raise
+            if chunk:
+                self._events.extend(self._decoder.feed(chunk))
+            else:
+                self._eof = True
+                self._events.extend(self._decoder.close())
+
+    def close(self):
+        """關閉串流；已讀完時連線回到連線池，否則直接關閉連線"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._eof:
+            self.response.release()
+        else:
+            self.response.close()
+
+    async def aclose(self):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.response.close()